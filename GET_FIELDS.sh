@@ -1,4 +1,6 @@
 #!/bin/bash
 
 mkdir -p lib/static/json
-curl -o lib/static/json/fields.json https://issues.redhat.com/rest/api/2/field/
+# write next to the file and rename, running apps reload it on the new mtime
+curl -o lib/static/json/fields.json.tmp https://issues.redhat.com/rest/api/2/field/ && \
+    mv lib/static/json/fields.json.tmp lib/static/json/fields.json
@@ -0,0 +1,4 @@
+#!/bin/bash
+
+source .venv/bin/activate
+uvicorn --app-dir lib asgiapp:app --host 0.0.0.0 --port 5001 --workers ${WORKERS:-2}
@@ -0,0 +1,4 @@
+#!/bin/bash
+
+source .venv/bin/activate
+gunicorn -c gunicorn.conf.py 'flaskapp:create_app()'
@@ -0,0 +1,30 @@
+# gunicorn settings for the flask app
+#
+#   gunicorn -c gunicorn.conf.py 'flaskapp:create_app()'
+#
+# WEB_CONCURRENCY sets the worker count, see the README for sizing.
+
+import multiprocessing
+import os
+
+
+pythonpath = 'lib'
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('WEB_THREADS', 1))
+
+# the burndown and tree reports can take a while on big projects
+timeout = int(os.environ.get('WEB_TIMEOUT', 120))
+graceful_timeout = 30
+
+# load the app (and fields.json) once in the master and fork the workers
+preload_app = True
+
+accesslog = '-'
+
+
+def post_fork(server, worker):
+    # every worker needs its own database connections
+    from database import JiraDatabaseWrapper
+    JiraDatabaseWrapper.reset_pool()
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+
+"""
+api_queries.py - sql builders and row formatters shared by the read-only
+/api endpoints of the flask app and the asgi app.
+"""
+
+import base64
+import datetime
+import json
+
+
+TICKET_COLUMNS = [
+    'key',
+    'created',
+    'updated',
+    'created_by',
+    'assigned_to',
+    'type',
+    'priority',
+    'state',
+    'labels',
+    'components',
+    'sfdc_count',
+    'fix_versions',
+    'summary'
+]
+
+TICKET_PARENTS_COLUMNS = ['key', 'type', 'epic_link', 'feature_link', 'parent_link']
+
+# endpoint name -> (facet count view, value column)
+FACET_COUNT_VIEWS = {
+    'labels': ('issue_label_counts', 'label'),
+    'components': ('issue_component_counts', 'component'),
+    'fix_versions': ('issue_fix_version_counts', 'fix_version'),
+}
+
+
+# DataTables server-side processing (and keyset paging) for /api/tickets
+PAGE_LENGTH = 50
+MAX_PAGE_LENGTH = 1000
+
+# sort columns with a (project, column, coalesce(id, key)) index, so a row
+# comparison with the tiebreak() can seek straight to the next page -> cast
+# for the cursor value.
+# Issues stored as invalid have no created or updated, those rows sort last
+# in either direction, see tickets_page_queries.
+KEYSET_COLUMNS = {
+    'key': '',
+    'created': '::timestamp',
+    'updated': '::timestamp',
+}
+
+# matched by the DataTables search box
+SEARCH_COLUMNS = ['key', 'summary', 'created_by', 'assigned_to', 'type', 'state']
+
+PAGING_ARGS = ['draw', 'start', 'length', 'after', 'query', 'limit', '_']
+PAGING_ARG_PREFIXES = ('columns[', 'order[', 'search[')
+
+
+def is_paged_request(args):
+    return 'draw' in args or 'after' in args or 'length' in args
+
+
+def filter_args(args):
+    """Drop the paging arguments, the rest become query filters."""
+    return dict(
+        (k, v) for k, v in dict(args).items()
+        if k not in PAGING_ARGS and not k.startswith(PAGING_ARG_PREFIXES)
+    )
+
+
+def encode_cursor(value, issue_id):
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, issue_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('utf-8')
+
+
+def decode_cursor(cursor):
+    value, issue_id = json.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')))
+    return value, issue_id
+
+
+def _int_arg(args, key, default):
+    try:
+        return int(args.get(key, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def datatables_order(args):
+    """The (column, direction) to sort on from DataTables' order[0] args."""
+
+    column = 'created'
+    direction = 'desc'
+
+    idx = args.get('order[0][column]')
+    if idx is not None:
+        name = args.get(f'columns[{idx}][data]')
+        if name in TICKET_COLUMNS:
+            column = name
+    if args.get('order[0][dir]') in ['asc', 'desc']:
+        direction = args.get('order[0][dir]')
+
+    return column, direction
+
+
+def page_window(args):
+    """The (start, length) of the requested page."""
+    start = max(_int_arg(args, 'start', 0), 0)
+    length = _int_arg(args, 'length', PAGE_LENGTH)
+    if length < 1 or length > MAX_PAGE_LENGTH:
+        length = MAX_PAGE_LENGTH
+    return start, length
+
+
+def tiebreak(alias):
+    """The expression that orders page rows with the same sort value.
+
+    Placeholder issues stored as invalid have no id, their key stands in.
+    """
+    return f'coalesce({alias}.id, {alias}.key)'
+
+
+def row_tiebreak(row):
+    """The tiebreak() value of a result row."""
+    return row['key'] if row['id'] is None else row['id']
+
+
+def tickets_page_queries(base_sql, args, base_params=None):
+    """Build the count and page queries for one page of /api/tickets.
+
+    base_sql and base_params are the unpaged query_compile output and have
+    to select id and key. The page follows the ``after`` cursor when it is
+    given and the sort column allows it, otherwise it falls back to OFFSET.
+    """
+
+    base_params = list(base_params or [])
+
+    column, direction = datatables_order(args)
+    start, length = page_window(args)
+
+    queries = {
+        'total': (f'SELECT count(*) FROM ({base_sql}) t', base_params[:]),
+    }
+
+    where = []
+    params = base_params[:]
+
+    search = (args.get('search[value]') or '').strip()
+    if search:
+        pattern = '%' + search.replace('%', r'\%').replace('_', r'\_') + '%'
+        where.append('(' + ' OR '.join(f't.{x} ILIKE %s' for x in SEARCH_COLUMNS) + ')')
+        params.extend([pattern] * len(SEARCH_COLUMNS))
+        queries['filtered'] = (
+            f'SELECT count(*) FROM ({base_sql}) t WHERE ' + ' AND '.join(where),
+            params[:]
+        )
+
+    if column not in KEYSET_COLUMNS:
+        sql = f'SELECT * FROM ({base_sql}) t'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += f' ORDER BY t.{column} {direction} NULLS LAST, {tiebreak("t")} {direction}'
+        sql += ' LIMIT %s OFFSET %s'
+        params.extend([length, start])
+        queries['page'] = (sql, params)
+        return queries
+
+    # NULLS LAST in both directions can not come from one index scan, so the
+    # rows with and without a value are read as two index ordered branches
+    # of at most offset + length rows each, and merged.
+    operator = '<' if direction == 'desc' else '>'
+    valued = where + [f't.{column} IS NOT NULL']
+    valued_params = params[:]
+    nulls = where + [f't.{column} IS NULL']
+    nulls_params = params[:]
+
+    offset = start
+    if args.get('after'):
+        value, issue_id = decode_cursor(args.get('after'))
+        offset = 0
+        if value is None:
+            # past every valued row already
+            valued.append('false')
+            nulls.append(f'{tiebreak("t")} {operator} %s')
+            nulls_params.append(issue_id)
+        else:
+            cast = KEYSET_COLUMNS[column]
+            valued.append(f'(t.{column}, {tiebreak("t")}) {operator} (%s{cast}, %s)')
+            valued_params.extend([value, issue_id])
+
+    sql = (
+        f'SELECT * FROM ('
+        f'(SELECT * FROM ({base_sql}) t WHERE ' + ' AND '.join(valued)
+        + f' ORDER BY t.{column} {direction}, {tiebreak("t")} {direction} LIMIT %s)'
+        ' UNION ALL '
+        f'(SELECT * FROM ({base_sql}) t WHERE ' + ' AND '.join(nulls)
+        + f' ORDER BY {tiebreak("t")} {direction} LIMIT %s)'
+        f') p ORDER BY p.{column} {direction} NULLS LAST, {tiebreak("p")} {direction}'
+        ' LIMIT %s OFFSET %s'
+    )
+    params = valued_params + [offset + length] + nulls_params + [offset + length, length, offset]
+    queries['page'] = (sql, params)
+
+    return queries
+
+
+def tickets_page_response(args, total, filtered, rows):
+    """Format a page of raw rows the way DataTables expects it.
+
+    ``next`` is the cursor to pass as ``after`` for the following page, it
+    is only set when the sort column supports keyset paging.
+    """
+
+    column, direction = datatables_order(args)
+    # the length the page query ran with
+    start, length = page_window(args)
+
+    next_cursor = None
+    if rows and len(rows) >= length and column in KEYSET_COLUMNS:
+        next_cursor = encode_cursor(rows[-1][column], row_tiebreak(rows[-1]))
+
+    data = []
+    for row in rows:
+        row = dict(row)
+        row.pop('id', None)
+        data.append(format_ticket_row(row))
+
+    return {
+        'draw': _int_arg(args, 'draw', 0),
+        'recordsTotal': total,
+        'recordsFiltered': total if filtered is None else filtered,
+        'data': data,
+        'next': next_cursor,
+    }
+
+
+def jql_quote(value):
+    """Quote a value for use in a jql query."""
+    value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{value}"'
+
+
+def tickets_query_from_args(args):
+    """Turn the /api/tickets GET arguments into a jql query."""
+
+    kwargs = dict(args)
+
+    if 'project' not in kwargs and not kwargs:
+        kwargs['project'] = 'AAH'
+
+    qs = ""
+    for key, val in kwargs.items():
+        if key == 'component':
+            key = 'components'
+        val = jql_quote(val)
+        if not qs:
+            qs += f"{key}={val}"
+        else:
+            qs += f" AND {key}={val}"
+    # if not qs and not "project" in request.args:
+    #    qs += " project=AAH"
+    if "state" not in kwargs and "status" not in kwargs:
+        if not qs:
+            qs += "status!=Closed"
+        else:
+            qs += " AND status!=Closed"
+
+    return qs
+
+
+def format_ticket_row(row):
+    ds = {}
+    for colname, value in row.items():
+
+        ds[colname] = value
+        if colname in ['created', 'updated']:
+            if value is not None:
+                ds[colname] = value.isoformat().split('.')[0]
+        elif colname == 'sfdc_count':
+            if value is not None:
+                ds[colname] = int(value)
+        elif colname == 'labels':
+            labels = value or []
+            labels = [x for x in labels if 'JIRALERT' not in x]
+            ds[colname] = labels
+        elif colname in ['components', 'fix_versions']:
+            ds[colname] = value or []
+
+    return ds
+
+
+def ticket_parents_query(args):
+    sql = f"SELECT {','.join(TICKET_PARENTS_COLUMNS)} from jira_issues"
+    params = []
+    if args.get('project'):
+        sql += " WHERE project=%s"
+        params.append(args.get('project'))
+    return sql, params
+
+
+def facet_counts_query(facet, args):
+    """Build the facet count query for labels, components or fix_versions."""
+
+    view, column = FACET_COUNT_VIEWS[facet]
+
+    clauses = {
+        'state': [('!=', 'Closed')]
+    }
+    if args.get('project'):
+        clauses['project'] = [('=', args.get('project'))]
+    if args.get('state'):
+        clauses['state'] = [('=', args.get('state'))]
+    if args.get('closed'):
+        clauses.pop('state')
+
+    sql = f"SELECT {column},SUM(issue_count)::integer count FROM {view}"
+
+    params = []
+    if clauses:
+        statements = []
+        for k, v in clauses.items():
+            for _v in v:
+                statements.append(f"{k}{_v[0]}%s")
+                params.append(_v[1])
+        sql += ' WHERE ' + ' AND '.join(statements)
+
+    sql += f" GROUP BY {column}"
+    sql += " ORDER BY count DESC"
+
+    return sql, params
@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+
+"""
+asgiapp.py - asgi entry point for the read-only /api endpoints.
+
+The sql backed endpoints run on psycopg's async pool, so many slow queries
+can be in flight on a single worker. The pandas heavy report endpoints are
+pushed to worker threads so they do not block the event loop.
+
+    uvicorn --app-dir lib asgiapp:app --host 0.0.0.0 --port 5001
+"""
+
+import asyncio
+import datetime
+import decimal
+import json
+import os
+import re
+import uuid
+
+import psycopg
+
+from urllib.parse import parse_qsl
+
+from logzero import logger
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import http_date
+from werkzeug.http import parse_etags
+
+from async_database import AsyncJiraDatabaseWrapper
+from database import HISTORY_COLUMN
+from database import JiraDatabaseWrapper
+from database import issues_by_keys_query
+from stats_wrapper import StatsWrapper
+from timeline import make_timeline
+from tree import make_tickets_tree
+from tree import make_child_tree
+from jql import JQLError
+from jql import query_cache_stats
+from jql import query_compile
+from jql import parse as jql_parse
+from api_queries import SEARCH_COLUMNS
+from api_queries import TICKET_COLUMNS
+from api_queries import datatables_order
+from api_queries import facet_counts_query
+from api_queries import filter_args
+from api_queries import format_ticket_row
+from api_queries import is_paged_request
+from api_queries import page_window
+from api_queries import ticket_parents_query
+from api_queries import tickets_page_queries
+from api_queries import tickets_page_response
+from api_queries import tickets_query_from_args
+from data_listener import LISTEN_ENABLED
+from data_listener import DataChangeListener
+from issue_snapshot import SNAPSHOT_ENABLED
+from issue_snapshot import IssueSnapshot
+from issue_snapshot import UnsupportedQuery
+from query_guard import STATEMENT_TIMEOUTS
+from query_guard import QueryRejected
+from query_guard import check_cost
+from query_guard import row_limit
+from response_cache import RESPONSE_CACHE_MB
+from response_cache import ResponseCache
+from response_cache import make_etag
+from response_cache import make_key
+
+
+# largest batch /api/tickets/batch will look up in one request
+BATCH_MAX_KEYS = int(os.environ.get('API_BATCH_MAX_KEYS', 500))
+
+adbw = AsyncJiraDatabaseWrapper()
+response_cache = ResponseCache(max_bytes=RESPONSE_CACHE_MB * 1024 * 1024)
+# the listener thread runs blocking psycopg, so it gets the sync wrapper
+data_listener = DataChangeListener(JiraDatabaseWrapper())
+
+
+def invalidate_reports(project, keys):
+    response_cache.invalidate(None if project is None else [project])
+
+
+data_listener.add_callback(invalidate_reports)
+
+issue_snapshot = IssueSnapshot(data_listener.jdbw) if SNAPSHOT_ENABLED else None
+if issue_snapshot is not None:
+    data_listener.add_callback(issue_snapshot.invalidate)
+
+
+async def snapshot_select(query, cols, **kwargs):
+    """Answer a jql query from the issue snapshot, None when it can not."""
+    if issue_snapshot is None:
+        return None
+    if LISTEN_ENABLED:
+        data_listener.ensure_started()
+    try:
+        # a stale snapshot refreshes with blocking psycopg
+        return await asyncio.to_thread(issue_snapshot.select, jql_parse(query), cols, **kwargs)
+    except UnsupportedQuery as e:
+        logger.debug(f'issue snapshot can not answer {query!r}: {e}')
+        return None
+
+
+class Redirect:
+    def __init__(self, location):
+        self.location = location
+
+
+class ApiError:
+    def __init__(self, status, message):
+        self.status = status
+        self.message = message
+
+
+class JsonResponse:
+    def __init__(self, data, headers):
+        self.data = data
+        self.headers = headers
+
+
+def _json_default(obj):
+    # same conversions as flask's jsonify
+    if isinstance(obj, (datetime.date, datetime.datetime)):
+        return http_date(obj)
+    if isinstance(obj, (decimal.Decimal, uuid.UUID)):
+        return str(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+async def projects(args):
+    rows = await adbw.fetch_dicts("SELECT DISTINCT(project) FROM jira_issues ORDER BY project")
+    return sorted(x['project'] for x in rows)
+
+
+async def cache_stats(args):
+    return {
+        'responses': response_cache.stats(),
+        'queries': query_cache_stats(),
+    }
+
+
+async def api_tickets_batch(args):
+    # the GET flavor of the flask app's /api/tickets/batch
+    keys = list(dict.fromkeys(args.getlist('key')))
+    if len(keys) > BATCH_MAX_KEYS:
+        return ApiError(400, f'at most {BATCH_MAX_KEYS} keys per request')
+    if not keys:
+        return {}
+    try:
+        sql, params = issues_by_keys_query(keys, cols=args.getlist('column') or None)
+    except ValueError as e:
+        return ApiError(400, str(e))
+    rows = await adbw.fetch_dicts(sql, params)
+    return dict((x['key'], x) for x in rows)
+
+
+async def api_ticket(args, issue_key):
+    sql = 'SELECT * FROM jira_issues WHERE key=%s'
+    if args.get('history') in ['true', 'True', '1']:
+        sql = f'SELECT *,{HISTORY_COLUMN} FROM jira_issues WHERE key=%s'
+    rows = await adbw.fetch_dicts(sql, (issue_key,))
+    if rows:
+        return rows[0]
+    return {'data': {'fields': {}}}
+
+
+async def tickets(args):
+    if is_paged_request(args):
+        return await tickets_page(args)
+    qs = tickets_query_from_args(filter_args(args))
+    limit = row_limit(args)
+    # one row past the limit tells whether the result was cut short
+    snapshot = await snapshot_select(qs, TICKET_COLUMNS[:], limit=limit + 1)
+    if snapshot is not None:
+        rows = snapshot[2]
+    else:
+        sql, params = query_compile(qs, cols=TICKET_COLUMNS[:], limit=limit + 1)
+        limit = check_cost(await adbw.explain(sql, params), limit)
+        sql, params = query_compile(qs, cols=TICKET_COLUMNS[:], limit=limit + 1)
+        rows = await adbw.fetch_dicts(sql, params, timeout_ms=STATEMENT_TIMEOUTS['tickets'])
+
+    headers = {'X-Row-Limit': str(limit)}
+    if len(rows) > limit:
+        headers['X-Result-Truncated'] = 'true'
+    return JsonResponse([format_ticket_row(x) for x in rows[:limit]], headers)
+
+
+async def tickets_page(args):
+    query = args.get('query') or tickets_query_from_args(filter_args(args))
+
+    column, direction = datatables_order(args)
+    start, length = page_window(args)
+    snapshot = await snapshot_select(
+        query,
+        TICKET_COLUMNS + ['id'],
+        order_by=[(column, direction, True), ('id', direction, False)],
+        search=(args.get('search[value]') or '').strip(),
+        search_columns=SEARCH_COLUMNS,
+        offset=start,
+        limit=length,
+    )
+    if snapshot is not None:
+        return tickets_page_response(args, *snapshot)
+
+    sql, params = query_compile(query, cols=TICKET_COLUMNS + ['id'])
+    queries = tickets_page_queries(sql, args, params)
+    check_cost(await adbw.explain(*queries['total']), length)
+    timeout_ms = STATEMENT_TIMEOUTS['tickets_page']
+
+    rows = await adbw.fetch_dicts(*queries['total'], timeout_ms=timeout_ms)
+    total = rows[0]['count']
+
+    filtered = None
+    if 'filtered' in queries:
+        rows = await adbw.fetch_dicts(*queries['filtered'], timeout_ms=timeout_ms)
+        filtered = rows[0]['count']
+
+    rows = await adbw.fetch_dicts(*queries['page'], timeout_ms=timeout_ms)
+    return tickets_page_response(args, total, filtered, rows)
+
+
+async def api_tickets_parents(args):
+    sql, params = ticket_parents_query(args)
+    return await adbw.fetch_dicts(sql, params)
+
+
+def facet_counts(facet):
+    async def handler(args):
+        sql, params = facet_counts_query(facet, args)
+        return await adbw.fetch_dicts(sql, params)
+    return handler
+
+
+async def tickets_tree(args):
+    return await asyncio.to_thread(
+        make_tickets_tree,
+        filter_key=args.get('key'),
+        filter_project=args.get('project'),
+        show_closed=args.get('closed') in ['true', 'True', '1'],
+        map_progress=args.get('progress') in ['true', 'True', '1'],
+    )
+
+
+async def ticket_child_tree(args, issue_key):
+    return await asyncio.to_thread(
+        make_child_tree,
+        filter_key=issue_key,
+        show_closed=True,
+        map_progress=True
+    )
+
+
+async def tickets_burndown(args):
+    data = await asyncio.to_thread(
+        StatsWrapper().burndown,
+        args.getlist('project'),
+        frequency=args.get('frequency', 'monthly'),
+        start=args.get('start'),
+        end=args.get('end'),
+        jql=args.get('jql'),
+    )
+    return json.loads(data)
+
+
+async def fixversion_burndown(args):
+    data = await asyncio.to_thread(
+        StatsWrapper().fix_versions_burndown,
+        projects=args.getlist('project'),
+        frequency=args.get('frequency', 'monthly'),
+        start=args.get('start'),
+        end=args.get('end'),
+        jql=args.get('jql'),
+        versions=args.getlist('version') or None
+    )
+    return json.loads(data)
+
+
+async def tickets_churn(args):
+    projects = args.getlist('project')
+    if not projects:
+        return Redirect('/api/tickets_churn/?project=AAH')
+    projects = [x for x in projects if x != 'null']
+    data = await asyncio.to_thread(
+        StatsWrapper().churn,
+        projects,
+        frequency='monthly',
+        fields=args.getlist('field'),
+        start=args.get('start'),
+        end=args.get('end')
+    )
+    return json.loads(data)
+
+
+async def api_tickets_timeline(args):
+    projects = args.getlist('project')
+    return await asyncio.to_thread(
+        make_timeline,
+        jql=args.get('jql'),
+        start=args.get('start'),
+        finish=args.get('end'),
+        filter_project=projects[0] if projects else None,
+        filter_type=args.get('type'),
+        filter_user=args.get('user'),
+        filter_assignee=args.get('assignee'),
+        filter_state=args.get('state'),
+    )
+
+
+ROUTES = [
+    (r'/api/cache_stats', cache_stats),
+    (r'/api/projects/?', projects),
+    (r'/api/tickets/?', tickets),
+    (r'/api/tickets/batch', api_tickets_batch),
+    (r'/api/tickets/(?P<issue_key>[^/]+)', api_ticket),
+    (r'/api/(tickets_parents|ticket_parents/)', api_tickets_parents),
+    (r'/api/labels/?', facet_counts('labels')),
+    (r'/api/components/?', facet_counts('components')),
+    (r'/api/fix_versions/?', facet_counts('fix_versions')),
+    (r'/api/tickets_tree/?', tickets_tree),
+    (r'/api/ticket_child_tree/(?P<issue_key>[^/]+)', ticket_child_tree),
+    (r'/api/tickets_burndown/?', tickets_burndown),
+    (r'/api/fixversion_burndown/?', fixversion_burndown),
+    (r'/api/tickets_churn/?', tickets_churn),
+    (r'/api/timeline/?', api_tickets_timeline),
+]
+ROUTES = [(re.compile('^' + x[0] + '$'), x[1]) for x in ROUTES]
+
+# report handlers served through the response cache -> project scoped or not
+CACHED_REPORTS = {
+    tickets_tree: False,
+    tickets_burndown: True,
+    fixversion_burndown: True,
+    tickets_churn: True,
+    api_tickets_timeline: True,
+}
+
+
+async def send_response(send, status, body, headers=None):
+    headers = headers or []
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-length', str(len(body)).encode('utf-8'))] + headers,
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_json(send, status, data, headers=None):
+    body = json.dumps(data, default=_json_default).encode('utf-8')
+    headers = [(k.lower().encode('utf-8'), v.encode('utf-8')) for k, v in (headers or {}).items()]
+    await send_response(send, status, body, [(b'content-type', b'application/json')] + headers)
+
+
+async def get_data_versions():
+    if LISTEN_ENABLED:
+        data_listener.ensure_started()
+        if data_listener.connected:
+            return data_listener.versions
+    return await adbw.get_data_versions()
+
+
+async def send_cached_report(scope, send, handler, args, match):
+    # same keys and etags as the flask app's cached_report
+    projects = None
+    if CACHED_REPORTS[handler] and not args.get('jql'):
+        projects = [x for x in args.getlist('project') if x not in ['', 'null']]
+        projects = projects or None
+
+    key = make_key(
+        scope['path'].rstrip('/'),
+        args,
+        await get_data_versions(),
+        projects=projects,
+        extra=datetime.date.today().isoformat()
+    )
+    etag = make_etag(key)
+    headers = [(b'etag', f'"{etag}"'.encode('utf-8')), (b'cache-control', b'no-cache')]
+
+    if_none_match = dict(scope['headers']).get(b'if-none-match')
+    if if_none_match and parse_etags(if_none_match.decode('latin-1')).contains(etag):
+        await send_response(send, 304, b'', headers)
+        return
+
+    entry = response_cache.get(key)
+    if entry is None:
+        data = await handler(args, **match.groupdict())
+        if isinstance(data, Redirect):
+            await send_response(send, 302, b'', [(b'location', data.location.encode('utf-8'))])
+            return
+        body = json.dumps(data, default=_json_default).encode('utf-8')
+        entry = response_cache.put(key, body, projects=projects)
+
+    await send_response(send, 200, entry.body, [(b'content-type', b'application/json')] + headers)
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+async def until_disconnect(receive, coro):
+    """Await coro, cancelling it if the client disconnects first.
+
+    psycopg cancels the running statement on the server when a task waiting
+    on it is cancelled, so an abandoned request stops costing the database.
+    """
+    task = asyncio.ensure_future(coro)
+
+    async def wait_for_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    watcher = asyncio.ensure_future(wait_for_disconnect())
+    try:
+        await asyncio.wait([task, watcher], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+    if not task.done():
+        task.cancel()
+        raise ClientDisconnected()
+    return task.result()
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await adbw.open_pool()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await asyncio.to_thread(data_listener.stop)
+            await adbw.close_pool()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+
+    if scope['type'] != 'http':
+        return
+
+    # servers without lifespan support
+    await adbw.open_pool()
+
+    path = scope['path']
+    for pattern, handler in ROUTES:
+        match = pattern.match(path)
+        if match:
+            break
+    else:
+        await send_json(send, 404, {'error': f'{path} not found'})
+        return
+
+    if scope['method'] not in ['GET', 'HEAD']:
+        await send_json(send, 405, {'error': f'{scope["method"]} not allowed'})
+        return
+
+    args = MultiDict(parse_qsl(scope['query_string'].decode('utf-8'), keep_blank_values=True))
+    logger.info(f'{scope["method"]} {path} {dict(args)}')
+
+    try:
+        if handler in CACHED_REPORTS and RESPONSE_CACHE_MB:
+            await until_disconnect(receive, send_cached_report(scope, send, handler, args, match))
+            return
+        data = await until_disconnect(receive, handler(args, **match.groupdict()))
+    except ClientDisconnected:
+        logger.info(f'{path} client went away, request canceled')
+        return
+    except (JQLError, QueryRejected) as e:
+        await send_json(send, getattr(e, 'status', 400), {'error': str(e)})
+        return
+    except psycopg.errors.QueryCanceled as e:
+        logger.warning(f'query canceled: {e}')
+        await send_json(send, 503, {'error': 'the query took too long and was canceled, narrow it down'})
+        return
+
+    if isinstance(data, Redirect):
+        await send_response(send, 302, b'', [(b'location', data.location.encode('utf-8'))])
+        return
+    if isinstance(data, ApiError):
+        await send_json(send, data.status, {'error': data.message})
+        return
+    if isinstance(data, JsonResponse):
+        await send_json(send, 200, data.data, data.headers)
+        return
+
+    await send_json(send, 200, data)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+"""
+async_database.py - asyncio flavor of JiraDatabaseWrapper for the asgi api.
+"""
+
+import asyncio
+
+from logzero import logger
+from psycopg import AsyncClientCursor
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+from database import JiraDatabaseWrapper
+from database import POOL_MAX_SIZE
+from database import POOL_MIN_SIZE
+from database import POOL_TIMEOUT
+
+
+class AsyncJiraDatabaseWrapper(JiraDatabaseWrapper):
+
+    # bound to the event loop that opened it, one per process
+    _async_pool = None
+    _async_pool_lock = None
+
+    async def open_pool(self):
+        cls = AsyncJiraDatabaseWrapper
+        if cls._async_pool_lock is None:
+            cls._async_pool_lock = asyncio.Lock()
+        async with cls._async_pool_lock:
+            if cls._async_pool is None:
+                logger.info(f'open async connection pool min:{POOL_MIN_SIZE} max:{POOL_MAX_SIZE}')
+                pool = AsyncConnectionPool(
+                    self.connstring,
+                    min_size=POOL_MIN_SIZE,
+                    max_size=POOL_MAX_SIZE,
+                    timeout=POOL_TIMEOUT,
+                    open=False,
+                )
+                await pool.open()
+                cls._async_pool = pool
+        return cls._async_pool
+
+    async def close_pool(self):
+        cls = AsyncJiraDatabaseWrapper
+        if cls._async_pool is not None:
+            await cls._async_pool.close()
+            cls._async_pool = None
+
+    def connection(self):
+        """Borrow a connection from the async pool.
+
+        Use as an async context manager after open_pool has been awaited.
+        """
+        return AsyncJiraDatabaseWrapper._async_pool.connection()
+
+    async def fetch_dicts(self, sql, params=None, timeout_ms=None):
+        # cancelling the awaiting task cancels the statement on the server
+        async with self.connection() as conn:
+            if timeout_ms:
+                await conn.execute("SELECT set_config('statement_timeout', %s, true)", (f'{int(timeout_ms)}ms',))
+            async with conn.cursor(row_factory=dict_row) as cur:
+                await cur.execute(sql, params)
+                return await cur.fetchall()
+
+    async def explain(self, sql, params=None, timeout_ms=None):
+        async with self.connection() as conn:
+            if timeout_ms:
+                await conn.execute("SELECT set_config('statement_timeout', %s, true)", (f'{int(timeout_ms)}ms',))
+            async with AsyncClientCursor(conn) as cur:
+                await cur.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+                row = await cur.fetchone()
+                return row[0]
+
+    async def get_data_versions(self):
+        rows = await self.fetch_dicts('SELECT project, version FROM jira_data_versions')
+        return dict((x['project'], x['version']) for x in rows)
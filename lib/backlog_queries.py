@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+"""
+backlog_queries.py - sql builders for the backlog flow behind the burndowns.
+
+Issues flow into a set of projects by being opened there or moved in with a
+key change, and out by being closed or moved out. The queries here count
+those events per period in postgres, so a burndown over several projects is
+one round trip returning
+
+    (period, opened, closed, moved_in, moved_out)
+
+rows, with period the start of the day, week or month the events fell in.
+
+The same counts are kept per project and day in the jira_backlog_daily
+rollup. Ingest recounts the days an issue or its events touch, so the
+project burndowns read a few rows per day instead of the whole history.
+"""
+
+import datetime
+
+
+# pandas frequency letter -> date_trunc unit. Postgres weeks start on monday,
+# like the pandas W periods the burndowns group by.
+FREQUENCY_UNITS = {
+    'D': 'day',
+    'W': 'week',
+    'M': 'month',
+}
+
+FLOW_COLUMNS = ['period', 'opened', 'closed', 'moved_in', 'moved_out']
+
+# a Key change moves an issue between projects, a rename within one does not
+MOVE_CONDITION = "field = 'Key' AND to_project <> from_project"
+
+
+def frequency_unit(frequency):
+    """The date_trunc unit for a frequency like 'M' or 'monthly'."""
+    unit = FREQUENCY_UNITS.get((frequency or '')[:1].upper())
+    if unit is None:
+        raise ValueError(f'unknown frequency {frequency!r}')
+    return unit
+
+
+def open_close_move_query(projects, frequency, start=None, end=None):
+    """Count the flow events of projects from jira_issue_events.
+
+    Status changes to New or Closed count for the project the issue is in.
+    A move, see MOVE_CONDITION, counts as moved_in for the project it lands
+    in, otherwise as moved_out for the project it left. The field,
+    from_project and to_project columns are generated and indexed on
+    jira_issue_events.
+    """
+    projects = list(projects)
+    qs = (
+        'SELECT date_trunc(%s, created) AS period,'
+        " count(*) FILTER (WHERE field = 'status' AND data->>'toString' = 'New') AS opened,"
+        " count(*) FILTER (WHERE field = 'status' AND data->>'toString' = 'Closed') AS closed,"
+        f' count(*) FILTER (WHERE {MOVE_CONDITION} AND to_project = ANY(%s)) AS moved_in,'
+        f' count(*) FILTER (WHERE {MOVE_CONDITION} AND from_project = ANY(%s) AND to_project <> ALL(%s)) AS moved_out'
+        ' FROM jira_issue_events'
+        " WHERE ((field = 'status' AND project = ANY(%s) AND data->>'toString' IN ('New', 'Closed'))"
+        " OR (field = 'Key' AND (to_project = ANY(%s) OR from_project = ANY(%s))))"
+    )
+    qargs = [frequency_unit(frequency), projects, projects, projects, projects, projects, projects]
+
+    # bound the scan so the events partitions can be pruned
+    if start:
+        qs += ' AND created >= %s'
+        qargs.append(start)
+    if end:
+        qs += ' AND created <= %s'
+        qargs.append(end)
+
+    qs += ' GROUP BY 1 ORDER BY 1'
+    return qs, qargs
+
+
+def open_close_query(issues_sql, issues_params, frequency):
+    """Count opened and closed issues per period for a compiled jql query.
+
+    issues_sql has to select created, updated and state. An issue opens when
+    created and, if Closed, closes when last updated. Nothing moves.
+    """
+    unit = frequency_unit(frequency)
+    qs = (
+        f'WITH issues AS ({issues_sql})'
+        ' SELECT period, sum(opened) AS opened, sum(closed) AS closed,'
+        ' 0 AS moved_in, 0 AS moved_out'
+        ' FROM ('
+        'SELECT date_trunc(%s, created) AS period, 1 AS opened, 0 AS closed'
+        ' FROM issues WHERE created IS NOT NULL'
+        ' UNION ALL'
+        ' SELECT date_trunc(%s, updated), 0, 1'
+        " FROM issues WHERE state = 'Closed' AND updated IS NOT NULL"
+        ') AS flow'
+        ' GROUP BY period ORDER BY period'
+    )
+    return qs, list(issues_params) + [unit, unit]
+
+
+# The per project, per day counts kept in jira_backlog_daily. backlog is the
+# running sum of created - resolved and is maintained separately, see
+# backlog_running_total_query.
+ROLLUP_COUNTS = ['opened', 'closed', 'moved_in', 'moved_out', 'created', 'resolved']
+
+#   (count, project column, timestamp, table, condition)
+ROLLUP_SOURCES = [
+    ('opened', 'project', 'created', 'jira_issue_events', "field = 'status' AND data->>'toString' = 'New'"),
+    ('closed', 'project', 'created', 'jira_issue_events', "field = 'status' AND data->>'toString' = 'Closed'"),
+    ('moved_in', 'to_project', 'created', 'jira_issue_events', MOVE_CONDITION),
+    ('moved_out', 'from_project', 'created', 'jira_issue_events', MOVE_CONDITION),
+    ('created', 'project', 'created', 'jira_issues', 'updated IS NOT NULL'),
+    ('resolved', 'project', 'coalesce(closed, updated)', 'jira_issues', "state = 'Closed' AND created IS NOT NULL"),
+]
+
+
+def backlog_rollup_query(projects=None, days=None):
+    """Upsert the jira_backlog_daily counts of projects on days.
+
+    None means every project or every day. The rows of days that no longer
+    have any events are not removed, delete them first.
+    """
+    selects = []
+    qargs = []
+    for count, project_column, timestamp, table, condition in ROLLUP_SOURCES:
+        values = ', '.join('1' if x == count else '0' for x in ROLLUP_COUNTS)
+        qs = (
+            f'SELECT {project_column} AS project, ({timestamp})::date AS day, {values}'
+            f' FROM {table} WHERE {condition} AND {timestamp} IS NOT NULL'
+        )
+        if projects is not None:
+            qs += f' AND {project_column} = ANY(%s)'
+            qargs.append(list(projects))
+        if days is not None:
+            # the range lets postgres use the indexes and prune partitions
+            days = sorted(days)
+            qs += f' AND {timestamp} >= %s AND {timestamp} < %s AND ({timestamp})::date = ANY(%s)'
+            qargs.extend([days[0], days[-1] + datetime.timedelta(days=1), days])
+        selects.append(qs)
+
+    qs = (
+        f"INSERT INTO jira_backlog_daily (project, day, {', '.join(ROLLUP_COUNTS)})"
+        f" SELECT project, day, {', '.join(f'sum({x})' for x in ROLLUP_COUNTS)}"
+        f" FROM ({' UNION ALL '.join(selects)}) AS flow"
+        ' GROUP BY project, day'
+        ' ON CONFLICT (project, day) DO UPDATE SET '
+        + ', '.join(f'{x} = EXCLUDED.{x}' for x in ROLLUP_COUNTS)
+    )
+    return qs, qargs
+
+
+def backlog_running_total_query(projects=None, since=None):
+    """Recompute the backlog column of projects from day since onwards."""
+    where = []
+    qargs = []
+    if projects is not None:
+        where.append('project = ANY(%s)')
+        qargs.append(list(projects))
+    qs = (
+        'UPDATE jira_backlog_daily AS rollup SET backlog = totals.backlog'
+        ' FROM (SELECT project, day,'
+        ' sum(created - resolved) OVER (PARTITION BY project ORDER BY day) AS backlog'
+        ' FROM jira_backlog_daily'
+    )
+    if where:
+        qs += ' WHERE ' + ' AND '.join(where)
+    qs += (
+        ') AS totals'
+        ' WHERE rollup.project = totals.project AND rollup.day = totals.day'
+        ' AND rollup.backlog IS DISTINCT FROM totals.backlog'
+    )
+    if since is not None:
+        qs += ' AND rollup.day >= %s'
+        qargs.append(since)
+    return qs, qargs
+
+
+def backlog_rollup_read_query(projects, end=None):
+    """The jira_backlog_daily rows of projects up to and including day end."""
+    qs = (
+        f"SELECT project, day, {', '.join(ROLLUP_COUNTS)}, backlog"
+        ' FROM jira_backlog_daily WHERE project = ANY(%s)'
+    )
+    qargs = [list(projects)]
+    if end is not None:
+        qs += ' AND day <= %s'
+        qargs.append(end)
+    qs += ' ORDER BY day'
+    return qs, qargs
+
+
+def issue_backlog_days(issue):
+    """The days an issue row is counted on in jira_backlog_daily.
+
+    issue is a dict with created, updated, closed and state, as stored or
+    about to be stored in jira_issues. Returns a set of dates.
+    """
+    days = set()
+    if not issue or issue.get('created') is None or issue.get('updated') is None:
+        return days
+    days.add(as_day(issue['created']))
+    if issue.get('state') == 'Closed':
+        days.add(as_day(issue.get('closed') or issue['updated']))
+    return days
+
+
+def as_day(value):
+    """The date of a datetime, or of a jira timestamp like 2023-03-28T16:09:38.233+0000.
+
+    Postgres drops the offset when such a string goes into a TIMESTAMP
+    column, so the date is its first ten characters.
+    """
+    if isinstance(value, str):
+        return datetime.date.fromisoformat(value[:10])
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return value
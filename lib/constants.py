@@ -35,6 +35,5 @@ ISSUE_COLUMN_NAMES = [
     "state",
     "priority",
     "data",
-    "history"
 ]
 
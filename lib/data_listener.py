@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+"""
+data_listener.py - follow the ingest path's change notifications in an api worker.
+
+The scraper NOTIFYs on DATA_CHANGED_CHANNEL whenever it bumps a project's data
+version. A DataChangeListener keeps a LISTEN connection open on a daemon
+thread, tracks the latest versions from those payloads and runs the
+registered invalidation callbacks with the affected project and keys.
+
+Notifications sent while the listener is disconnected are lost, so after
+every (re)connect the versions are reloaded from jira_data_versions and the
+callbacks are run with project=None, meaning everything may have changed.
+"""
+
+import json
+import os
+import threading
+
+import psycopg
+
+from logzero import logger
+
+from database import DATA_CHANGED_CHANNEL
+
+
+# set to 0 to have the api look the versions up per request instead
+LISTEN_ENABLED = os.environ.get('API_LISTEN_NOTIFY', '1') not in ['0', 'false', 'False']
+LISTEN_TIMEOUT = 5.0
+RECONNECT_DELAY = 5.0
+
+
+class DataChangeListener:
+
+    def __init__(self, jdbw, channel=DATA_CHANGED_CHANNEL):
+        self.jdbw = jdbw
+        self.channel = channel
+        self.versions = {}
+        self.connected = False
+        self.pid = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_callback(self, callback):
+        """Register callback(project, keys), project is None for everything."""
+        self._callbacks.append(callback)
+
+    def ensure_started(self):
+        """Start the thread once per process, forked workers start their own."""
+        if self.pid == os.getpid():
+            return
+        with self._lock:
+            if self.pid != os.getpid():
+                self.start()
+
+    def start(self):
+        self.pid = os.getpid()
+        self.connected = False
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='data-change-listener', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=LISTEN_TIMEOUT + 1)
+        self.connected = False
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with psycopg.connect(self.jdbw.connstring, autocommit=True) as conn:
+                    conn.execute(f'LISTEN {self.channel}')
+                    self._resync()
+                    logger.info(f'listening on {self.channel}')
+                    while not self._stop.is_set():
+                        for notify in conn.notifies(timeout=LISTEN_TIMEOUT):
+                            self.dispatch(notify.payload)
+            except Exception as e:
+                logger.warning(f'{self.channel} listener failed, retrying in {RECONNECT_DELAY}s: {e}')
+            self.connected = False
+            self._stop.wait(RECONNECT_DELAY)
+
+    def _resync(self):
+        self.versions = self.jdbw.get_data_versions()
+        self.connected = True
+        self._run_callbacks(None, [])
+
+    def dispatch(self, payload):
+        ds = json.loads(payload)
+        project = ds['project']
+
+        # record the version before invalidating, a request racing with the
+        # callbacks then keys its result on the new version
+        if ds['version'] > self.versions.get(project, 0):
+            self.versions = dict(self.versions, **{project: ds['version']})
+
+        self._run_callbacks(project, ds.get('keys', []))
+
+    def _run_callbacks(self, project, keys):
+        for callback in self._callbacks:
+            try:
+                callback(project, keys)
+            except Exception as e:
+                logger.exception(e)
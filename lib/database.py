@@ -9,9 +9,16 @@ import json
 import docker
 import os
 import psycopg
+import threading
 import time
+import uuid
 
 from logzero import logger
+from psycopg_pool import ConnectionPool
+
+from backlog_queries import backlog_rollup_query
+from backlog_queries import backlog_running_total_query
+from constants import ISSUE_COLUMN_NAMES
 
 
 DOWNLOAD_LOG_SCHEMA = '''
@@ -56,11 +63,25 @@ CREATE TABLE jira_issues (
   state VARCHAR(50),
   priority VARCHAR(50),
   data JSONB,
-  history JSONB,
   CONSTRAINT unique_issueid UNIQUE (id)
 );
 '''
 
+# The changelog lives outside of jira_issues so the hot table stays narrow.
+# Callers that need it select HISTORY_COLUMN or join on issue_id.
+ISSUE_HISTORY_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jira_issue_histories (
+  issue_id VARCHAR(50),
+  history JSONB,
+  CONSTRAINT unique_history_issueid UNIQUE (issue_id)
+);
+'''
+
+HISTORY_COLUMN = (
+    '(SELECT history FROM jira_issue_histories'
+    ' WHERE jira_issue_histories.issue_id = jira_issues.id) AS history'
+)
+
 ISSUE_RELATIONSHIP_SCHEMA = '''
 CREATE TABLE jira_issue_relationships (
   parent VARCHAR(50),
@@ -69,6 +90,9 @@ CREATE TABLE jira_issue_relationships (
 );
 '''
 
+# Range partitioned by month on created so date bounded stats queries only
+# read the partitions they need. A unique constraint on a partitioned table
+# has to include the partition key, hence (id, created).
 ISSUE_EVENT_SCHEMA = '''
 CREATE TABLE jira_issue_events (
   id VARCHAR(50),
@@ -78,10 +102,25 @@ CREATE TABLE jira_issue_events (
   key VARCHAR(50),
   created TIMESTAMP,
   data JSONB,
-  CONSTRAINT unique_eventid UNIQUE (id)
-);
+  CONSTRAINT unique_eventid UNIQUE (id, created)
+) PARTITION BY RANGE (created);
 '''
 
+ISSUE_EVENT_PARTITION_NAME = 'jira_issue_events_y{year:04d}m{month:02d}'
+
+ISSUE_EVENT_PARTITION_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS {name} PARTITION OF jira_issue_events
+FOR VALUES FROM ('{start}') TO ('{end}')
+'''
+
+# events without a created timestamp fall outside every monthly range
+ISSUE_EVENT_DEFAULT_PARTITION_NAME = 'jira_issue_events_default'
+
+ISSUE_EVENT_DEFAULT_PARTITION_SCHEMA = (
+    f'CREATE TABLE IF NOT EXISTS {ISSUE_EVENT_DEFAULT_PARTITION_NAME}'
+    ' PARTITION OF jira_issue_events DEFAULT'
+)
+
 ISSUE_INSERT_QUERY = """
     INSERT INTO jira_issues (
         datafile,
@@ -101,16 +140,297 @@ ISSUE_INSERT_QUERY = """
         closed,
         state,
         priority,
-        data,
-        history
+        data
     )
     VALUES (
-        %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
+        %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
     );
 """
 
+# Sizing for the process wide connection pool that the api, stats, tree,
+# timeline and linter modules borrow from.
+POOL_MIN_SIZE = int(os.environ.get('POSTGRES_POOL_MIN_SIZE', 1))
+POOL_MAX_SIZE = int(os.environ.get('POSTGRES_POOL_MAX_SIZE', 10))
+POOL_TIMEOUT = float(os.environ.get('POSTGRES_POOL_TIMEOUT', 30))
+
+# Rows pulled per round trip by the streaming server-side cursors.
+FETCH_SIZE = int(os.environ.get('POSTGRES_FETCH_SIZE', 2000))
+
 PARENT_FIELDS = ['customfield_12313140', 'customfield_12318341.key']
 
+# Hot JSON paths promoted to typed columns on jira_issues. They are kept in
+# sync with the data blob by postgres so the listing and tree queries never
+# have to detoast and parse the full document per row.
+ISSUE_GENERATED_COLUMNS = [
+    ('labels', 'JSONB', "data->'fields'->'labels'"),
+    ('components', 'JSONB', "jsonb_path_query_array(data->'fields'->'components', '$[*].name')"),
+    ('fix_versions', 'JSONB', "jsonb_path_query_array(data->'fields'->'fixVersions', '$[*].name')"),
+    # anything but a plain number is left in the blob, a failing cast would
+    # fail the whole issue upsert
+    ('sfdc_count', 'NUMERIC', (
+        "CASE WHEN data->'fields'->>'customfield_12313440'"
+        " ~ '^[-+]?([0-9]+[.]?[0-9]*|[.][0-9]+)([eE][-+]?[0-9]{1,3})?$'"
+        " THEN (data->'fields'->>'customfield_12313440')::numeric END"
+    )),
+    ('parent', 'TEXT', "data->'fields'->'parent'->>'key'"),
+    ('parent_link', 'TEXT', "data->'fields'->>'customfield_12313140'"),
+    ('feature_link', 'TEXT', "data->'fields'->'customfield_12318341'->>'key'"),
+    ('epic_link', 'TEXT', "data->'fields'->>'customfield_12311140'"),
+]
+
+ISSUE_GENERATED_COLUMNS_MIGRATION = [
+    (
+        f'ALTER TABLE jira_issues ADD COLUMN IF NOT EXISTS {colname} {coltype}'
+        f' GENERATED ALWAYS AS ({expression}) STORED'
+    )
+    for colname, coltype, expression in ISSUE_GENERATED_COLUMNS
+] + [
+    'CREATE INDEX IF NOT EXISTS jira_issues_labels_idx ON jira_issues USING GIN (labels)',
+    'CREATE INDEX IF NOT EXISTS jira_issues_components_idx ON jira_issues USING GIN (components)',
+    'CREATE INDEX IF NOT EXISTS jira_issues_fix_versions_idx ON jira_issues USING GIN (fix_versions)',
+    'CREATE INDEX IF NOT EXISTS jira_issues_sfdc_count_idx ON jira_issues (sfdc_count)',
+    'CREATE INDEX IF NOT EXISTS jira_issues_parent_idx ON jira_issues (parent)',
+    'CREATE INDEX IF NOT EXISTS jira_issues_parent_link_idx ON jira_issues (parent_link)',
+    'CREATE INDEX IF NOT EXISTS jira_issues_feature_link_idx ON jira_issues (feature_link)',
+    'CREATE INDEX IF NOT EXISTS jira_issues_epic_link_idx ON jira_issues (epic_link)',
+]
+
+# Multi-valued fields normalized into (issue_id, value) side tables so facet
+# counts and membership filters can use plain btree index scans.
+#   (table, value column, source column on jira_issues)
+ISSUE_FACET_TABLES = [
+    ('issue_labels', 'label', 'labels'),
+    ('issue_components', 'component', 'components'),
+    ('issue_fix_versions', 'fix_version', 'fix_versions'),
+]
+
+ISSUE_FACET_TABLES_MIGRATION = []
+for _table, _column, _source in ISSUE_FACET_TABLES:
+    ISSUE_FACET_TABLES_MIGRATION.extend([
+        (
+            f'CREATE TABLE IF NOT EXISTS {_table} ('
+            f' issue_id VARCHAR(50),'
+            f' {_column} VARCHAR(255),'
+            f' CONSTRAINT unique_{_table}_issue_{_column} UNIQUE (issue_id, {_column})'
+            ')'
+        ),
+        f'CREATE INDEX IF NOT EXISTS {_table}_{_column}_idx ON {_table} ({_column}, issue_id)',
+        (
+            f'INSERT INTO {_table} (issue_id, {_column})'
+            f' SELECT id, jsonb_array_elements_text({_source}) FROM jira_issues'
+            f' WHERE {_source} IS NOT NULL'
+            ' ON CONFLICT DO NOTHING'
+        ),
+    ])
+
+# Pre-aggregated facet counts keyed by (project, state, value) so the facet
+# endpoints never have to re-aggregate the issue table. Each view carries a
+# unique index, which REFRESH ... CONCURRENTLY requires.
+#   (view, value column, side table)
+ISSUE_FACET_COUNT_VIEWS = [
+    ('issue_label_counts', 'label', 'issue_labels'),
+    ('issue_component_counts', 'component', 'issue_components'),
+    ('issue_fix_version_counts', 'fix_version', 'issue_fix_versions'),
+]
+
+ISSUE_FACET_COUNT_VIEWS_MIGRATION = []
+for _view, _column, _table in ISSUE_FACET_COUNT_VIEWS:
+    ISSUE_FACET_COUNT_VIEWS_MIGRATION.extend([
+        (
+            f'CREATE MATERIALIZED VIEW IF NOT EXISTS {_view} AS'
+            f' SELECT jira_issues.project, jira_issues.state, {_table}.{_column},'
+            ' COUNT(*) AS issue_count'
+            f' FROM {_table} JOIN jira_issues ON jira_issues.id = {_table}.issue_id'
+            f' GROUP BY jira_issues.project, jira_issues.state, {_table}.{_column}'
+        ),
+        f'CREATE UNIQUE INDEX IF NOT EXISTS {_view}_idx ON {_view} (project, state, {_column})',
+    ])
+
+ISSUE_EVENT_INDEXES_MIGRATION = [
+    'CREATE INDEX IF NOT EXISTS jira_issue_events_project_created_idx ON jira_issue_events (project, created)',
+]
+
+# The changelog item's field, and for Key changes the projects the issue moved
+# between, as indexed columns so the backlog flow queries in backlog_queries.py
+# never have to parse the data blob or LIKE scan keys to find their events.
+ISSUE_EVENT_GENERATED_COLUMNS = [
+    ('field', 'VARCHAR(255)', "data->>'field'"),
+    (
+        'from_project', 'VARCHAR(50)',
+        "CASE WHEN data->>'field' = 'Key' THEN split_part(data->>'fromString', '-', 1) END"
+    ),
+    (
+        'to_project', 'VARCHAR(50)',
+        "CASE WHEN data->>'field' = 'Key' THEN split_part(data->>'toString', '-', 1) END"
+    ),
+]
+
+ISSUE_EVENT_FLOW_MIGRATION = [
+    (
+        f'ALTER TABLE jira_issue_events ADD COLUMN IF NOT EXISTS {colname} {coltype}'
+        f' GENERATED ALWAYS AS ({expression}) STORED'
+    )
+    for colname, coltype, expression in ISSUE_EVENT_GENERATED_COLUMNS
+] + [
+    'CREATE INDEX IF NOT EXISTS jira_issue_events_field_project_created_idx'
+    ' ON jira_issue_events (field, project, created)',
+    'CREATE INDEX IF NOT EXISTS jira_issue_events_from_project_idx ON jira_issue_events (from_project, created)',
+    'CREATE INDEX IF NOT EXISTS jira_issue_events_to_project_idx ON jira_issue_events (to_project, created)',
+]
+
+ISSUE_HISTORY_MIGRATION = [
+    ISSUE_HISTORY_SCHEMA,
+    '''
+    DO $$
+    BEGIN
+        IF EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'jira_issues' AND column_name = 'history'
+        ) THEN
+            INSERT INTO jira_issue_histories (issue_id, history)
+                SELECT id, history FROM jira_issues WHERE history IS NOT NULL
+                ON CONFLICT (issue_id) DO UPDATE SET history = EXCLUDED.history;
+            ALTER TABLE jira_issues DROP COLUMN history;
+        END IF;
+    END $$
+    ''',
+]
+
+# keyset paging for /api/tickets seeks on (sort column, id)
+# the paging tiebreak is coalesce(id, key), invalid issues are stored
+# without an id, see api_queries.tiebreak
+ISSUE_PAGING_INDEXES_MIGRATION = [
+    'DROP INDEX IF EXISTS jira_issues_created_id_idx',
+    'DROP INDEX IF EXISTS jira_issues_updated_id_idx',
+    'DROP INDEX IF EXISTS jira_issues_project_created_id_idx',
+    'DROP INDEX IF EXISTS jira_issues_project_updated_id_idx',
+    'CREATE INDEX IF NOT EXISTS jira_issues_created_page_idx ON jira_issues (created, (coalesce(id, key)))',
+    'CREATE INDEX IF NOT EXISTS jira_issues_updated_page_idx ON jira_issues (updated, (coalesce(id, key)))',
+    # the issues page is nearly always filtered to a project
+    'CREATE INDEX IF NOT EXISTS jira_issues_project_created_page_idx'
+    ' ON jira_issues (project, created, (coalesce(id, key)))',
+    'CREATE INDEX IF NOT EXISTS jira_issues_project_updated_page_idx'
+    ' ON jira_issues (project, updated, (coalesce(id, key)))',
+]
+
+# JQL ORDER BY ... LIMIT n within a project, and the linter's key order, walk
+# these and the (project, created|updated, tiebreak) paging indexes instead of
+# sorting every matching row
+ISSUE_ORDER_INDEXES_MIGRATION = [
+    'DROP INDEX IF EXISTS jira_issues_project_updated_idx',
+    'DROP INDEX IF EXISTS jira_issues_project_created_idx',
+    'CREATE INDEX IF NOT EXISTS jira_issues_project_number_idx ON jira_issues (project, number)',
+]
+
+# batch lookups and the per ticket endpoints filter on key
+ISSUE_KEY_INDEX_MIGRATION = [
+    'CREATE INDEX IF NOT EXISTS jira_issues_key_idx ON jira_issues (key)',
+]
+
+# Full text search over summary (weight A), description (B) and the comment
+# bodies (C). JQL text ~ "..." matches it with websearch_to_tsquery. Adding
+# the column rewrites jira_issues once.
+ISSUE_SEARCH_VECTOR = (
+    "setweight(to_tsvector('english', coalesce(summary, '')), 'A')"
+    " || setweight(to_tsvector('english', coalesce(description, '')), 'B')"
+    " || setweight(to_tsvector('english', coalesce("
+    "jsonb_path_query_array(data, '$.fields.comment.comments[*].body')::text, '')), 'C')"
+)
+
+ISSUE_SEARCH_MIGRATION = [
+    (
+        'ALTER TABLE jira_issues ADD COLUMN IF NOT EXISTS search_vector tsvector'
+        f' GENERATED ALWAYS AS ({ISSUE_SEARCH_VECTOR}) STORED'
+    ),
+    'CREATE INDEX IF NOT EXISTS jira_issues_search_vector_idx ON jira_issues USING GIN (search_vector)',
+]
+
+# already partitioned tables predate the default partition
+ISSUE_EVENT_DEFAULT_PARTITION_MIGRATION = [
+    ISSUE_EVENT_DEFAULT_PARTITION_SCHEMA,
+]
+
+# Per project and day backlog flow, see backlog_queries.py. Ingest recounts
+# the days it touches, `database.py --rebuild-backlog` recounts everything.
+BACKLOG_ROLLUP_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jira_backlog_daily (
+    project VARCHAR(50) NOT NULL,
+    day DATE NOT NULL,
+    opened INTEGER NOT NULL DEFAULT 0,
+    closed INTEGER NOT NULL DEFAULT 0,
+    moved_in INTEGER NOT NULL DEFAULT 0,
+    moved_out INTEGER NOT NULL DEFAULT 0,
+    created INTEGER NOT NULL DEFAULT 0,
+    resolved INTEGER NOT NULL DEFAULT 0,
+    backlog INTEGER,
+    PRIMARY KEY (project, day)
+);
+'''
+
+BACKLOG_ROLLUP_MIGRATION = [
+    BACKLOG_ROLLUP_SCHEMA,
+]
+
+# Bumped by the ingest path whenever a project's issues or events change, the
+# api keys its response cache on these.
+DATA_VERSION_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jira_data_versions (
+    project VARCHAR(50) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated TIMESTAMP NOT NULL DEFAULT now()
+);
+'''
+
+DATA_VERSION_MIGRATION = [
+    DATA_VERSION_SCHEMA,
+]
+
+# NOTIFY channel carrying {"project", "version", "keys"} for every bump
+DATA_CHANGED_CHANNEL = 'jira_data_changed'
+
+# what get_issues_by_keys may project onto, history comes from HISTORY_COLUMN
+ISSUE_SELECTABLE_COLUMNS = (
+    ISSUE_COLUMN_NAMES
+    + ['is_valid']
+    + [x[0] for x in ISSUE_GENERATED_COLUMNS]
+    + ['history']
+)
+
+def issues_by_keys_query(keys, cols=None):
+    """Build the single query behind get_issues_by_keys.
+
+    Raises ValueError for columns outside ISSUE_SELECTABLE_COLUMNS.
+    """
+    selects = ['*']
+    if cols:
+        unknown = [x for x in cols if x not in ISSUE_SELECTABLE_COLUMNS]
+        if unknown:
+            raise ValueError(f'unknown columns: {unknown}')
+        selects = ['key'] + [x for x in cols if x != 'key']
+    selects = [HISTORY_COLUMN if x == 'history' else x for x in selects]
+
+    sql = f"SELECT {','.join(selects)} FROM jira_issues WHERE key = ANY(%s)"
+    return sql, (list(keys),)
+
+
+# Applied in order by migrate_database. Every statement must be idempotent so
+# the list can be replayed against both fresh and existing databases.
+SCHEMA_MIGRATIONS = [
+    ISSUE_GENERATED_COLUMNS_MIGRATION,
+    ISSUE_FACET_TABLES_MIGRATION,
+    ISSUE_FACET_COUNT_VIEWS_MIGRATION,
+    ISSUE_EVENT_INDEXES_MIGRATION,
+    ISSUE_HISTORY_MIGRATION,
+    DATA_VERSION_MIGRATION,
+    ISSUE_PAGING_INDEXES_MIGRATION,
+    ISSUE_KEY_INDEX_MIGRATION,
+    ISSUE_SEARCH_MIGRATION,
+    ISSUE_ORDER_INDEXES_MIGRATION,
+    ISSUE_EVENT_FLOW_MIGRATION,
+    BACKLOG_ROLLUP_MIGRATION,
+    ISSUE_EVENT_DEFAULT_PARTITION_MIGRATION,
+]
+
 
 class JiraDatabaseWrapper:
 
@@ -122,8 +442,14 @@ class JiraDatabaseWrapper:
     IP = None
     _conn = None
 
+    # shared by every wrapper instance in the process
+    _pool = None
+    _pool_lock = threading.Lock()
+
     def __init__(self):
-        self.get_ip()
+        # the connection settings are resolved on first use, so building a
+        # wrapper at import time does not touch docker or the network
+        pass
 
     def start_database(self, clean=False):
         client = docker.APIClient()
@@ -175,17 +501,21 @@ class JiraDatabaseWrapper:
 
     def get_ip(self):
 
+        # the connection settings are resolved once per process
+        cls = JiraDatabaseWrapper
+
         if os.environ.get("POSTGRES_HOST"):
-            self.NAME = os.environ["POSTGRES_HOST"]
-            self.IP = os.environ["POSTGRES_HOST"]
-            self.USER = os.environ.get("POSTGRES_USER", 'jira')
-            self.PASS = os.environ.get("POSGRES_PASSWROD", 'jira')
-            self.DB = os.environ.get("POSTGRES_DB", 'jira')
+            cls.NAME = os.environ["POSTGRES_HOST"]
+            cls.IP = os.environ["POSTGRES_HOST"]
+            cls.USER = os.environ.get("POSTGRES_USER", 'jira')
+            cls.PASS = os.environ.get("POSGRES_PASSWROD", 'jira')
+            cls.DB = os.environ.get("POSTGRES_DB", 'jira')
 
             # wait for it to come up ...
             for _ in range(0, 20):
                 try:
-                    self.get_connection()
+                    self.get_connection().close()
+                    break
                 except Exception as e:
                     logger.warning("waiting 5s for connection")
                     time.sleep(5)
@@ -196,17 +526,104 @@ class JiraDatabaseWrapper:
         for container in client.containers(all=True):
             name = container['Names'][0].lstrip('/')
             if name == self.NAME:
-                self.IP = container['NetworkSettings']['Networks']['bridge']['IPAddress']
+                cls.IP = container['NetworkSettings']['Networks']['bridge']['IPAddress']
                 logger.info(f'container IP {self.IP}')
                 break
 
         return self.IP
 
+    @property
+    def connstring(self):
+        if JiraDatabaseWrapper.IP is None:
+            self.get_ip()
+        return f'host={self.IP} dbname={self.DB} user={self.USER} password={self.PASS}'
+
     def get_connection(self):
-        connstring = f'host={self.IP} dbname={self.DB} user={self.USER} password={self.PASS}'
-        print(connstring)
+        print(self.connstring)
         #raise("HERE!")
-        return psycopg.connect(connstring)
+        return psycopg.connect(self.connstring)
+
+    @property
+    def pool(self):
+        cls = JiraDatabaseWrapper
+        if cls._pool is None:
+            with cls._pool_lock:
+                if cls._pool is None:
+                    logger.info(f'open connection pool min:{POOL_MIN_SIZE} max:{POOL_MAX_SIZE}')
+                    cls._pool = ConnectionPool(
+                        self.connstring,
+                        min_size=POOL_MIN_SIZE,
+                        max_size=POOL_MAX_SIZE,
+                        timeout=POOL_TIMEOUT,
+                        open=True,
+                    )
+                    atexit.register(cls._close_pool)
+        return cls._pool
+
+    @classmethod
+    def _close_pool(cls):
+        if cls._pool is not None:
+            cls._pool.close()
+            cls._pool = None
+
+    @classmethod
+    def reset_pool(cls):
+        """Forget a pool inherited from the parent process.
+
+        Call this in a freshly forked worker. The pooled sockets belong to
+        the parent, so the pool is dropped rather than closed and the next
+        connection() opens a new one for this process.
+        """
+        cls._pool = None
+
+    def connection(self):
+        """Borrow a connection from the process wide pool.
+
+        Use as a context manager. On exit the transaction is committed, or
+        rolled back if the block raised, and the connection goes back to the
+        pool.
+        """
+        return self.pool.connection()
+
+    @staticmethod
+    def set_statement_timeout(conn, timeout_ms):
+        """statement_timeout for the rest of the connection's transaction."""
+        conn.execute("SELECT set_config('statement_timeout', %s, true)", (f'{int(timeout_ms)}ms',))
+
+    def explain(self, sql, params=None, timeout_ms=None):
+        """The EXPLAIN (FORMAT JSON) plan of a query, without running it."""
+        with self.connection() as conn:
+            if timeout_ms:
+                self.set_statement_timeout(conn, timeout_ms)
+            # bound client side, utility statements take no server side params
+            with psycopg.ClientCursor(conn) as cur:
+                cur.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+                return cur.fetchone()[0]
+
+    def iter_dicts(self, sql, params=None, fetch_size=None, timeout_ms=None):
+        """Stream the rows of a query as dicts through a named server-side cursor.
+
+        Rows are pulled fetch_size at a time so memory stays bounded however
+        many rows match. The pooled connection is held until the generator is
+        exhausted or closed. Closing it early, as a server does when the
+        client of a streamed response goes away, cancels the connection's
+        query, closes the portal and rolls back, so nothing keeps running
+        server side.
+        """
+        fetch_size = fetch_size or FETCH_SIZE
+        with self.connection() as conn:
+            if timeout_ms:
+                self.set_statement_timeout(conn, timeout_ms)
+            with conn.cursor(name=f'jira_stream_{uuid.uuid4().hex}') as cur:
+                cur.itersize = fetch_size
+                cur.execute(sql, params)
+                colnames = [x.name for x in cur.description]
+                try:
+                    for row in cur:
+                        yield dict(zip(colnames, row))
+                except GeneratorExit:
+                    conn.cancel()
+                    raise
 
     def check_table_and_create(self, tablename):
         conn = self.get_connection()
@@ -233,6 +650,113 @@ class JiraDatabaseWrapper:
         except Exception as e:
             logger.exception(e)
 
+        self.migrate_database()
+
+    def migrate_database(self):
+        conn = self.get_connection()
+        with conn.cursor() as cur:
+            self.partition_events(cur)
+            self.drop_stale_generated_columns(cur)
+            for migration in SCHEMA_MIGRATIONS:
+                for statement in migration:
+                    logger.info(statement)
+                    cur.execute(statement)
+            conn.commit()
+        conn.close()
+
+    def drop_stale_generated_columns(self, cur):
+        """Drop the ISSUE_GENERATED_COLUMNS created from an older definition.
+
+        Postgres can not change the expression of a generated column in
+        place. The columns whose type differs, or whose numeric cast has no
+        guard yet, are dropped with their indexes and the migration adds them
+        back, recomputed from data.
+        """
+        cur.execute(
+            'SELECT column_name, data_type, generation_expression FROM information_schema.columns'
+            " WHERE table_name = 'jira_issues' AND is_generated = 'ALWAYS'"
+        )
+        current = dict((x[0], (x[1], x[2] or '')) for x in cur.fetchall())
+        for colname, coltype, expression in ISSUE_GENERATED_COLUMNS:
+            if colname not in current:
+                continue
+            data_type, generated = current[colname]
+            if data_type == coltype.lower() and (coltype != 'NUMERIC' or 'CASE' in generated.upper()):
+                continue
+            logger.info(f'redefining generated column jira_issues.{colname}')
+            cur.execute(f'ALTER TABLE jira_issues DROP COLUMN {colname}')
+
+    def partition_events(self, cur):
+        """Convert a legacy heap jira_issue_events table to monthly partitions.
+
+        The old table is renamed aside, its rows are copied into the new
+        partitioned table and it is dropped, all in the caller's transaction.
+        Does nothing if the table is already partitioned.
+        """
+        cur.execute("SELECT relkind FROM pg_class WHERE relname = 'jira_issue_events'")
+        rows = cur.fetchall()
+        if not rows:
+            cur.execute(ISSUE_EVENT_SCHEMA)
+            cur.execute(ISSUE_EVENT_DEFAULT_PARTITION_SCHEMA)
+            return
+        if rows[0][0] == 'p':
+            return
+
+        logger.info('partitioning jira_issue_events by month')
+        cur.execute('ALTER TABLE jira_issue_events RENAME TO jira_issue_events_unpartitioned')
+        cur.execute(
+            'ALTER TABLE jira_issue_events_unpartitioned'
+            ' RENAME CONSTRAINT unique_eventid TO unique_eventid_unpartitioned'
+        )
+        cur.execute(ISSUE_EVENT_SCHEMA)
+        cur.execute(ISSUE_EVENT_DEFAULT_PARTITION_SCHEMA)
+
+        cur.execute(
+            "SELECT DISTINCT date_trunc('month', created) FROM jira_issue_events_unpartitioned"
+            ' WHERE created IS NOT NULL'
+        )
+        for row in cur.fetchall():
+            self.ensure_event_partition(cur, row[0])
+
+        # rows without created land in the default partition
+        cur.execute(
+            'INSERT INTO jira_issue_events (id, author, project, number, key, created, data)'
+            ' SELECT id, author, project, number, key, created, data'
+            ' FROM jira_issue_events_unpartitioned'
+        )
+        logger.info(f'copied {cur.rowcount} events into partitions')
+        cur.execute('DROP TABLE jira_issue_events_unpartitioned')
+
+    def ensure_event_partition(self, cur, created):
+        """Create the monthly partition that an event timestamp falls into.
+
+        created may be a datetime or a jira timestamp string such as
+        2023-03-28T16:09:38.233+0000. Events without one go to the default
+        partition.
+        """
+        if created is None:
+            cur.execute(ISSUE_EVENT_DEFAULT_PARTITION_SCHEMA)
+            return ISSUE_EVENT_DEFAULT_PARTITION_NAME
+
+        if isinstance(created, str):
+            year = int(created[0:4])
+            month = int(created[5:7])
+        else:
+            year = created.year
+            month = created.month
+
+        # Always asked of postgres: a name remembered here could belong to a
+        # CREATE that the caller's transaction later rolled back. IF NOT
+        # EXISTS returns before locking anything when the partition is there.
+        name = ISSUE_EVENT_PARTITION_NAME.format(year=year, month=month)
+        start = datetime.date(year, month, 1)
+        if month == 12:
+            end = datetime.date(year + 1, 1, 1)
+        else:
+            end = datetime.date(year, month + 1, 1)
+        cur.execute(ISSUE_EVENT_PARTITION_SCHEMA.format(name=name, start=start, end=end))
+        return name
+
     @property
     def conn(self):
         if self._conn is None:
@@ -258,6 +782,118 @@ class JiraDatabaseWrapper:
         value = rows[0][0]
         return value
 
+    def store_issue_facets(self, cur, issue_id):
+        """Rebuild the facet side table rows for an issue from its columns.
+
+        Runs on the caller's cursor so the rows are committed together with
+        the issue upsert.
+        """
+        for table, column, source in ISSUE_FACET_TABLES:
+            cur.execute(f'DELETE FROM {table} WHERE issue_id = %s', (issue_id,))
+            cur.execute(
+                f'INSERT INTO {table} (issue_id, {column})'
+                f' SELECT id, jsonb_array_elements_text({source}) FROM jira_issues'
+                ' WHERE id = %s ON CONFLICT DO NOTHING',
+                (issue_id,)
+            )
+
+    def store_issue_history(self, cur, issue_id, history):
+        cur.execute(
+            'INSERT INTO jira_issue_histories (issue_id, history) VALUES (%s, %s)'
+            ' ON CONFLICT (issue_id) DO UPDATE SET history = EXCLUDED.history',
+            (issue_id, history)
+        )
+
+    def bump_data_version(self, cur, project, keys=None):
+        """Mark a project's data as changed and tell the listening api workers.
+
+        Runs on the caller's cursor so the new version becomes visible, and
+        the notification is delivered, in the same commit as the data it
+        describes.
+        """
+        cur.execute(
+            'INSERT INTO jira_data_versions (project, version) VALUES (%s, 1)'
+            ' ON CONFLICT (project) DO UPDATE'
+            ' SET version = jira_data_versions.version + 1, updated = now()'
+            ' RETURNING version',
+            (project,)
+        )
+        version = cur.fetchone()[0]
+        payload = {'project': project, 'version': version, 'keys': keys or []}
+        cur.execute('SELECT pg_notify(%s, %s)', (DATA_CHANGED_CHANNEL, json.dumps(payload)))
+        return version
+
+    def refresh_backlog_days(self, cur, touched):
+        """Recount the jira_backlog_daily rows of {project: days}.
+
+        Runs on the caller's cursor, like bump_data_version, so the rollup
+        commits together with the issues and events it counts.
+        """
+        for project, days in sorted(touched.items()):
+            days = sorted(x for x in days if x is not None)
+            if not project or not days:
+                continue
+            cur.execute(
+                'DELETE FROM jira_backlog_daily WHERE project = %s AND day = ANY(%s)',
+                (project, days)
+            )
+            qs, qargs = backlog_rollup_query(projects=[project], days=days)
+            cur.execute(qs, qargs)
+            qs, qargs = backlog_running_total_query(projects=[project], since=days[0])
+            cur.execute(qs, qargs)
+
+    def rebuild_backlog_rollup(self, projects=None):
+        """Recount jira_backlog_daily from scratch, for projects or all of them."""
+        with self.connection() as conn, conn.cursor() as cur:
+            if projects:
+                cur.execute('DELETE FROM jira_backlog_daily WHERE project = ANY(%s)', (list(projects),))
+            else:
+                cur.execute('DELETE FROM jira_backlog_daily')
+            qs, qargs = backlog_rollup_query(projects=projects or None)
+            cur.execute(qs, qargs)
+            logger.info(f'counted {cur.rowcount} backlog days')
+            qs, qargs = backlog_running_total_query(projects=projects or None)
+            cur.execute(qs, qargs)
+
+    def get_data_versions(self):
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute('SELECT project, version FROM jira_data_versions')
+            return dict(cur.fetchall())
+
+    def refresh_facet_counts(self):
+        """Refresh the facet count views after a sync batch.
+
+        CONCURRENTLY keeps the views readable by the api while refreshing.
+        """
+        with self.conn.cursor() as cur:
+            for view, column, table in ISSUE_FACET_COUNT_VIEWS:
+                logger.info(f'refresh {view}')
+                cur.execute(f'REFRESH MATERIALIZED VIEW CONCURRENTLY {view}')
+            self.conn.commit()
+
+    def get_issues_by_keys(self, keys, cols=None):
+        """Fetch many issues in one query, as a dict of key -> row.
+
+        cols projects the rows onto a subset of ISSUE_SELECTABLE_COLUMNS, the
+        key is always included. Keys that are not in the database are left
+        out of the result.
+        """
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+
+        sql, params = issues_by_keys_query(keys, cols=cols)
+
+        issues = {}
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute(sql, params)
+            colnames = [x[0] for x in cur.description]
+            for row in cur.fetchall():
+                ds = dict(zip(colnames, row))
+                issues[ds['key']] = ds
+
+        return issues
+
     def get_issue_field(self, project, number, field_name):
         data = self.get_issue_column(project, number, 'data')
         if data is None:
@@ -326,6 +962,9 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--start', action='store_true')
     parser.add_argument('--load', action='store_true')
+    parser.add_argument('--migrate', action='store_true')
+    parser.add_argument('--rebuild-backlog', action='store_true', help='recount the daily backlog rollup')
+    parser.add_argument('--project', action='append', dest='projects', help='limit --rebuild-backlog to a project')
     args = parser.parse_args()
 
     jdbw = JiraDatabaseWrapper()
@@ -334,6 +973,10 @@ def main():
         jdbw.start_database()
     if args.load:
         jdbw.load_database()
+    if args.migrate:
+        jdbw.migrate_database()
+    if args.rebuild_backlog:
+        jdbw.rebuild_backlog_rollup(projects=args.projects)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+"""
+field_registry.py - the one place that reads jira's field definitions.
+
+GET_FIELDS.sh dumps /rest/api/2/field to lib/static/json/fields.json. The
+registry parses it once per process, indexes it by id, name and jql clause
+name, and picks up a refreshed file on its own by checking the mtime at most
+every RELOAD_CHECK_INTERVAL seconds.
+
+    from field_registry import FIELDS
+
+    FIELDS.get('customfield_12313140')['name']    # 'Parent Link'
+    FIELDS.get_by_name('Epic Link')['id']
+    FIELDS.resolve('cf[12311140]')                # 'customfield_12311140'
+
+The returned dicts are shared, callers must not modify them.
+"""
+
+import json
+import os
+import threading
+import time
+
+
+FIELDS_FILE = os.path.join(os.path.dirname(__file__), 'static', 'json', 'fields.json')
+
+RELOAD_CHECK_INTERVAL = 5.0
+
+
+class FieldRegistry:
+
+    def __init__(self, filename=FIELDS_FILE, check_interval=RELOAD_CHECK_INTERVAL):
+        self.filename = filename
+        self.check_interval = check_interval
+        self.mtime = None
+        # bumped on every load, lets callers key caches on the definitions
+        self.generation = 0
+        self._checked = 0
+        self._lock = threading.Lock()
+        self._fields = []
+        self._by_id = {}
+        self._by_name = {}
+        self._by_clause_name = {}
+
+    def load(self):
+        """(Re)read the file and swap in fresh indexes."""
+        with self._lock:
+            mtime = os.stat(self.filename).st_mtime
+            with open(self.filename, 'r') as f:
+                fields = json.loads(f.read())
+
+            by_id = {}
+            by_name = {}
+            by_clause_name = {}
+            for field in fields:
+                by_id[field['id']] = field
+                by_name.setdefault(field['name'], field)
+                for clause_name in field.get('clauseNames', []):
+                    by_clause_name.setdefault(clause_name.lower(), field)
+
+            # readers never see a half built index, each is replaced whole
+            self._fields = fields
+            self._by_id = by_id
+            self._by_name = by_name
+            self._by_clause_name = by_clause_name
+            self.mtime = mtime
+            self.generation += 1
+            self._checked = time.monotonic()
+
+    def reload_if_changed(self):
+        """Load the file if it was never read or has changed since.
+
+        Returns True when it was (re)loaded.
+        """
+        now = time.monotonic()
+        if self.mtime is not None and now - self._checked < self.check_interval:
+            return False
+        self._checked = now
+
+        try:
+            mtime = os.stat(self.filename).st_mtime
+        except FileNotFoundError:
+            if self.mtime is None:
+                raise
+            return False
+
+        if mtime == self.mtime:
+            return False
+        try:
+            self.load()
+        except ValueError:
+            # caught the file mid write, keep serving the old copy
+            if self.mtime is None:
+                raise
+            return False
+        return True
+
+    def __iter__(self):
+        self.reload_if_changed()
+        return iter(self._fields)
+
+    def __len__(self):
+        self.reload_if_changed()
+        return len(self._fields)
+
+    def id_map(self):
+        """All fields as a dict of id -> field."""
+        self.reload_if_changed()
+        return self._by_id
+
+    def get(self, field_id, default=None):
+        self.reload_if_changed()
+        return self._by_id.get(field_id, default)
+
+    def get_by_name(self, name, default=None):
+        self.reload_if_changed()
+        return self._by_name.get(name, default)
+
+    def get_by_clause_name(self, clause_name, default=None):
+        """Look up a field by any of its jql names, case insensitive."""
+        self.reload_if_changed()
+        return self._by_clause_name.get(clause_name.lower(), default)
+
+    def resolve(self, name):
+        """The field id for an id, display name or jql clause name."""
+        field = self.get(name) or self.get_by_name(name) or self.get_by_clause_name(name)
+        if field is None:
+            return None
+        return field['id']
+
+
+FIELDS = FieldRegistry()
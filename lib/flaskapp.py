@@ -1,10 +1,16 @@
 #!/usr/bin/env python3
 
-import atexit
 import copy
+import datetime
+import functools
 import glob
+import gzip
+import itertools
 import json
 import os
+import zlib
+
+import psycopg
 
 from flask import Flask
 from flask import jsonify
@@ -12,13 +18,19 @@ from flask import request
 from flask import redirect
 from flask import render_template
 from flask import send_file
+from flask import stream_with_context
 
 from pprint import pprint
 from logzero import logger
 
-from jira_wrapper import JiraWrapper
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 from nodes import tickets_to_nodes
 from database import JiraDatabaseWrapper
+from database import HISTORY_COLUMN
 from stats_wrapper import StatsWrapper
 from timeline import make_timeline
 
@@ -27,19 +39,278 @@ from tree import make_tickets_tree
 from tree import make_child_tree
 from text_tools import render_jira_markup
 from text_tools import split_acceptance_criteria
-from query_parser import query_parse
+from field_registry import FIELDS
+from jql import JQLError
+from jql import query_cache_stats
+from jql import query_compile
+from jql import parse as jql_parse
 from utils import sort_issue_keys
+from api_queries import SEARCH_COLUMNS
+from api_queries import TICKET_COLUMNS
+from api_queries import datatables_order
+from api_queries import facet_counts_query
+from api_queries import filter_args
+from api_queries import format_ticket_row
+from api_queries import is_paged_request
+from api_queries import page_window
+from api_queries import ticket_parents_query
+from api_queries import tickets_page_queries
+from api_queries import tickets_page_response
+from api_queries import tickets_query_from_args
+from data_listener import LISTEN_ENABLED
+from data_listener import DataChangeListener
+from issue_snapshot import SNAPSHOT_ENABLED
+from issue_snapshot import IssueSnapshot
+from issue_snapshot import UnsupportedQuery
+from query_guard import STATEMENT_TIMEOUTS
+from query_guard import QueryRejected
+from query_guard import check_cost
+from query_guard import row_limit
+from response_cache import RESPONSE_CACHE_MB
+from response_cache import ResponseCache
+from response_cache import make_etag
+from response_cache import make_key
+
+
+# serve the api without ever loading the jira client, /api/refresh is refused
+READONLY = os.environ.get('JIRA_API_READONLY') in ['1', 'true', 'True']
 
-
-jw = JiraWrapper()
 jdbw = JiraDatabaseWrapper()
-conn = jdbw.get_connection()
-atexit.register(conn.close)
+_jw = None
+
+
+def get_jira_wrapper():
+    # the jira client is only needed to refresh tickets, build it on demand
+    global _jw
+    if _jw is None:
+        from jira_wrapper import JiraWrapper
+        _jw = JiraWrapper()
+    return _jw
 
 
 app = Flask(__name__)
 
 
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+# json bodies smaller than this are sent as is
+COMPRESS_MIN_SIZE = int(os.environ.get('API_COMPRESS_MIN_SIZE', 1024))
+COMPRESS_MIMETYPES = ['application/json', NDJSON_MIMETYPE]
+
+
+def wants_ndjson():
+    best = request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE])
+    return best == NDJSON_MIMETYPE
+
+
+def ndjson_response(rows):
+    """Stream an iterable of dicts as newline delimited json.
+
+    Each row is serialized as it is produced, so a generator backed by
+    jdbw.iter_dicts never holds the whole result in memory. The status and
+    headers are sent by then, so a query failing mid stream ends the body
+    with an {"error": ...} line instead of just stopping.
+    """
+    def generate():
+        try:
+            for row in rows:
+                yield app.json.dumps(row) + '\n'
+        except psycopg.errors.QueryCanceled as e:
+            logger.warning(f'query canceled mid stream: {e}')
+            yield app.json.dumps({'error': 'the query took too long and was canceled, narrow it down'}) + '\n'
+        except psycopg.Error as e:
+            logger.error(f'query failed mid stream: {e}')
+            yield app.json.dumps({'error': 'the query failed'}) + '\n'
+    return app.response_class(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+
+def _compress_stream(chunks, encoding):
+    if encoding == 'br':
+        compressor = brotli.Compressor()
+        for chunk in chunks:
+            data = compressor.process(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+        return
+
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@app.after_request
+def compress_response(response):
+    """gzip or brotli encode large json and all ndjson responses."""
+
+    if response.status_code != 200 or response.direct_passthrough:
+        return response
+    if response.mimetype not in COMPRESS_MIMETYPES or 'Content-Encoding' in response.headers:
+        return response
+
+    encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+    encoding = request.accept_encodings.best_match(encodings)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.iter_encoded(), encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        if encoding == 'br':
+            response.set_data(brotli.compress(data))
+        else:
+            response.set_data(gzip.compress(data))
+
+    # the encoded body is a different representation of the same data
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(etag, weak=True)
+
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+response_cache = ResponseCache(max_bytes=RESPONSE_CACHE_MB * 1024 * 1024)
+data_listener = DataChangeListener(jdbw)
+
+
+def invalidate_reports(project, keys):
+    response_cache.invalidate(None if project is None else [project])
+
+
+data_listener.add_callback(invalidate_reports)
+
+issue_snapshot = IssueSnapshot(jdbw) if SNAPSHOT_ENABLED else None
+if issue_snapshot is not None:
+    data_listener.add_callback(issue_snapshot.invalidate)
+
+
+def get_data_versions():
+    # the listener keeps the versions current, so a cached report costs no
+    # query at all. it starts lazily so pre-forked workers each get a thread
+    if LISTEN_ENABLED:
+        data_listener.ensure_started()
+        if data_listener.connected:
+            return data_listener.versions
+    return jdbw.get_data_versions()
+
+
+def snapshot_select(query, cols, **kwargs):
+    """Answer a jql query from the issue snapshot, None when it can not."""
+    if issue_snapshot is None:
+        return None
+    if LISTEN_ENABLED:
+        data_listener.ensure_started()
+    try:
+        return issue_snapshot.select(jql_parse(query), cols, **kwargs)
+    except UnsupportedQuery as e:
+        logger.debug(f'issue snapshot can not answer {query!r}: {e}')
+        return None
+
+
+def cached_report(project_scoped=True):
+    """Serve a report endpoint from the response cache.
+
+    The key is the path, the query args and the data versions of the
+    requested projects, or of every project when the view is not project
+    scoped or a jql query could reach anywhere. The date is part of the key
+    because the reports run up to today.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not RESPONSE_CACHE_MB or wants_ndjson():
+                return view(*args, **kwargs)
+
+            projects = None
+            if project_scoped and not request.args.get('jql'):
+                projects = [x for x in request.args.getlist('project') if x not in ['', 'null']]
+                projects = projects or None
+
+            key = make_key(
+                request.path.rstrip('/'),
+                request.args,
+                get_data_versions(),
+                projects=projects,
+                extra=datetime.date.today().isoformat()
+            )
+            etag = make_etag(key)
+
+            if request.if_none_match.contains_weak(etag):
+                response = app.response_class(status=304)
+            else:
+                entry = response_cache.get(key)
+                if entry is None:
+                    response = app.make_response(view(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    entry = response_cache.put(key, response.get_data(), projects=projects)
+                response = app.response_class(entry.body, mimetype='application/json')
+
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
+def create_app():
+    """App factory for pre-fork wsgi servers.
+
+        gunicorn -c gunicorn.conf.py 'flaskapp:create_app()'
+
+    The field registry is loaded here, before the workers fork, so every
+    worker shares the one copy. Database pools are not opened here, each
+    worker opens its own on the first request.
+    """
+    FIELDS.reload_if_changed()
+    return app
+
+
+@app.errorhandler(JQLError)
+@app.errorhandler(QueryRejected)
+def query_error(e):
+    return jsonify({'error': str(e)}), getattr(e, 'status', 400)
+
+
+@app.errorhandler(psycopg.errors.QueryCanceled)
+def query_canceled(e):
+    logger.warning(f'query canceled: {e}')
+    return jsonify({'error': 'the query took too long and was canceled, narrow it down'}), 503
+
+
+@app.route('/healthz')
+def healthz():
+    return jsonify({'status': 'ok'})
+
+
+@app.route('/readyz')
+def readyz():
+    try:
+        with jdbw.connection() as conn, conn.cursor() as cur:
+            cur.execute('SELECT 1')
+    except Exception as e:
+        logger.error(f'database not ready: {e}')
+        return jsonify({'status': 'unavailable', 'error': str(e)}), 503
+    return jsonify({'status': 'ok'})
+
+
+@app.route('/api/cache_stats')
+def cache_stats():
+    return jsonify({
+        'responses': response_cache.stats(),
+        'queries': query_cache_stats(),
+    })
+
+
 @app.route('/')
 def root():
     return redirect('/ui')
@@ -61,10 +332,10 @@ def ui_issues():
 def ui_issues_key(issue_key):
 
     rows = []
-    with conn.cursor() as cur:
+    with jdbw.connection() as conn, conn.cursor() as cur:
         cols = ','.join(ISSUE_COLUMN_NAMES)
         # sql = f'SELECT {cols} FROM jira_issues WHERE key=%s'
-        sql = f'SELECT * FROM jira_issues WHERE key=%s'
+        sql = f'SELECT *,{HISTORY_COLUMN} FROM jira_issues WHERE key=%s'
         cur.execute(sql, (issue_key,))
         results = cur.fetchall()
         colnames = [x[0] for x in cur.description]
@@ -75,9 +346,7 @@ def ui_issues_key(issue_key):
                 ds[x] = row[idx]
             rows.append(ds)
 
-    with open('lib/static/json/fields.json', 'r') as f:
-        field_map = json.loads(f.read())
-    field_map = dict((x['id'], x) for x in field_map)
+    field_map = FIELDS.id_map()
 
     if rows:
         issue_data = rows[0]
@@ -160,7 +429,7 @@ def ui_timeline():
 def projects():
 
     projects = []
-    with conn.cursor() as cur:
+    with jdbw.connection() as conn, conn.cursor() as cur:
         cur.execute(
             f"SELECT DISTINCT(project) FROM jira_issues ORDER BY project")
         results = cur.fetchall()
@@ -172,14 +441,46 @@ def projects():
     return jsonify(projects)
 
 
+# largest batch /api/tickets/batch will look up in one request
+BATCH_MAX_KEYS = int(os.environ.get('API_BATCH_MAX_KEYS', 500))
+
+
+@app.route('/api/tickets/batch', methods=['GET', 'POST'])
+def api_tickets_batch():
+    """Look up many tickets in one query.
+
+    GET takes repeated key= and column= args, POST a json body with keys and
+    columns lists. Answers a mapping of key to row, unknown keys are left out.
+    """
+
+    if request.method == 'POST':
+        keys = request.json.get('keys') or []
+        columns = request.json.get('columns') or None
+    else:
+        keys = request.args.getlist('key')
+        columns = request.args.getlist('column') or None
+
+    if len(keys) > BATCH_MAX_KEYS:
+        return jsonify({'error': f'at most {BATCH_MAX_KEYS} keys per request'}), 400
+
+    try:
+        issues = jdbw.get_issues_by_keys(keys, cols=columns)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify(issues)
+
+
 @app.route('/api/tickets/<issue_key>')
 def api_ticket(issue_key):
 
     rows = []
-    with conn.cursor() as cur:
+    with jdbw.connection() as conn, conn.cursor() as cur:
         cols = ','.join(ISSUE_COLUMN_NAMES)
         # sql = f'SELECT {cols} FROM jira_issues WHERE key=%s'
         sql = f'SELECT * FROM jira_issues WHERE key=%s'
+        if request.args.get('history') in ['true', 'True', '1']:
+            sql = f'SELECT *,{HISTORY_COLUMN} FROM jira_issues WHERE key=%s'
         cur.execute(sql, (issue_key,))
         results = cur.fetchall()
         colnames = [x[0] for x in cur.description]
@@ -190,10 +491,6 @@ def api_ticket(issue_key):
                 ds[x] = row[idx]
             rows.append(ds)
 
-    with open('lib/static/json/fields.json', 'r') as f:
-        field_map = json.loads(f.read())
-    field_map = dict((x['id'], x) for x in field_map)
-
     issue_data = {}
     if rows:
         issue_data = rows[0]
@@ -215,136 +512,99 @@ def api_ticket(issue_key):
 @app.route('/api/tickets/', methods=['GET', 'POST'])
 def tickets():
 
-    cols = [
-        'key',
-        'created',
-        'updated',
-        'created_by',
-        'assigned_to',
-        'type',
-        'priority',
-        'state',
-        "data->'fields'->>'labels' as labels",
-        "data->'fields'->>'components' as components",
-        "data->'fields'->>'customfield_12313440' as sfdc_count",
-        "data->'fields'->>'fixVersions' as fix_versions",
-        'summary'
-    ]
+    cols = TICKET_COLUMNS[:]
+
+    if request.method == 'GET' and is_paged_request(request.args):
+        return jsonify(tickets_page(request.args))
 
     if request.method == 'POST':
         query = request.json.get('query')
+        limit = row_limit(request.json)
         print(f'SEARCH QUERY: {query}')
 
-        '''
-        with open('lib/static/json/fields.json', 'r') as f:
-            field_map = json.loads(f.read())
-        field_map = dict((x['id'], x) for x in field_map)
-        '''
-
-        # sql = query_parse(query, cols=cols, field_map=field_map, debug=True)
-        sql = query_parse(query, cols=cols, debug=True)
-
     else:
 
-        '''
-        projects = request.args.getlist("project")
-        if projects:
-            project = projects[0]
-        else:
-            project = 'AAH'
-
-        WHERE = f"WHERE project = '{project}' AND state != 'Closed'"
-        sql = f"SELECT {','.join(cols)} FROM jira_issues {WHERE}"
-        '''
-        # return jsonify(request.args)
+        query = tickets_query_from_args(filter_args(request.args))
+        limit = row_limit(request.args)
 
-        kwargs = dict(request.args)
+    # one row past the limit tells whether the result was cut short
+    snapshot = snapshot_select(query, cols, limit=limit + 1)
+    if snapshot is not None:
+        rows = snapshot[2]
+    else:
+        sql, params = query_compile(query, cols=cols, limit=limit + 1)
+        limit = check_cost(jdbw.explain(sql, params), limit)
+        sql, params = query_compile(query, cols=cols, limit=limit + 1)
+        print(f'SQL: {sql} {params}')
+        rows = jdbw.iter_dicts(sql, params, timeout_ms=STATEMENT_TIMEOUTS['tickets'])
+
+    if wants_ndjson():
+        response = ndjson_response(format_ticket_row(x) for x in itertools.islice(rows, limit))
+        response.headers['X-Row-Limit'] = str(limit)
+        return response
+
+    filtered = [format_ticket_row(x) for x in rows]
+    response = jsonify(filtered[:limit])
+    response.headers['X-Row-Limit'] = str(limit)
+    if len(filtered) > limit:
+        response.headers['X-Result-Truncated'] = 'true'
+    return response
+
+
+def tickets_page(args):
+    """One page of /api/tickets in DataTables' server-side format."""
+
+    query = args.get('query') or tickets_query_from_args(filter_args(args))
+
+    column, direction = datatables_order(args)
+    start, length = page_window(args)
+    snapshot = snapshot_select(
+        query,
+        TICKET_COLUMNS + ['id'],
+        order_by=[(column, direction, True), ('id', direction, False)],
+        search=(args.get('search[value]') or '').strip(),
+        search_columns=SEARCH_COLUMNS,
+        offset=start,
+        limit=length,
+    )
+    if snapshot is not None:
+        return tickets_page_response(args, *snapshot)
 
-        if 'project' not in kwargs and not kwargs:
-            kwargs['project'] = 'AAH'
+    sql, params = query_compile(query, cols=TICKET_COLUMNS + ['id'])
+    queries = tickets_page_queries(sql, args, params)
+    check_cost(jdbw.explain(*queries['total']), length)
 
-        qs = ""
-        for key, val in kwargs.items():
-            if key == 'component':
-                key = 'components'
-            if not qs:
-                qs += f"{key}={val}"
-            else:
-                qs += f" AND {key}={val}"
-        # if not qs and not "project" in request.args:
-        #    qs += " project=AAH"
-        if "state" not in kwargs and "status" not in kwargs:
-            if not qs:
-                qs += "status!=Closed"
-            else:
-                qs += " AND status!=Closed"
+    with jdbw.connection() as conn, conn.cursor() as cur:
+        jdbw.set_statement_timeout(conn, STATEMENT_TIMEOUTS['tickets_page'])
+        cur.execute(*queries['total'])
+        total = cur.fetchone()[0]
 
-        sql = query_parse(qs, cols=cols, debug=True)
-        # return jsonify({"qs": qs, "sql": sql})
+        filtered = None
+        if 'filtered' in queries:
+            cur.execute(*queries['filtered'])
+            filtered = cur.fetchone()[0]
 
-    print(f'SQL: {sql}')
-    filtered = []
-    with conn.cursor() as cur:
+        cur.execute(*queries['page'])
+        colnames = [x[0] for x in cur.description]
+        rows = [dict(zip(colnames, row)) for row in cur.fetchall()]
 
-        try:
-            cur.execute(sql)
-            results = cur.fetchall()
-
-            print(f'DESCRIPTION: {cur.description}')
-            desc_cols = [x.name for x in cur.description]
-            print(f'DCOLS: {desc_cols}')
-
-            for row in results:
-                ds = {}
-                # for idc,colname in enumerate(cols):
-                for idc, colname in enumerate(desc_cols):
-
-                    ds[colname] = row[idc]
-                    if colname in ['created', 'updated']:
-                        ds[colname] = row[idc].isoformat().split('.')[0]
-                    elif colname == 'sfdc_count':
-                        ds[colname] = int(row[idc].split('.')[0])
-                    elif colname == 'labels':
-                        labels = json.loads(row[idc])
-                        labels = [x for x in labels if 'JIRALERT' not in x]
-                        ds[colname] = labels
-                    elif colname == 'components':
-                        components = json.loads(row[idc])
-                        components = [x['name'] for x in components]
-                        ds[colname] = components
-
-                    elif colname == 'fix_versions':
-                        ds[colname] = [x['name'] for x in json.loads(row[idc])]
-                filtered.append(ds)
-        except Exception as e:
-            print(e)
-            conn.rollback()
-
-    return jsonify(filtered)
+    return tickets_page_response(args, total, filtered, rows)
 
 
 @app.route('/api/tickets_parents')
 @app.route('/api/ticket_parents/')
 def api_tickets_parents():
 
-    fmap = {
-        'epic_link': 'customfield_12311140',
-        'feature_link': 'customfield_12318341',
-        'parent_link': 'customfield_12313140',
-    }
-
-    sql = "SELECT key,type"
-    for k, v in fmap.items():
-        sql += ',' + f"data->'fields'->>'{v}' {k}"
-    sql += " from jira_issues"
-    if request.args.get('project'):
-        project = request.args.get('project')
-        sql += f" WHERE project='{project}'"
+    sql, params = ticket_parents_query(request.args)
 
     print(f'SQL: {sql}')
+
+    if wants_ndjson():
+        return ndjson_response(jdbw.iter_dicts(sql, params))
+
     rows = []
-    with conn.cursor() as cur:
-        cur.execute(sql)
+    with jdbw.connection() as conn, conn.cursor() as cur:
+        cur.execute(sql, params)
         results = cur.fetchall()
         cols = [desc[0] for desc in cur.description]
 
@@ -352,12 +612,6 @@ def api_tickets_parents():
             ds = {}
             for idc, colname in enumerate(cols):
                 ds[colname] = row[idc]
-
-                # is it json?
-                if colname in fmap and row[idc] is not None and 'key' in row[idc]:
-                    colds = json.loads(row[idc])
-                    ds[colname] = colds['key']
-
             rows.append(ds)
 
     return jsonify(rows)
@@ -376,7 +630,7 @@ def api_acceptance_criteria():
 
     print(f'SQL: {sql}')
     rows = []
-    with conn.cursor() as cur:
+    with jdbw.connection() as conn, conn.cursor() as cur:
         cur.execute(sql)
         results = cur.fetchall()
         cols = [desc[0] for desc in cur.description]
@@ -402,40 +656,13 @@ def api_acceptance_criteria():
 @app.route('/api/labels')
 @app.route('/api/labels/')
 def api_labels():
-    '''
-    sql = "SELECT project,key,summary,state,data->'fields'->>'labels' acceptance_criteria"
-    sql += " from jira_issues"
-    sql += " WHERE data->'fields'->>'customfield_12315940' IS NOT NULL"
-    '''
-    clauses = {
-        'state': [('!=', 'Closed')]
-    }
-
-    sql = "select label,COUNT(label) count from jira_issues,jsonb_array_elements(data->'fields'->'labels') AS label"
 
-    if request.args.get('project'):
-        clauses['project'] = [('=', request.args.get('project'))]
-    if request.args.get('state'):
-        clauses['state'] = [('=', request.args.get('state'))]
-    if request.args.get('closed'):
-        clauses.pop('state')
-
-    if clauses:
-        sql += ' WHERE '
-        statements = []
-        for k, v in clauses.items():
-            for _v in v:
-                statement = f"{k}{_v[0]}'{_v[1]}'"
-                statements.append(statement)
-        sql += ' AND '.join(statements)
-
-    sql += " GROUP BY label"
-    sql += " ORDER BY count DESC"
+    sql, params = facet_counts_query('labels', request.args)
 
     print(f'SQL: {sql}')
     rows = []
-    with conn.cursor() as cur:
-        cur.execute(sql)
+    with jdbw.connection() as conn, conn.cursor() as cur:
+        cur.execute(sql, params)
         results = cur.fetchall()
         cols = [desc[0] for desc in cur.description]
 
@@ -451,49 +678,13 @@ def api_labels():
 @app.route('/api/components')
 @app.route('/api/components/')
 def api_components():
-    '''
-    sql = "SELECT project,key,summary,state,data->'fields'->>'labels' acceptance_criteria"
-    sql += " from jira_issues"
-    sql += " WHERE data->'fields'->>'customfield_12315940' IS NOT NULL"
-    '''
-    clauses = {
-        'state': [('!=', 'Closed')]
-    }
-
-    '''
-    SELECT components->>'name' AS component, COUNT(components->>'name') AS count
-    FROM jira_issues, LATERAL jsonb_array_elements(data->'fields'->'components') AS components
-    WHERE state = 'null'
-    GROUP BY component
-    ORDER BY count DESC;
-    '''
-    # sql = "select component,COUNT(component) count from jira_issues,jsonb_array_elements(data->'fields'->'components')->>'name' AS component"
-    sql = '''SELECT components->>'name' AS component, COUNT(components->>'name') AS count
-    FROM jira_issues, LATERAL jsonb_array_elements(data->'fields'->'components') AS components'''
 
-    if request.args.get('project'):
-        clauses['project'] = [('=', request.args.get('project'))]
-    if request.args.get('state'):
-        clauses['state'] = [('=', request.args.get('state'))]
-    if request.args.get('closed'):
-        clauses.pop('state')
-
-    if clauses:
-        sql += ' WHERE '
-        statements = []
-        for k, v in clauses.items():
-            for _v in v:
-                statement = f"{k}{_v[0]}'{_v[1]}'"
-                statements.append(statement)
-        sql += ' AND '.join(statements)
-
-    sql += " GROUP BY component"
-    sql += " ORDER BY count DESC"
+    sql, params = facet_counts_query('components', request.args)
 
     print(f'SQL: {sql}')
     rows = []
-    with conn.cursor() as cur:
-        cur.execute(sql)
+    with jdbw.connection() as conn, conn.cursor() as cur:
+        cur.execute(sql, params)
         results = cur.fetchall()
         cols = [desc[0] for desc in cur.description]
 
@@ -509,40 +700,13 @@ def api_components():
 @app.route('/api/fix_versions')
 @app.route('/api/fix_versions/')
 def api_fix_versions():
-    '''
-    sql = "SELECT project,key,summary,state,data->'fields'->>'labels' acceptance_criteria"
-    sql += " from jira_issues"
-    sql += " WHERE data->'fields'->>'customfield_12315940' IS NOT NULL"
-    '''
-    clauses = {
-        'state': [('!=', 'Closed')]
-    }
 
-    sql = "select fv->'name' as fix_version,COUNT(fv) count from jira_issues,jsonb_array_elements(data->'fields'->'fixVersions') AS fv"
-
-    if request.args.get('project'):
-        clauses['project'] = [('=', request.args.get('project'))]
-    if request.args.get('state'):
-        clauses['state'] = [('=', request.args.get('state'))]
-    if request.args.get('closed'):
-        clauses.pop('state')
-
-    if clauses:
-        sql += ' WHERE '
-        statements = []
-        for k, v in clauses.items():
-            for _v in v:
-                statement = f"{k}{_v[0]}'{_v[1]}'"
-                statements.append(statement)
-        sql += ' AND '.join(statements)
-
-    sql += " GROUP BY fix_version"
-    sql += " ORDER BY count DESC"
+    sql, params = facet_counts_query('fix_versions', request.args)
 
     print(f'SQL: {sql}')
     rows = []
-    with conn.cursor() as cur:
-        cur.execute(sql)
+    with jdbw.connection() as conn, conn.cursor() as cur:
+        cur.execute(sql, params)
         results = cur.fetchall()
         cols = [desc[0] for desc in cur.description]
 
@@ -557,6 +721,7 @@ def api_fix_versions():
 
 @app.route('/api/tickets_tree')
 @app.route('/api/tickets_tree/')
+@cached_report(project_scoped=False)
 def tickets_tree():
 
     # show_closed = request.args.get('closed') in ['false', 'False', '0']
@@ -572,6 +737,9 @@ def tickets_tree():
         map_progress=show_progress
     )
 
+    if wants_ndjson():
+        return ndjson_response(imap.values())
+
     return jsonify(imap)
 
 
@@ -595,6 +763,7 @@ def ticket_child_tree(issue_key):
 
 @app.route('/api/tickets_burndown')
 @app.route('/api/tickets_burndown/')
+@cached_report()
 def tickets_burndown():
 
     projects = request.args.getlist("project")
@@ -623,6 +792,7 @@ def tickets_burndown():
 
 @app.route('/api/fixversion_burndown')
 @app.route('/api/fixversion_burndown/')
+@cached_report()
 def fixversion_burndown():
 
     projects = request.args.getlist("project")
@@ -651,6 +821,7 @@ def fixversion_burndown():
 
 @app.route('/api/tickets_churn')
 @app.route('/api/tickets_churn/')
+@cached_report()
 def tickets_churn():
 
     projects = request.args.getlist("project")
@@ -681,6 +852,7 @@ def tickets_churn():
 
 @app.route('/api/timeline')
 @app.route('/api/timeline/')
+@cached_report()
 def api_tickets_timeline():
     projects = request.args.getlist("project")
     start = request.args.get('start')
@@ -715,6 +887,10 @@ def api_tickets_timeline():
 @app.route('/api/refresh', methods=['POST'])
 def ticket_refresh():
 
+    if READONLY:
+        return jsonify({'error': 'refresh is disabled in read-only mode'}), 403
+
+    jw = get_jira_wrapper()
     issue_key = request.json.get('issue')
     project = issue_key.split('-')[0]
     number = int(issue_key.split('-')[1])
@@ -725,4 +901,4 @@ def ticket_refresh():
 
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    create_app().run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,518 @@
+#!/usr/bin/env python3
+
+"""
+issue_snapshot.py - an in-process columnar copy of the filterable issue fields.
+
+With API_ISSUE_SNAPSHOT=1 every api worker keeps the jira_issues columns the
+issues page shows in numpy arrays and answers parsed jql from them without a
+round trip to postgres:
+
+  * short strings (project, state, type, ...) are dictionary encoded, an
+    int32 code per issue and -1 for null
+  * labels, components and fix versions get a packed bitmap per value
+  * timestamps are datetime64 with NaT for null, numbers float64 with nan
+
+A clause turns into a pair of boolean masks, rows where it is true and rows
+where it is false, so NOT and != keep sql's three valued logic around nulls.
+Anything the snapshot can not answer exactly (~, unknown fields, most date
+functions) raises UnsupportedQuery and the caller runs the sql instead.
+
+The snapshot is refreshed by re-reading the rows whose updated timestamp is
+at or past the newest one it holds. That misses rows stored with an older or
+null updated and rows deleted from jira_issues, so every
+API_ISSUE_SNAPSHOT_FULL_REFRESH seconds the next refresh reads everything
+again. A refresh copies the arrays it changes and swaps in a new ColumnStore,
+so readers never see a half applied update.
+
+Text sorts by the database collation, not by code point. The dictionary
+values of the encoded columns are ranked by postgres whenever new ones show
+up; ordering by key or summary raises UnsupportedQuery.
+"""
+
+import datetime
+import os
+import threading
+import time
+
+import numpy as np
+
+from logzero import logger
+
+
+SNAPSHOT_ENABLED = os.environ.get('API_ISSUE_SNAPSHOT', '0') in ['1', 'true', 'True']
+# seconds before a request triggers a refresh, data change notifications
+# from the sync trigger one sooner
+SNAPSHOT_MAX_AGE = float(os.environ.get('API_ISSUE_SNAPSHOT_MAX_AGE', 60))
+# seconds between refreshes that read every row again
+SNAPSHOT_FULL_REFRESH = float(os.environ.get('API_ISSUE_SNAPSHOT_FULL_REFRESH', 3600))
+
+OBJECT_COLUMNS = ['id', 'key', 'summary']
+ENCODED_COLUMNS = ['project', 'state', 'type', 'priority', 'assigned_to', 'created_by']
+TIMESTAMP_COLUMNS = ['created', 'updated', 'closed']
+NUMERIC_COLUMNS = ['number', 'sfdc_count']
+# facet side table the jql compiler names -> jira_issues list column
+MULTI_COLUMNS = {
+    'issue_labels': 'labels',
+    'issue_components': 'components',
+    'issue_fix_versions': 'fix_versions',
+}
+
+SNAPSHOT_COLUMNS = (
+    OBJECT_COLUMNS + ENCODED_COLUMNS + TIMESTAMP_COLUMNS + NUMERIC_COLUMNS + list(MULTI_COLUMNS.values())
+)
+
+NAT = np.datetime64('NaT', 'us')
+
+DURATION_UNITS = {
+    'w': np.timedelta64(7, 'D'),
+    'd': np.timedelta64(1, 'D'),
+    'h': np.timedelta64(1, 'h'),
+    'm': np.timedelta64(1, 'm'),
+}
+
+COMPARISONS = {
+    '=': np.equal,
+    '!=': np.not_equal,
+    '<': np.less,
+    '>': np.greater,
+    '<=': np.less_equal,
+    '>=': np.greater_equal,
+}
+
+
+class UnsupportedQuery(Exception):
+    """The snapshot can not answer this query, run it in postgres."""
+
+
+def _grow(arr, n, fill):
+    """A copy of arr padded to n entries with fill."""
+    grown = np.full(n, fill, dtype=arr.dtype)
+    grown[:len(arr)] = arr
+    return grown
+
+
+def _bits(bitmap, n):
+    if bitmap is None:
+        return np.zeros(n, dtype=bool)
+    return np.unpackbits(bitmap, count=n).astype(bool)
+
+
+class ColumnStore:
+    """One immutable version of the snapshot."""
+
+    def __init__(self):
+        self.n = 0
+        self.row_index = {}
+        self.max_updated = None
+        self.arrays = {}
+        self.dictionaries = {}
+        # column -> rank of each dictionary code in the database collation
+        self.ranks = {}
+        self.bitmaps = {}
+
+        for col in OBJECT_COLUMNS:
+            self.arrays[col] = np.empty(0, dtype=object)
+        for col in ENCODED_COLUMNS:
+            self.arrays[col] = np.empty(0, dtype=np.int32)
+            self.dictionaries[col] = ([], {})
+        for col in TIMESTAMP_COLUMNS:
+            self.arrays[col] = np.empty(0, dtype='datetime64[us]')
+        for col in NUMERIC_COLUMNS:
+            self.arrays[col] = np.empty(0, dtype=np.float64)
+        for col in MULTI_COLUMNS.values():
+            self.arrays[col] = np.empty(0, dtype=object)
+            self.arrays[f'{col}_count'] = np.empty(0, dtype=np.int32)
+            self.bitmaps[col] = {}
+
+    def with_rows(self, rows):
+        """A new store with rows (dicts of SNAPSHOT_COLUMNS) inserted or replaced."""
+
+        new = ColumnStore()
+        new.row_index = dict(self.row_index)
+        # dictionaries only grow, a rank shorter than its dictionary is stale
+        new.ranks = dict(self.ranks)
+        positions = []
+        for row in rows:
+            pos = new.row_index.get(row['id'])
+            if pos is None:
+                pos = len(new.row_index)
+                new.row_index[row['id']] = pos
+            positions.append(pos)
+        n = new.n = len(new.row_index)
+
+        for col in OBJECT_COLUMNS:
+            arr = new.arrays[col] = _grow(self.arrays[col], n, None)
+            for pos, row in zip(positions, rows):
+                arr[pos] = row[col]
+
+        for col in ENCODED_COLUMNS:
+            values, index = self.dictionaries[col]
+            values, index = new.dictionaries[col] = (values[:], dict(index))
+            arr = new.arrays[col] = _grow(self.arrays[col], n, -1)
+            for pos, row in zip(positions, rows):
+                value = row[col]
+                if value is None:
+                    arr[pos] = -1
+                    continue
+                code = index.get(value)
+                if code is None:
+                    code = index[value] = len(values)
+                    values.append(value)
+                arr[pos] = code
+
+        for col in TIMESTAMP_COLUMNS:
+            arr = new.arrays[col] = _grow(self.arrays[col], n, NAT)
+            for pos, row in zip(positions, rows):
+                arr[pos] = NAT if row[col] is None else np.datetime64(row[col], 'us')
+
+        for col in NUMERIC_COLUMNS:
+            arr = new.arrays[col] = _grow(self.arrays[col], n, np.nan)
+            for pos, row in zip(positions, rows):
+                arr[pos] = np.nan if row[col] is None else float(row[col])
+
+        for col in MULTI_COLUMNS.values():
+            old_lists = self.arrays[col]
+            lists = new.arrays[col] = _grow(old_lists, n, None)
+            counts = new.arrays[f'{col}_count'] = _grow(self.arrays[f'{col}_count'], n, 0)
+
+            # only the bitmaps of values that came or went are rebuilt
+            removed = {}
+            added = {}
+            for pos, row in zip(positions, rows):
+                old = (old_lists[pos] if pos < len(old_lists) else None) or []
+                current = list(dict.fromkeys(row[col] or []))
+                for value in old:
+                    removed.setdefault(value, []).append(pos)
+                for value in current:
+                    added.setdefault(value, []).append(pos)
+                lists[pos] = current
+                counts[pos] = len(current)
+
+            bitmaps = new.bitmaps[col] = dict(self.bitmaps[col])
+            for value in set(removed) | set(added):
+                bits = _bits(bitmaps.get(value), n)
+                bits[removed.get(value, [])] = False
+                bits[added.get(value, [])] = True
+                bitmaps[value] = np.packbits(bits)
+
+        updated = new.arrays['updated']
+        if n and not np.isnat(updated).all():
+            new.max_updated = updated[~np.isnat(updated)].max().item()
+
+        return new
+
+    def unranked(self):
+        """The encoded columns with dictionary values that have no rank yet."""
+        return [x for x in ENCODED_COLUMNS if len(self.ranks.get(x, ())) != len(self.dictionaries[x][0])]
+
+
+class IssueSnapshot:
+
+    def __init__(self, jdbw, max_age=SNAPSHOT_MAX_AGE, resolver=None, full_refresh=SNAPSHOT_FULL_REFRESH):
+        self.jdbw = jdbw
+        self.max_age = max_age
+        self.full_refresh = full_refresh
+        self.resolver = resolver
+        self.store = ColumnStore()
+        self.refreshed = None
+        self.full_refreshed = None
+        self.stale = True
+        self._lock = threading.Lock()
+
+    def invalidate(self, project=None, keys=None):
+        """data_listener callback, the next request refreshes."""
+        self.stale = True
+
+    def refresh(self, full=False):
+        """Pull the changed rows into a new store, returns how many were read."""
+        with self._lock:
+            store = ColumnStore() if full else self.store
+            sql = f"SELECT {','.join(SNAPSHOT_COLUMNS)} FROM jira_issues"
+            params = None
+            if store.max_updated is not None:
+                sql += ' WHERE updated >= %s'
+                params = (store.max_updated,)
+
+            # clear first, a change landing mid-read marks it stale again
+            self.stale = False
+            t0 = time.monotonic()
+            rows = list(self.jdbw.iter_dicts(sql, params))
+            if rows:
+                store = store.with_rows(rows)
+            if store.unranked():
+                self.rank(store)
+            self.store = store
+            self.refreshed = time.monotonic()
+            if full or self.full_refreshed is None:
+                self.full_refreshed = self.refreshed
+            logger.info(f'issue snapshot: {len(rows)} rows in {self.refreshed - t0:.2f}s, {store.n} total')
+            return len(rows)
+
+    def rank(self, store):
+        """Rank the dictionary values of store in the database collation."""
+        values = sorted(set(x for col in ENCODED_COLUMNS for x in store.dictionaries[col][0]))
+        sql = 'SELECT v FROM unnest(%s::text[]) AS v ORDER BY v'
+        collated = {x['v']: i for i, x in enumerate(self.jdbw.iter_dicts(sql, (values,)))}
+        for col in ENCODED_COLUMNS:
+            store.ranks[col] = np.array([collated[x] for x in store.dictionaries[col][0]], dtype=np.int64)
+
+    def ensure_fresh(self):
+        now = time.monotonic()
+        if self.full_refreshed is not None and now - self.full_refreshed > self.full_refresh:
+            self.refresh(full=True)
+        elif self.refreshed is None or self.stale or now - self.refreshed > self.max_age:
+            self.refresh()
+        return self.store
+
+    # -- evaluation ----------------------------------------------------------
+
+    def resolve(self, name):
+        if self.resolver is None:
+            from jql import resolve_field
+            self.resolver = resolve_field
+        resolved = self.resolver(name)
+        if resolved[0] == 'multi' and resolved[1] in MULTI_COLUMNS:
+            return 'multi', MULTI_COLUMNS[resolved[1]]
+        if resolved[0] == 'scalar' and resolved[1] in SNAPSHOT_COLUMNS:
+            return 'scalar', resolved[1]
+        raise UnsupportedQuery(f'{name} is not in the snapshot')
+
+    def evaluate(self, store, node):
+        """(true, false) masks for a jql ast node."""
+        kind = type(node).__name__
+
+        if kind in ['And', 'Or']:
+            masks = [self.evaluate(store, x) for x in node.items]
+            true, false = masks[0]
+            for t, f in masks[1:]:
+                if kind == 'And':
+                    true, false = true & t, false | f
+                else:
+                    true, false = true | t, false & f
+            return true, false
+
+        if kind == 'Not':
+            true, false = self.evaluate(store, node.item)
+            return false, true
+
+        if kind != 'Clause':
+            raise UnsupportedQuery(f'can not evaluate {kind}')
+
+        how, col = self.resolve(node.field)
+        if how == 'multi':
+            return self.evaluate_multi(store, col, node.op, node.value)
+        return self.evaluate_scalar(store, col, node.op, node.value)
+
+    def evaluate_multi(self, store, col, op, value):
+        if op in ['is', 'is not']:
+            empty = store.arrays[f'{col}_count'] == 0
+            return (empty, ~empty) if op == 'is' else (~empty, empty)
+
+        if op in ['=', '!=']:
+            values = [value]
+        elif op in ['in', 'not in']:
+            values = value
+        else:
+            raise UnsupportedQuery(f'{op} on {col}')
+        if any(not isinstance(x, str) for x in values):
+            raise UnsupportedQuery('functions on multi valued fields')
+
+        bitmaps = store.bitmaps[col]
+        hit = np.zeros(store.n, dtype=bool)
+        for x in values:
+            hit |= _bits(bitmaps.get(x), store.n)
+
+        # a multi valued field is never unknown, EXISTS is true or false
+        if op in ['=', 'in']:
+            return hit, ~hit
+        return ~hit, hit
+
+    def evaluate_scalar(self, store, col, op, value):
+        arr = store.arrays[col]
+
+        if col in ENCODED_COLUMNS:
+            known = arr >= 0
+        elif col in TIMESTAMP_COLUMNS:
+            known = ~np.isnat(arr)
+        elif col in NUMERIC_COLUMNS:
+            known = ~np.isnan(arr)
+        else:
+            known = np.fromiter((x is not None for x in arr), dtype=bool, count=store.n)
+
+        if op == 'is':
+            return ~known, known
+        if op == 'is not':
+            return known, ~known
+
+        if op in ['in', 'not in']:
+            if any(not isinstance(x, str) for x in value):
+                raise UnsupportedQuery('functions in a list')
+            hit = self.member_mask(store, col, value)
+            if op == 'not in':
+                hit = ~hit
+            return known & hit, known & ~hit
+
+        if op not in COMPARISONS:
+            raise UnsupportedQuery(f'{op} on {col}')
+
+        if col in ENCODED_COLUMNS or col in OBJECT_COLUMNS:
+            if op not in ['=', '!='] or not isinstance(value, str):
+                raise UnsupportedQuery(f'{op} on {col}')
+            hit = self.member_mask(store, col, [value])
+            if op == '!=':
+                hit = ~hit
+        else:
+            hit = COMPARISONS[op](arr, self.scalar_value(col, value))
+
+        return known & hit, known & ~hit
+
+    def member_mask(self, store, col, values):
+        arr = store.arrays[col]
+        if col in ENCODED_COLUMNS:
+            index = store.dictionaries[col][1]
+            codes = [index[x] for x in values if x in index]
+            return np.isin(arr, codes)
+        if col in OBJECT_COLUMNS:
+            values = set(values)
+            return np.fromiter((x in values for x in arr), dtype=bool, count=store.n)
+        if col in NUMERIC_COLUMNS:
+            return np.isin(arr, [self.scalar_value(col, x) for x in values])
+        raise UnsupportedQuery(f'IN on {col}')
+
+    def scalar_value(self, col, value):
+        if col in NUMERIC_COLUMNS:
+            if not isinstance(value, str):
+                raise UnsupportedQuery(f'functions on {col}')
+            try:
+                return float(value)
+            except ValueError:
+                raise UnsupportedQuery(f'{value!r} is not a number')
+
+        # timestamps are utc wall clock times, like in postgres
+        now = np.datetime64(datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None), 'us')
+        if not isinstance(value, str):
+            if value.name.lower() == 'now' and not value.args:
+                return now
+            raise UnsupportedQuery(f'{value.name}()')
+
+        sign = -1 if value.startswith('-') else 1
+        digits = value.lstrip('+-')
+        if digits[:-1].isdigit() and digits[-1:] in DURATION_UNITS:
+            return now + sign * int(digits[:-1]) * DURATION_UNITS[digits[-1]]
+        try:
+            return np.datetime64(value, 'us')
+        except ValueError:
+            raise UnsupportedQuery(f'{value!r} is not a date')
+
+    # -- ordering ------------------------------------------------------------
+
+    def sort_key(self, store, col, idx):
+        """(values, known) for the rows in idx, values sort like postgres would."""
+        arr = store.arrays[col][idx]
+        if col in ENCODED_COLUMNS:
+            rank = store.ranks.get(col)
+            if rank is None or len(rank) != len(store.dictionaries[col][0]):
+                raise UnsupportedQuery(f'{col} has no collation order')
+            known = arr >= 0
+            return np.where(known, rank[np.where(known, arr, 0)] if len(rank) else 0, 0), known
+        if col in TIMESTAMP_COLUMNS:
+            known = ~np.isnat(arr)
+            return np.where(known, arr.astype(np.int64), 0), known
+        if col in NUMERIC_COLUMNS:
+            known = ~np.isnan(arr)
+            return np.where(known, arr, 0), known
+        if col == 'id':
+            # jira ids are digit strings, which every collation orders by code point
+            known = np.fromiter((x is not None for x in arr), dtype=bool, count=len(arr))
+            _, inverse = np.unique(np.array([x or '' for x in arr], dtype=str), return_inverse=True)
+            return inverse, known
+        raise UnsupportedQuery(f'can not order by {col}')
+
+    def order(self, store, idx, order_by):
+        """Sort idx by [(column, 'ASC'|'DESC', nulls_last)], most significant first."""
+        keys = []
+        for col, direction, nulls_last in reversed(order_by):
+            values, known = self.sort_key(store, col, idx)
+            if direction.upper() == 'DESC':
+                values = -values
+            keys.append(values)
+            keys.append(~known if nulls_last else known)
+        if not keys:
+            return idx
+        return idx[np.lexsort(keys)]
+
+    # -- queries -------------------------------------------------------------
+
+    def select(self, query, cols, order_by=None, search=None, search_columns=(), offset=0, limit=None):
+        """Run a parsed jql Query, returns (total, filtered, rows).
+
+        A LIMIT in the query applies first, in the query's own order. Then
+        order_by, see order(), replaces that order. search is matched case
+        insensitively as a substring of search_columns, and filtered is the
+        count after it or None without a search.
+        """
+        for col in cols:
+            if col not in SNAPSHOT_COLUMNS:
+                raise UnsupportedQuery(f'{col} is not in the snapshot')
+
+        store = self.ensure_fresh()
+
+        if query.where is None:
+            mask = np.ones(store.n, dtype=bool)
+        else:
+            mask, _ = self.evaluate(store, query.where)
+
+        query_order = []
+        for key in query.order_by:
+            how, col = self.resolve(key.field)
+            if how != 'scalar':
+                raise UnsupportedQuery(f'can not order by {key.field}')
+            # postgres puts nulls last going up and first going down
+            query_order.append((col, key.direction, key.direction.upper() == 'ASC'))
+
+        idx = np.flatnonzero(mask)
+        if query.limit is not None:
+            idx = self.order(store, idx, query_order)[:query.limit]
+
+        total = len(idx)
+        filtered = None
+        if search:
+            idx = idx[self.search_mask(store, search, search_columns)[idx]]
+            filtered = len(idx)
+
+        idx = self.order(store, idx, query_order if order_by is None else order_by)
+        end = None if limit is None else offset + limit
+        return total, filtered, self.rows(store, idx[offset:end], cols)
+
+    def search_mask(self, store, search, columns):
+        needle = search.lower()
+        mask = np.zeros(store.n, dtype=bool)
+        for col in columns:
+            arr = store.arrays[col]
+            if col in ENCODED_COLUMNS:
+                values = store.dictionaries[col][0]
+                codes = [i for i, x in enumerate(values) if needle in x.lower()]
+                mask |= np.isin(arr, codes)
+            elif col in OBJECT_COLUMNS:
+                mask |= np.fromiter((x is not None and needle in x.lower() for x in arr), dtype=bool, count=store.n)
+            else:
+                raise UnsupportedQuery(f'can not search {col}')
+        return mask
+
+    def rows(self, store, idx, cols):
+        columns = {}
+        for col in cols:
+            arr = store.arrays[col][idx]
+            if col in ENCODED_COLUMNS:
+                values = store.dictionaries[col][0]
+                columns[col] = [values[x] if x >= 0 else None for x in arr]
+            elif col in TIMESTAMP_COLUMNS:
+                columns[col] = arr.tolist()
+            elif col in NUMERIC_COLUMNS:
+                cast = int if col == 'number' else float
+                columns[col] = [None if np.isnan(x) else cast(x) for x in arr]
+            elif col in MULTI_COLUMNS.values():
+                columns[col] = [list(x) for x in arr]
+            else:
+                columns[col] = arr.tolist()
+        return [dict(zip(cols, values)) for values in zip(*[columns[x] for x in cols])]
@@ -15,6 +15,7 @@ import json
 import logging
 import os
 import time
+from collections import defaultdict
 from datetime import timezone
 import jira
 
@@ -24,6 +25,8 @@ import concurrent.futures
 
 from logzero import logger
 
+from backlog_queries import as_day
+from backlog_queries import issue_backlog_days
 from constants import PROJECTS, ISSUE_COLUMN_NAMES
 from database import JiraDatabaseWrapper
 from utils import (
@@ -59,28 +62,48 @@ class JiraWrapper:
 
     def __init__(self):
 
-        self.dcw = DiskCacheWrapper(self.cachedir)
-
         self.project = None
         self.processed = {}
         self.ids = []
 
         self.jdbw = JiraDatabaseWrapper()
-        self.conn = self.jdbw.get_connection()
-        atexit.register(self.conn.close)
-
-        jira_token = os.environ.get('JIRA_TOKEN')
-        if not jira_token:
-            raise Exception('JIRA_TOKEN must be set!')
-        logger.info('start jira client')
-        self.jira_client = jira.JIRA(
-            {'server': 'https://issues.redhat.com'},
-            token_auth=jira_token
-        )
 
-        # validate auth ...
-        if not os.environ.get("SKIP_JIRA_CONNECTION"):
-            self.jira_client.myself()
+        # the cache, db connection and jira client are built on first use
+        self._dcw = None
+        self._conn = None
+        self._jira_client = None
+
+    @property
+    def dcw(self):
+        if self._dcw is None:
+            self._dcw = DiskCacheWrapper(self.cachedir)
+        return self._dcw
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = self.jdbw.get_connection()
+            atexit.register(self._conn.close)
+        return self._conn
+
+    @property
+    def jira_client(self):
+        if self._jira_client is None:
+            jira_token = os.environ.get('JIRA_TOKEN')
+            if not jira_token:
+                raise Exception('JIRA_TOKEN must be set!')
+            logger.info('start jira client')
+            jira_client = jira.JIRA(
+                {'server': 'https://issues.redhat.com'},
+                token_auth=jira_token
+            )
+
+            # validate auth ...
+            if not os.environ.get("SKIP_JIRA_CONNECTION"):
+                jira_client.myself()
+
+            self._jira_client = jira_client
+        return self._jira_client
 
     '''
     def load_issues_and_events_from_disk(self):
@@ -114,6 +137,7 @@ class JiraWrapper:
 
         logger.info('scrape jira issues')
         self.scrape_jira_issues(full=full, limit=limit, no_events=no_events)
+        self.jdbw.refresh_facet_counts()
         #self.process_relationships()
 
     def map_relationships(self, project=None, projects=None, clean=True):
@@ -132,8 +156,8 @@ class JiraWrapper:
           key VARCHAR(50),
           created TIMESTAMP,
           data JSONB,
-          CONSTRAINT unique_eventid UNIQUE (id)
-        );
+          CONSTRAINT unique_eventid UNIQUE (id, created)
+        ) PARTITION BY RANGE (created);
         '''
         """
 
@@ -173,104 +197,128 @@ class JiraWrapper:
             datawrappers = [DataWrapper(x['datafile']) for x in rows]
 
         with self.conn.cursor() as cur:
-            for dw in datawrappers:
-
-                if projects and dw.project not in projects:
-                    continue
-
-                # TBD: use the outter scraper to only process what was fetched
-                if ids and dw.id not in ids:
-                    continue
-
-                if not dw.events:
-                    continue
-
-                if logit:
-                    logger.info(f'map events for {dw.key}:{dw.datafile}')
-
-                key = dw.key
-                project = dw.project
-                number = dw.number
-
-                if dw.history is None:
-                    continue
-
-                history = dw.events
-
-                # get the first key in the key
-                this_key = key
-                this_project = project
-                this_number = number
-
-                for event_group in history:
-                    for eid,event_item in enumerate(event_group['items']):
-                        if event_item['field'] == 'Key':
-                            this_key = event_item['fromString']
-                            this_project = this_key.split('-')[0]
-                            this_number = int(this_key.split('-')[1])
-
-                # 2023-03-28T16:09:38.233+0000
-                created = dw.fields['created']
-                create_event = {
-                    'id': dw.id + '_OPENED',
-                    'author': {
-                        'displayName': dw.fields['creator']['displayName'],
-                        'key': dw.fields['creator']['key'],
-                        'name': dw.fields['creator']['name'],
-                    },
-                    'created': created,
-                    'items': [
-                        {
-                            'field': 'status',
-                            'fieldtype': 'jira',
-                            'from': None,
-                            'fromString': None,
-                            'to': 'new',
-                            'toString': 'New',
-                        }
-                    ]
-                }
-                history.insert(0, create_event)
-
-                for event_group in history:
-                    author = event_group['author']['name']
-                    created = event_group['created']
-                    id_prefix = event_group['id']
-                    for eid,event_item in enumerate(event_group['items']):
-                        this_id = id_prefix + "_" + str(eid)
-                        if this_id is None:
-                            continue
-                        if this_id in idmap:
-                            continue
-
-                        cur.execute(
-                            '''INSERT INTO jira_issue_events (
-                                id,
-                                author,
-                                project,
-                                number,
-                                key,
-                                created,
-                                data
-                            ) VALUES (
-                                %s, %s, %s, %s, %s, %s, %s
-                            )''',
-                            (
-                                this_id, author,
-                                this_project,
-                                this_number,
-                                this_key,
-                                created,
-                                json.dumps(event_item),
+            try:
+                for dw in datawrappers:
+
+                    if projects and dw.project not in projects:
+                        continue
+
+                    # TBD: use the outter scraper to only process what was fetched
+                    if ids and dw.id not in ids:
+                        continue
+
+                    if not dw.events:
+                        continue
+
+                    if logit:
+                        logger.info(f'map events for {dw.key}:{dw.datafile}')
+
+                    key = dw.key
+                    project = dw.project
+                    number = dw.number
+
+                    if dw.history is None:
+                        continue
+
+                    history = dw.events
+
+                    # get the first key in the key
+                    this_key = key
+                    this_project = project
+                    this_number = number
+
+                    for event_group in history:
+                        for eid,event_item in enumerate(event_group['items']):
+                            if event_item['field'] == 'Key':
+                                this_key = event_item['fromString']
+                                this_project = this_key.split('-')[0]
+                                this_number = int(this_key.split('-')[1])
+
+                    # 2023-03-28T16:09:38.233+0000
+                    created = dw.fields['created']
+                    create_event = {
+                        'id': dw.id + '_OPENED',
+                        'author': {
+                            'displayName': dw.fields['creator']['displayName'],
+                            'key': dw.fields['creator']['key'],
+                            'name': dw.fields['creator']['name'],
+                        },
+                        'created': created,
+                        'items': [
+                            {
+                                'field': 'status',
+                                'fieldtype': 'jira',
+                                'from': None,
+                                'fromString': None,
+                                'to': 'new',
+                                'toString': 'New',
+                            }
+                        ]
+                    }
+                    history.insert(0, create_event)
+
+                    # projects whose events changed, plus the issue's current one
+                    # since its reports count moves in from other projects
+                    touched = set()
+                    # (project, days) of the backlog rollup the new events count on
+                    touched_days = defaultdict(set)
+
+                    for event_group in history:
+                        author = event_group['author']['name']
+                        created = event_group['created']
+                        id_prefix = event_group['id']
+                        for eid,event_item in enumerate(event_group['items']):
+                            this_id = id_prefix + "_" + str(eid)
+                            if this_id is None:
+                                continue
+                            if this_id in idmap:
+                                continue
+
+                            self.jdbw.ensure_event_partition(cur, created)
+                            cur.execute(
+                                '''INSERT INTO jira_issue_events (
+                                    id,
+                                    author,
+                                    project,
+                                    number,
+                                    key,
+                                    created,
+                                    data
+                                ) VALUES (
+                                    %s, %s, %s, %s, %s, %s, %s
+                                )''',
+                                (
+                                    this_id, author,
+                                    this_project,
+                                    this_number,
+                                    this_key,
+                                    created,
+                                    json.dumps(event_item),
+                                )
                             )
-                        )
+                            touched.add(this_project)
+                            touched_days[this_project].add(as_day(created))
+
+                            # iterate to the next key
+                            if event_item['field'] == 'Key':
+                                this_key = event_item['toString']
+                                this_project = this_key.split('-')[0]
+                                this_number = int(this_key.split('-')[1])
+                                # a move also counts for the project it lands in
+                                touched_days[this_project].add(as_day(created))
+
+                    # an issue's new events, the rollup days they count on and the
+                    # version bumps commit together, or not at all
+                    if touched:
+                        touched.add(project)
+                        self.jdbw.refresh_backlog_days(cur, touched_days)
+                        for _project in sorted(touched):
+                            self.jdbw.bump_data_version(cur, _project, keys=[key])
                         self.conn.commit()
-
-                        # iterate to the next key
-                        if event_item['field'] == 'Key':
-                            this_key = event_item['toString']
-                            this_project = this_key.split('-')[0]
-                            this_number = int(this_key.split('-')[1])
+            except Exception:
+                # leave nothing of a half mapped issue for a later commit
+                self.conn.rollback()
+                raise
 
     def get_issue_with_history(self, issue_key, fallback=False):
 
@@ -395,7 +443,9 @@ class JiraWrapper:
         # when was it last fetched?
         with self.conn.cursor() as cur:
             cur.execute(
-                'SELECT project,number,fetched,history FROM jira_issues WHERE project=%s AND number=%s',
+                'SELECT project,number,fetched,history FROM jira_issues'
+                ' LEFT JOIN jira_issue_histories ON jira_issue_histories.issue_id = jira_issues.id'
+                ' WHERE project=%s AND number=%s',
                 (project, number)
             )
             rows = cur.fetchall()
@@ -625,14 +675,37 @@ class JiraWrapper:
 
         with self.conn.cursor() as cur:
             try:
+                # the backlog days the issue was counted on before this write
+                cur.execute(
+                    'SELECT project, created, updated, closed, state FROM jira_issues WHERE id = %s',
+                    (dw.id,)
+                )
+                row = cur.fetchone()
+                touched = defaultdict(set)
+                if row:
+                    old = dict(zip(['project', 'created', 'updated', 'closed', 'state'], row))
+                    touched[old['project']] |= issue_backlog_days(old)
+
                 cur.execute(
                     qs,
                     tuple(args)
                 )
+                self.jdbw.store_issue_history(cur, dw.id, dw.history)
+                self.jdbw.store_issue_facets(cur, dw.id)
+
+                new = {x: getattr(dw, x) for x in ['created', 'updated', 'closed', 'state']}
+                touched[dw.project] |= issue_backlog_days(new)
+                self.jdbw.refresh_backlog_days(cur, touched)
+
+                self.jdbw.bump_data_version(cur, dw.project, keys=[dw.key])
                 self.conn.commit()
             except psycopg.errors.UniqueViolation as e:
                 logger.exception(e)
-                cur.execute('rollback')
+                self.conn.rollback()
+            except Exception:
+                # the sync shares this connection, do not leave it aborted
+                self.conn.rollback()
+                raise
 
         return dw
 
@@ -0,0 +1,736 @@
+#!/usr/bin/env python3
+
+"""
+jql.py - a JQL dialect compiled to parameterized sql over jira_issues.
+
+    project = AAP AND status != Closed AND (labels IN (galaxy, hub) OR assignee IS EMPTY)
+    ORDER BY updated DESC
+
+query_compile() turns a query like that into a SELECT with %s placeholders
+and a list of params. Values never end up in the sql text, so every query of
+the same shape produces the same statement and postgres can reuse its plan.
+
+Grammar, loosest binding first. Clauses next to each other without an
+operator are ANDed, as the old regex parser did:
+
+    query    := [or_expr] [ORDER BY sort_key (, sort_key)*] [LIMIT number]
+    or_expr  := and_expr (OR and_expr)*
+    and_expr := not_expr ([AND] not_expr)*
+    not_expr := NOT not_expr | ( or_expr ) | clause
+    clause   := field op value
+              | field [NOT] IN ( value (, value)* )
+              | field IS [NOT] (EMPTY | NULL)
+    op       := = | != | < | > | <= | >= | ~ | !~
+    value    := "string" | 'string' | word | function ( [value (, value)*] )
+    sort_key := field [ASC | DESC]
+
+Fields are matched case insensitively against the jira_issues columns and
+their usual jira names, labels/components/fixVersions go through the facet
+side tables, and anything else is resolved with the field registry and read
+out of the data blob. text ~ "..." is a full text search over summaries,
+descriptions and comments, ranked best match first unless there is an
+ORDER BY.
+"""
+
+import functools
+import os
+import re
+
+from dataclasses import dataclass
+from dataclasses import field as dataclass_field
+
+
+class JQLError(ValueError):
+    """The query can not be parsed or compiled."""
+
+
+# -- lexer -------------------------------------------------------------------
+
+TOKEN_SPEC = [
+    ('WS', r'\s+'),
+    ('STRING', r'"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\''),
+    ('OP', r'!=|!~|>=|<=|=|~|>|<'),
+    ('LPAREN', r'\('),
+    ('RPAREN', r'\)'),
+    ('COMMA', r','),
+    ('WORD', r'[^\s"\'(),=!~<>]+'),
+]
+TOKEN_RE = re.compile('|'.join(f'(?P<{name}>{pattern})' for name, pattern in TOKEN_SPEC))
+
+
+@dataclass
+class Token:
+    type: str
+    value: str
+    pos: int
+    end: int = None
+
+
+def tokenize(query):
+    tokens = []
+    pos = 0
+    while pos < len(query):
+        match = TOKEN_RE.match(query, pos)
+        if match is None:
+            raise JQLError(f'unexpected character {query[pos]!r} at {pos}')
+        kind = match.lastgroup
+        value = match.group()
+        if kind == 'STRING':
+            value = re.sub(r'\\(.)', r'\1', value[1:-1])
+        if kind != 'WS':
+            tokens.append(Token(kind, value, pos, match.end()))
+        pos = match.end()
+    return tokens
+
+
+# -- ast ---------------------------------------------------------------------
+
+@dataclass
+class Function:
+    name: str
+    args: list
+
+
+@dataclass
+class Clause:
+    field: str
+    op: str
+    # a str, a Function, a list of those for IN, or None for EMPTY
+    value: object
+
+
+@dataclass
+class And:
+    items: list
+
+
+@dataclass
+class Or:
+    items: list
+
+
+@dataclass
+class Not:
+    item: object
+
+
+@dataclass
+class SortKey:
+    field: str
+    direction: str = 'ASC'
+
+
+@dataclass
+class Query:
+    where: object = None
+    order_by: list = dataclass_field(default_factory=list)
+    limit: int = None
+
+
+# -- parser ------------------------------------------------------------------
+
+class Parser:
+
+    def __init__(self, query):
+        self.query = query
+        self.tokens = tokenize(query)
+        self.pos = 0
+
+    def peek(self, offset=0):
+        idx = self.pos + offset
+        if idx < len(self.tokens):
+            return self.tokens[idx]
+        return None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise JQLError('unexpected end of query')
+        self.pos += 1
+        return token
+
+    def expect(self, kind):
+        token = self.next()
+        if token.type != kind:
+            raise JQLError(f'expected {kind.lower()} at {token.pos}, got {token.value!r}')
+        return token
+
+    def is_keyword(self, name, offset=0):
+        token = self.peek(offset)
+        return token is not None and token.type == 'WORD' and token.value.upper() == name
+
+    def accept_keyword(self, name):
+        if self.is_keyword(name):
+            self.pos += 1
+            return True
+        return False
+
+    def parse(self):
+        query = Query()
+        if self.peek() is not None and not self.is_keyword('ORDER') and not self.is_keyword('LIMIT'):
+            query.where = self.parse_or()
+        if self.accept_keyword('ORDER'):
+            if not self.accept_keyword('BY'):
+                raise JQLError('expected BY after ORDER')
+            query.order_by = self.parse_order_by()
+        if self.accept_keyword('LIMIT'):
+            token = self.next()
+            if token.type != 'WORD' or not token.value.isdigit() or int(token.value) < 1:
+                raise JQLError(f'LIMIT takes a positive number, got {token.value!r}')
+            query.limit = int(token.value)
+        if self.peek() is not None:
+            token = self.peek()
+            raise JQLError(f'unexpected {token.value!r} at {token.pos}')
+        return query
+
+    def parse_order_by(self):
+        keys = []
+        while True:
+            token = self.next()
+            if token.type not in ['WORD', 'STRING']:
+                raise JQLError(f'expected a field to order by at {token.pos}')
+            key = SortKey(token.value)
+            if self.accept_keyword('ASC'):
+                key.direction = 'ASC'
+            elif self.accept_keyword('DESC'):
+                key.direction = 'DESC'
+            keys.append(key)
+            if self.peek() is None or self.peek().type != 'COMMA':
+                return keys
+            self.next()
+
+    def parse_or(self):
+        items = [self.parse_and()]
+        while self.accept_keyword('OR'):
+            items.append(self.parse_and())
+        if len(items) == 1:
+            return items[0]
+        return Or(items)
+
+    def starts_expression(self):
+        token = self.peek()
+        if token is None:
+            return False
+        if token.type in ['LPAREN', 'STRING']:
+            return True
+        return token.type == 'WORD' and token.value.upper() not in ['OR', 'ORDER', 'LIMIT']
+
+    def parse_and(self):
+        items = [self.parse_not()]
+        while True:
+            if self.accept_keyword('AND'):
+                items.append(self.parse_not())
+            elif self.starts_expression():
+                items.append(self.parse_not())
+            else:
+                break
+        if len(items) == 1:
+            return items[0]
+        return And(items)
+
+    def parse_not(self):
+        if self.accept_keyword('NOT'):
+            return Not(self.parse_not())
+        token = self.peek()
+        if token is not None and token.type == 'LPAREN':
+            self.next()
+            expr = self.parse_or()
+            self.expect('RPAREN')
+            return expr
+        return self.parse_clause()
+
+    def parse_clause(self):
+        token = self.next()
+        if token.type not in ['WORD', 'STRING']:
+            raise JQLError(f'expected a field at {token.pos}, got {token.value!r}')
+        field = token.value
+
+        if self.accept_keyword('IN'):
+            return Clause(field, 'in', self.parse_list())
+        if self.is_keyword('NOT') and self.is_keyword('IN', offset=1):
+            self.pos += 2
+            return Clause(field, 'not in', self.parse_list())
+        if self.accept_keyword('IS'):
+            op = 'is not' if self.accept_keyword('NOT') else 'is'
+            if not (self.accept_keyword('EMPTY') or self.accept_keyword('NULL')):
+                raise JQLError(f'expected EMPTY after {field} {op.upper()}')
+            return Clause(field, op, None)
+
+        token = self.next()
+        if token.type != 'OP':
+            raise JQLError(f'expected an operator after {field} at {token.pos}, got {token.value!r}')
+        op = token.value
+        value = self.parse_value()
+        if value is None and op == '=':
+            op = 'is'
+        elif value is None and op == '!=':
+            op = 'is not'
+        elif value is None:
+            raise JQLError(f'EMPTY can not be used with {op}')
+        return Clause(field, op, value)
+
+    def parse_list(self):
+        self.expect('LPAREN')
+        values = [self.parse_value()]
+        while self.peek() is not None and self.peek().type == 'COMMA':
+            self.next()
+            values.append(self.parse_value())
+        self.expect('RPAREN')
+        if None in values:
+            raise JQLError('EMPTY can not be used in a list')
+        return values
+
+    def parse_value(self):
+        token = self.next()
+        if token.type == 'STRING':
+            return token.value
+        if token.type != 'WORD':
+            raise JQLError(f'expected a value at {token.pos}, got {token.value!r}')
+        if token.value.upper() in ['EMPTY', 'NULL']:
+            return None
+        # a call has its paren right after the name, "AAP (" starts a group
+        following = self.peek()
+        if following is not None and following.type == 'LPAREN' and following.pos == token.pos + len(token.value):
+            self.next()
+            args = []
+            if self.peek() is not None and self.peek().type != 'RPAREN':
+                args.append(self.parse_value())
+                while self.peek() is not None and self.peek().type == 'COMMA':
+                    self.next()
+                    args.append(self.parse_value())
+            self.expect('RPAREN')
+            return Function(token.value, args)
+        return token.value
+
+
+# the old parser's v2 marker means nothing to this one
+SCHEME_MARKER = [('WORD', 'jql_scheme'), ('OP', '='), ('WORD', '2')]
+
+
+def quote_string(value):
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def normalize_query(query):
+    """The query spelled from its tokens.
+
+    Tokens that touched still do, whitespace between others becomes one
+    space, so a call keeps its paren next to the name. Quoted strings keep
+    their contents. Raises JQLError like tokenize.
+    """
+    tokens = tokenize(query or '')
+    text = ''
+    end = None
+    pos = 0
+    while pos < len(tokens):
+        if [(x.type, x.value) for x in tokens[pos:pos + 3]] == SCHEME_MARKER:
+            pos += 3
+            end = None
+            continue
+        token = tokens[pos]
+        if text and token.pos != end:
+            text += ' '
+        text += quote_string(token.value) if token.type == 'STRING' else token.value
+        end = token.end
+        pos += 1
+    return text
+
+
+def parse(query):
+    return Parser(normalize_query(query)).parse()
+
+
+# -- compiler ----------------------------------------------------------------
+
+TEXT = 'text'
+TIMESTAMP = 'timestamp'
+NUMERIC = 'numeric'
+
+# jql name (lower case) -> (sql expression, type)
+SCALAR_FIELDS = {
+    'id': ('id', TEXT),
+    'project': ('project', TEXT),
+    'key': ('key', TEXT),
+    'issuekey': ('key', TEXT),
+    'number': ('number', NUMERIC),
+    'status': ('state', TEXT),
+    'state': ('state', TEXT),
+    'type': ('type', TEXT),
+    'issuetype': ('type', TEXT),
+    'priority': ('priority', TEXT),
+    'assignee': ('assigned_to', TEXT),
+    'assigned_to': ('assigned_to', TEXT),
+    'reporter': ('created_by', TEXT),
+    'creator': ('created_by', TEXT),
+    'created_by': ('created_by', TEXT),
+    'summary': ('summary', TEXT),
+    'description': ('description', TEXT),
+    'comments': ("data->'fields'->'comment'->>'comments'", TEXT),
+    'created': ('created', TIMESTAMP),
+    'createddate': ('created', TIMESTAMP),
+    'updated': ('updated', TIMESTAMP),
+    'updateddate': ('updated', TIMESTAMP),
+    'closed': ('closed', TIMESTAMP),
+    'resolved': ('closed', TIMESTAMP),
+    'resolutiondate': ('closed', TIMESTAMP),
+    'sfdc_count': ('sfdc_count', NUMERIC),
+    'parent': ('parent', TEXT),
+    'parent_link': ('parent_link', TEXT),
+    'epic_link': ('epic_link', TEXT),
+    'feature_link': ('feature_link', TEXT),
+}
+
+# jql name (lower case) -> (facet side table, value column)
+MULTI_FIELDS = {
+    'label': ('issue_labels', 'label'),
+    'labels': ('issue_labels', 'label'),
+    'component': ('issue_components', 'component'),
+    'components': ('issue_components', 'component'),
+    'fixversion': ('issue_fix_versions', 'fix_version'),
+    'fixversions': ('issue_fix_versions', 'fix_version'),
+    'fix_version': ('issue_fix_versions', 'fix_version'),
+    'fix_versions': ('issue_fix_versions', 'fix_version'),
+}
+
+# the full text search column, summary, description and comment bodies
+SEARCH_FIELDS = ['text']
+SEARCH_COLUMN = 'search_vector'
+SEARCH_CONFIG = 'english'
+
+# jira field ids that have their own column -> jql name above
+FIELD_ID_ALIASES = {
+    'customfield_12313140': 'parent_link',
+    'customfield_12311140': 'epic_link',
+    'customfield_12318341': 'feature_link',
+    'customfield_12313440': 'sfdc_count',
+    'fixVersions': 'fixversions',
+    'labels': 'labels',
+    'components': 'components',
+}
+
+DEFAULT_COLUMNS = [
+    'key',
+    'created',
+    'updated',
+    'created_by',
+    'assigned_to',
+    'type',
+    'priority',
+    'state',
+    'labels',
+    'components',
+    'sfdc_count',
+    'summary'
+]
+
+# compiled queries kept by query_compile
+QUERY_CACHE_SIZE = int(os.environ.get('JQL_CACHE_SIZE', 512))
+
+# timestamps in jira_issues are utc wall clock times without a zone
+NOW_SQL = "(now() AT TIME ZONE 'UTC')"
+
+DATE_FUNCTIONS = {
+    'startofday': 'day',
+    'startofweek': 'week',
+    'startofmonth': 'month',
+    'startofyear': 'year',
+    'endofday': 'day',
+    'endofweek': 'week',
+    'endofmonth': 'month',
+    'endofyear': 'year',
+}
+
+DURATION_RE = re.compile(r'^([+-]?)(\d+)([yMwdhm])$')
+DURATION_UNITS = {
+    'y': 'years',
+    'M': 'months',
+    'w': 'weeks',
+    'd': 'days',
+    'h': 'hours',
+    'm': 'minutes',
+}
+
+
+def parse_duration(value):
+    """Turn a jira relative date like -30d or 2w into a postgres interval."""
+    match = DURATION_RE.match(value)
+    if match is None:
+        return None
+    sign, amount, unit = match.groups()
+    return f"{'-' if sign == '-' else ''}{amount} {DURATION_UNITS[unit]}"
+
+
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+# the field registry resolve_field fell back to, set on first use
+_default_fields = None
+
+
+def resolve_field(name, fields=None):
+    """Map a jql field name to what holds it.
+
+    Returns ('scalar', column, type), ('multi', side table, value column),
+    ('search', tsvector column, TEXT) or, for fields without a column of
+    their own, ('data', field id, TEXT).
+    """
+    global _default_fields
+    lname = name.lower()
+    if lname in SEARCH_FIELDS:
+        return ('search', SEARCH_COLUMN, TEXT)
+    if lname in MULTI_FIELDS:
+        return ('multi',) + MULTI_FIELDS[lname]
+    if lname in SCALAR_FIELDS:
+        return ('scalar',) + SCALAR_FIELDS[lname]
+
+    if fields is None:
+        from field_registry import FIELDS
+        fields = _default_fields = FIELDS
+
+    field_id = fields.resolve(name)
+    if field_id is None:
+        raise JQLError(f'unknown field {name!r}')
+    if field_id in FIELD_ID_ALIASES:
+        return resolve_field(FIELD_ID_ALIASES[field_id], fields=fields)
+
+    return ('data', field_id, TEXT)
+
+
+class Compiler:
+
+    def __init__(self, fields=None):
+        self.fields = fields
+        self.params = []
+        self.search_terms = []
+
+    def param(self, value, cast=''):
+        self.params.append(value)
+        return f'%s{cast}'
+
+    def resolve_field(self, name):
+        """Map a jql field to ('scalar', expression, type) or ('multi', table, column)."""
+        resolved = resolve_field(name, fields=self.fields)
+        if resolved[0] == 'data':
+            return ('scalar', f"data->'fields'->>{self.param(resolved[1])}", TEXT)
+        return resolved
+
+    def compile(self, node):
+        if isinstance(node, And):
+            return '(' + ' AND '.join(self.compile(x) for x in node.items) + ')'
+        if isinstance(node, Or):
+            return '(' + ' OR '.join(self.compile(x) for x in node.items) + ')'
+        if isinstance(node, Not):
+            return f'NOT {self.compile(node.item)}'
+        return self.compile_clause(node)
+
+    def compile_clause(self, clause):
+        resolved = self.resolve_field(clause.field)
+        if resolved[0] == 'multi':
+            return self.compile_multi(clause, resolved[1], resolved[2])
+        if resolved[0] == 'search':
+            return self.compile_search(clause, resolved[1])
+        return self.compile_scalar(clause, resolved[1], resolved[2])
+
+    def compile_search(self, clause, column):
+        if clause.op not in ['~', '!~'] or not isinstance(clause.value, str):
+            raise JQLError(f'{clause.field} only supports ~ and !~ with a string')
+        tsquery = f"websearch_to_tsquery('{SEARCH_CONFIG}', {self.param(clause.value)})"
+        if clause.op == '!~':
+            return f'NOT {column} @@ {tsquery}'
+        self.search_terms.append(clause.value)
+        return f'{column} @@ {tsquery}'
+
+    def compile_rank(self):
+        """Best matches first for queries that searched text without an ORDER BY."""
+        terms = ' '.join(self.search_terms)
+        return f"ts_rank({SEARCH_COLUMN}, websearch_to_tsquery('{SEARCH_CONFIG}', {self.param(terms)})) DESC"
+
+    def compile_value(self, value, coltype):
+        if isinstance(value, Function):
+            return self.compile_function(value, coltype)
+        if coltype == TIMESTAMP:
+            interval = parse_duration(value)
+            if interval is not None:
+                return f'{NOW_SQL} + {self.param(interval, "::interval")}'
+            return self.param(value, '::timestamp')
+        if coltype == NUMERIC:
+            return self.param(value, '::numeric')
+        return self.param(value)
+
+    def compile_function(self, func, coltype):
+        name = func.name.lower()
+        if coltype != TIMESTAMP:
+            raise JQLError(f'{func.name}() can only be compared with dates')
+        if len(func.args) > 1:
+            raise JQLError(f'{func.name}() takes at most one argument')
+
+        if name == 'now':
+            if func.args:
+                raise JQLError('now() takes no arguments')
+            return NOW_SQL
+
+        if name not in DATE_FUNCTIONS:
+            raise JQLError(f'unknown function {func.name}()')
+
+        unit = DATE_FUNCTIONS[name]
+        sql = f"date_trunc('{unit}', {NOW_SQL})"
+        if name.startswith('end'):
+            sql += f" + interval '1 {unit}' - interval '1 microsecond'"
+        if func.args:
+            interval = parse_duration(func.args[0]) if isinstance(func.args[0], str) else None
+            if interval is None:
+                raise JQLError(f'{func.name}() takes an offset like -1d')
+            sql += f' + {self.param(interval, "::interval")}'
+        return f'({sql})'
+
+    def compile_scalar(self, clause, col, coltype):
+        op = clause.op
+        value = clause.value
+
+        if op == 'is':
+            return f'{col} IS NULL'
+        if op == 'is not':
+            return f'{col} IS NOT NULL'
+
+        if op in ['in', 'not in']:
+            if any(isinstance(x, Function) for x in value):
+                raise JQLError('functions can not be used in a list')
+            cast = {TIMESTAMP: '::timestamp[]', NUMERIC: '::numeric[]'}.get(coltype, '')
+            placeholder = self.param(list(value), cast)
+            if op == 'in':
+                return f'{col} = ANY({placeholder})'
+            return f'{col} <> ALL({placeholder})'
+
+        if op in ['~', '!~']:
+            if coltype != TEXT or isinstance(value, Function):
+                raise JQLError(f'{clause.field} does not support {op}')
+            placeholder = self.param('%' + escape_like(value) + '%')
+            if op == '~':
+                return f'{col} ILIKE {placeholder}'
+            return f'{col} NOT ILIKE {placeholder}'
+
+        return f'{col} {op} {self.compile_value(value, coltype)}'
+
+    def compile_multi(self, clause, table, column):
+        op = clause.op
+        value = clause.value
+
+        subquery = f'SELECT 1 FROM {table} WHERE {table}.issue_id = jira_issues.id'
+
+        if op == 'is':
+            return f'NOT EXISTS ({subquery})'
+        if op == 'is not':
+            return f'EXISTS ({subquery})'
+        if isinstance(value, Function) or (isinstance(value, list) and any(isinstance(x, Function) for x in value)):
+            raise JQLError(f'{clause.field} does not support functions')
+
+        if op in ['=', '!=']:
+            condition = f'{column} = {self.param(value)}'
+        elif op in ['in', 'not in']:
+            condition = f'{column} = ANY({self.param(list(value))})'
+        elif op in ['~', '!~']:
+            condition = f"{column} ILIKE {self.param('%' + escape_like(value) + '%')}"
+        else:
+            raise JQLError(f'{clause.field} does not support {op}')
+
+        if op in ['!=', 'not in', '!~']:
+            return f'NOT EXISTS ({subquery} AND {condition})'
+        return f'EXISTS ({subquery} AND {condition})'
+
+    def compile_order_by(self, keys):
+        terms = []
+        for key in keys:
+            resolved = self.resolve_field(key.field)
+            if resolved[0] != 'scalar':
+                raise JQLError(f'can not order by {key.field}')
+            if key.direction.upper() not in ['ASC', 'DESC']:
+                raise JQLError(f'unknown sort direction {key.direction!r}')
+            terms.append(f'{resolved[1]} {key.direction.upper()}')
+        return ', '.join(terms)
+
+
+def compile_query(query, cols=None, fields=None, limit=None, order_by=None):
+    """Compile a parsed Query into (sql, params).
+
+    limit caps the rows on top of the query's own LIMIT, order_by is a list
+    of (field, direction) used when the query has no ORDER BY of its own.
+    """
+
+    if cols is None:
+        cols = DEFAULT_COLUMNS
+
+    compiler = Compiler(fields=fields)
+
+    sql = f"SELECT {','.join(cols)} FROM jira_issues"
+    if query.where is not None:
+        where = compiler.compile(query.where)
+        if where.startswith('(') and where.endswith(')') and isinstance(query.where, (And, Or)):
+            where = where[1:-1]
+        sql += f' WHERE {where}'
+    if query.order_by:
+        sql += f' ORDER BY {compiler.compile_order_by(query.order_by)}'
+    elif compiler.search_terms:
+        sql += f' ORDER BY {compiler.compile_rank()}'
+    elif order_by:
+        sql += f' ORDER BY {compiler.compile_order_by([SortKey(*x) for x in order_by])}'
+
+    limits = [x for x in [query.limit, limit] if x is not None]
+    if limits:
+        sql += f' LIMIT {compiler.param(min(limits))}'
+
+    return sql, compiler.params
+
+
+@functools.lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _cached_compile(query, cols, fields, limit, order_by, fields_generation):
+    sql, params = compile_query(
+        parse(query),
+        cols=list(cols) if cols is not None else None,
+        fields=fields,
+        limit=limit,
+        order_by=order_by
+    )
+    return sql, tuple(params)
+
+
+def query_compile(query, cols=None, fields=None, limit=None, order_by=None):
+    """Parse and compile a JQL string into (sql, params) for cur.execute.
+
+    Results are kept in an LRU cache keyed on the whitespace normalized query
+    and the column list, so a dashboard refreshing the same queries skips
+    the parser. The key includes the load generation of the field registry,
+    so a reloaded fields.json recompiles queries naming custom fields. Errors
+    are not cached. The params list is a fresh copy and can be appended to.
+    See compile_query for limit and order_by.
+    """
+    # no cached query depends on the default registry before it is first used
+    registry = fields if fields is not None else _default_fields
+    fields_generation = None
+    if registry is not None:
+        registry.reload_if_changed()
+        fields_generation = registry.generation
+
+    sql, params = _cached_compile(
+        normalize_query(query),
+        tuple(cols) if cols is not None else None,
+        fields,
+        limit,
+        tuple(tuple(x) for x in order_by) if order_by else None,
+        fields_generation
+    )
+    return sql, list(params)
+
+
+def query_cache_stats():
+    info = _cached_compile.cache_info()
+    return {
+        'entries': info.currsize,
+        'max_entries': info.maxsize,
+        'hits': info.hits,
+        'misses': info.misses,
+    }
+
+
+def query_cache_clear():
+    _cached_compile.cache_clear()
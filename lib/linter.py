@@ -1,29 +1,21 @@
 #!/usr/bin/env python
 
 import argparse
-import atexit
 import json
 
-from jira_wrapper import JiraWrapper
 from database import JiraDatabaseWrapper
 from tree import make_tickets_tree
 from tree import make_child_tree
 from tree import _get_issue_map
 from tree import _make_nodes
 from utils import sortable_key_from_ikey
-from query_parser import query_parse
+from jql import query_compile
+from field_registry import FIELDS
 
 from logzero import logger
 
 
 jdbw = JiraDatabaseWrapper()
-conn = jdbw.get_connection()
-atexit.register(conn.close)
-
-
-with open('lib/static/json/fields.json', 'r') as f:
-    FIELD_MAP = json.loads(f.read())
-FIELD_MAP = dict((x['name'], x) for x in FIELD_MAP)
 
 AAP_PROJECTS = ['AA', 'AAP', 'AAH']
 
@@ -272,7 +264,7 @@ def rule_collaborative_delivery_hierarchy(tree, imap, key):
 
     this_project = imap[key]['project']
 
-    parent_link_field = FIELD_MAP['Parent Link']['id']
+    parent_link_field = FIELDS.get_by_name('Parent Link')['id']
     parent_link = imap[key]['data']['fields'][parent_link_field]
     parent_project = None
     parent_type = None
@@ -280,7 +272,7 @@ def rule_collaborative_delivery_hierarchy(tree, imap, key):
         parent_type = imap[parent_link]['type']
         parent_project = imap[parent_link]['project']
 
-    epic_link_field = FIELD_MAP['Epic Link']['id']
+    epic_link_field = FIELDS.get_by_name('Epic Link')['id']
     epic_link = imap[key]['data']['fields'][epic_link_field]
     epic_project = None
     epic_type = None
@@ -357,25 +349,20 @@ class Linter:
             self.keys.append(self.key)
 
         if self.project or jql:
+            # sorted by postgres, a jql ORDER BY and LIMIT pick what gets linted
             if self.project:
-                sql = f"SELECT key FROM jira_issues WHERE project=%s AND state!='Closed'"
+                sql = "SELECT key FROM jira_issues WHERE project=%s AND state!='Closed' ORDER BY project, number"
                 sargs = (self.project,)
             else:
-                sql = query_parse(jql, cols=['key'], debug=False)
-                sargs = None
+                sql, sargs = query_compile(jql, cols=['key'], order_by=[('project', 'ASC'), ('number', 'ASC')])
 
             rows = []
-            with conn.cursor() as cur:
-                if sargs:
-                    cur.execute(sql, sargs)
-                else:
-                    cur.execute(sql)
+            with jdbw.connection() as conn, conn.cursor() as cur:
+                cur.execute(sql, sargs)
                 results = cur.fetchall()
                 for row in results:
-                    self.keys.append(row[0])
-
-            self.keys = sorted(set(self.keys))
-            self.keys = sorted(self.keys, key=lambda x: sortable_key_from_ikey(x))
+                    if row[0] not in self.keys:
+                        self.keys.append(row[0])
 
         for key in self.keys:
             self.lint_key(key)
@@ -400,49 +387,32 @@ class Linter:
         return make_child_tree(filter_key=filter_key, show_closed=True, map_progress=True, tree=tree, debug=False)
 
     def get_issue(self, key):
-        sql = f"SELECT * FROM jira_issues WHERE key='{key}'"
-        rows = []
-        with conn.cursor() as cur:
-            cur.execute(sql)
-            results = cur.fetchall()
-            colnames = [x[0] for x in cur.description]
-            for row in results:
-                ds = {}
-                #for idx,x in enumerate(ISSUE_COLUMN_NAMES):
-                for idx,x in enumerate(colnames):
-                    ds[x] = row[idx]
-                rows.append(ds)
-
-        '''
-        if not rows:
-            import epdb; epdb.st()
-        return rows[0]
-        '''
-        if rows:
-            return rows[0]
-        return None
+        return jdbw.get_issues_by_keys([key]).get(key)
 
     def lint_key(self, key):
         logger.info(f'linting {key}')
         tree = self.get_tree(filter_key=key)
         ctree = self.get_child_tree(tree=tree, filter_key=key)
 
-        issue_data = self.get_issue(key)
+        # the whole tree in one query
+        issues = jdbw.get_issues_by_keys([key] + list(tree.keys()))
+        issue_data = issues.get(key)
         imap = {}
         for k,v in tree.items():
-            vdata = self.get_issue(k)
-            imap[k] = vdata
+            imap[k] = issues.get(k)
         imap[key] = issue_data
 
-        parent_link_field = FIELD_MAP['Parent Link']['id']
+        parent_link_field = FIELDS.get_by_name('Parent Link')['id']
         parent_link = imap[key]['data']['fields'][parent_link_field]
-        if parent_link:
-            imap[parent_link] = self.get_issue(parent_link)
 
-        epic_link_field = FIELD_MAP['Epic Link']['id']
+        epic_link_field = FIELDS.get_by_name('Epic Link')['id']
         epic_link = imap[key]['data']['fields'][epic_link_field]
-        if epic_link:
-            imap[epic_link] = self.get_issue(epic_link)
+
+        links = [x for x in [parent_link, epic_link] if x]
+        if links:
+            issues = jdbw.get_issues_by_keys(links)
+            for link in links:
+                imap[link] = issues.get(link)
 
         rule_id, rule_result = rule_parent_status_matches_child_status(ctree, key)
         rule_id, rule_result = rule_anstrat_work_criteria(key, issue_data)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+"""
+query_guard.py - limits on what a user supplied jql query may cost.
+
+The issues page lets anyone type jql, and one careless query should not hold
+a pooled connection for minutes. Every guarded endpoint runs with:
+
+  * a statement_timeout of its own, set with SET LOCAL semantics so it ends
+    with the transaction and never leaks to the next borrower of the
+    connection
+  * a row limit, DEFAULT_ROW_LIMIT unless the request asks for another one
+    up to MAX_ROW_LIMIT
+  * an EXPLAIN (FORMAT JSON) preview, plans costing more than MAX_QUERY_COST
+    are rejected and plans over DOWNGRADE_QUERY_COST run with at most
+    DOWNGRADED_ROW_LIMIT rows
+"""
+
+import os
+
+
+# statement_timeout per endpoint, in milliseconds
+STATEMENT_TIMEOUTS = {
+    'tickets': int(os.environ.get('API_TICKETS_TIMEOUT_MS', 15000)),
+    'tickets_page': int(os.environ.get('API_TICKETS_PAGE_TIMEOUT_MS', 10000)),
+}
+
+DEFAULT_ROW_LIMIT = int(os.environ.get('API_DEFAULT_ROW_LIMIT', 5000))
+MAX_ROW_LIMIT = int(os.environ.get('API_MAX_ROW_LIMIT', 50000))
+
+# in postgres planner cost units
+MAX_QUERY_COST = float(os.environ.get('API_MAX_QUERY_COST', 5000000))
+DOWNGRADE_QUERY_COST = float(os.environ.get('API_DOWNGRADE_QUERY_COST', 500000))
+DOWNGRADED_ROW_LIMIT = int(os.environ.get('API_DOWNGRADED_ROW_LIMIT', 500))
+
+
+class QueryRejected(ValueError):
+    """The request asked for a query the guard will not run."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def row_limit(args):
+    """The row limit requested with ``limit``, DEFAULT_ROW_LIMIT without one."""
+    value = args.get('limit')
+    if value is None or value == '':
+        return DEFAULT_ROW_LIMIT
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise QueryRejected(f'limit must be a number, got {value!r}')
+    if limit < 1 or limit > MAX_ROW_LIMIT:
+        raise QueryRejected(f'limit must be between 1 and {MAX_ROW_LIMIT}')
+    return limit
+
+
+def plan_cost(explain):
+    """(total cost, estimated rows) of EXPLAIN (FORMAT JSON) output."""
+    plan = explain[0]['Plan']
+    return plan['Total Cost'], plan['Plan Rows']
+
+
+def check_cost(explain, limit):
+    """The row limit to run a planned query with.
+
+    Raises QueryRejected when the plan is too expensive to run at all.
+    """
+    cost, rows = plan_cost(explain)
+    if cost > MAX_QUERY_COST:
+        raise QueryRejected(
+            f'query is too expensive to run (estimated cost {cost:.0f},'
+            f' at most {MAX_QUERY_COST:.0f} allowed), narrow it down'
+        )
+    if cost > DOWNGRADE_QUERY_COST and limit > DOWNGRADED_ROW_LIMIT:
+        return DOWNGRADED_ROW_LIMIT
+    return limit
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+"""
+response_cache.py - in-process cache for the expensive report endpoints.
+
+Entries are keyed by the endpoint, its normalized arguments and the data
+versions of the projects it reads. The ingest path bumps a project's version
+whenever it writes, so a sync makes the old entries unreachable even without
+explicit invalidation. Workers that listen for the ingest notifications also
+drop them right away to free the memory. The etag is derived from
+the key, so a client holding a current etag can be answered with a 304
+without rendering or even caching the body.
+"""
+
+import hashlib
+import os
+import threading
+
+from collections import OrderedDict
+from dataclasses import dataclass
+
+
+# per process cap on the cached bodies, 0 turns the cache off
+RESPONSE_CACHE_MB = int(os.environ.get('API_RESPONSE_CACHE_MB', 256))
+
+# version key used by responses that can read any project
+ALL_PROJECTS = '*'
+
+
+@dataclass
+class CacheEntry:
+    body: bytes
+    etag: str
+    projects: tuple
+    size: int
+
+
+def normalize_args(args):
+    """Turn a (multi)dict of query args into a hashable, order free tuple."""
+    items = []
+    for key in sorted(args.keys()):
+        if hasattr(args, 'getlist'):
+            values = args.getlist(key)
+        else:
+            values = args[key]
+            if not isinstance(values, (list, tuple)):
+                values = [values]
+        values = tuple(sorted(str(x) for x in values if x not in [None, '']))
+        if values:
+            items.append((key, values))
+    return tuple(items)
+
+
+def version_key(versions, projects=None):
+    """The part of a cache key that changes when the underlying data does.
+
+    With projects only their versions count, otherwise the sum of every
+    project's version stands in for a global one. Versions only grow, so
+    the sum changes whenever any of them does.
+    """
+    if projects:
+        return tuple((x, versions.get(x, 0)) for x in sorted(set(projects)))
+    return ((ALL_PROJECTS, sum(versions.values())),)
+
+
+def make_key(endpoint, args, versions, projects=None, extra=None):
+    return (endpoint, normalize_args(args), version_key(versions, projects=projects), extra)
+
+
+def make_etag(key):
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+
+    """Thread safe LRU of response bodies bounded by their total size."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body, projects=None):
+        entry = CacheEntry(
+            body=body,
+            etag=make_etag(key),
+            projects=tuple(projects or (ALL_PROJECTS,)),
+            size=len(body) + len(repr(key)),
+        )
+        if entry.size > self.max_bytes:
+            return entry
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old.size
+            self._entries[key] = entry
+            self.size += entry.size
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= evicted.size
+
+        return entry
+
+    def invalidate(self, projects=None):
+        """Drop the entries that read any of the projects, or every entry."""
+        with self._lock:
+            if projects is None:
+                self._entries.clear()
+                self.size = 0
+                return
+            projects = set(projects)
+            for key, entry in list(self._entries.items()):
+                if ALL_PROJECTS in entry.projects or projects.intersection(entry.projects):
+                    self._entries.pop(key)
+                    self.size -= entry.size
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'bytes': self.size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
@@ -8,10 +8,8 @@ can not generate tokens nor do advanced data import. This script works around al
 selenium to navigate through the pages and to input the data.
 """
 
-import atexit
 import argparse
 import datetime
-import copy
 import glob
 import json
 import logging
@@ -20,14 +18,10 @@ import os
 import pytz
 import time
 from datetime import timezone
-import jira
 import re
 
 from dataclasses import dataclass
 from collections import OrderedDict
-from collections import defaultdict
-
-import requests
 
 import concurrent.futures
 
@@ -39,237 +33,127 @@ import numpy as np
 
 from constants import PROJECTS
 from database import JiraDatabaseWrapper
+from database import HISTORY_COLUMN
 from utils import (
     sortable_key_from_ikey,
     history_items_to_dict,
     history_to_dict
 )
-from query_parser import query_parse
-
-
-with open('lib/static/json/fields.json', 'r') as f:
-    FIELD_MAP = json.loads(f.read())
-
-
-def accumulate_enumerated_backlog_from_row(row):
+from api_queries import jql_quote
+from backlog_queries import FLOW_COLUMNS
+from backlog_queries import ROLLUP_COUNTS
+from backlog_queries import backlog_rollup_read_query
+from backlog_queries import open_close_move_query
+from backlog_queries import open_close_query
+from jql import query_compile
+from field_registry import FIELDS
+from version_counts import monthly_version_counts
 
-    total = 0
-    total += int(row.opened)
-    total += int(row.moved_in)
-    total -= int(row.closed)
-    total -= int(row.moved_out)
 
-    return total
+def accumulate_enumerated_backlog(df):
+    return df['opened'] + df['moved_in'] - df['closed'] - df['moved_out']
 
 
 class StatsWrapper:
 
     def __init__(self):
         self.jdbw = JiraDatabaseWrapper()
-        self.conn = self.jdbw.get_connection()
-        atexit.register(self.conn.close)
 
     def _get_projects_issue_history(self, projects, jql=None):
 
         if jql:
             print(f'JQL: {jql}')
-            cols = ['number', 'created', 'updated',
-                    'data', 'project', 'key', 'state']
-            qs = query_parse(jql, cols=cols, debug=True)
+            cols = ['number', 'created', 'updated', 'closed',
+                    'project', 'key', 'state']
+            qs, qargs = query_compile(jql, cols=cols)
         else:
             placeholders = []
             for project in projects:
                 placeholders.append('%s')
             where_clause = "project = " + " OR project = ".join(placeholders)
-            qs = f'SELECT project,number,state,created,updated,data FROM jira_issues WHERE {where_clause}'
+            qs = f'SELECT project,number,key,state,created,updated,closed FROM jira_issues WHERE {where_clause}'
+            qargs = projects
 
-        with self.conn.cursor() as cur:
-            if jql:
-                cur.execute(qs,)
-            else:
-                cur.execute(qs, (projects))
-            colnames = [x[0] for x in cur.description]
-            for row in cur.fetchall():
-                ds = {}
-                for idc, cname in enumerate(colnames):
-                    ds[cname] = row[idc]
-                yield ds
+        yield from self.jdbw.iter_dicts(qs, qargs)
 
-    def get_open_close_move_events(self, projects, jql=None):
-        '''
-          project   |       key       |                                                            data
-        ------------+-----------------+-----------------------------------------------------------------------------------------------------------------------------
-         THEEDGE    | THEEDGE-924     | {"to": null, "from": null, "field": "Key", "toString": "THEEDGE-924", "fieldtype": "jira", "fromString": "RHELPLAN-88851"}
-         THEEDGE    | THEEDGE-924     | {"to": null, "from": null, "field": "Key", "toString": "AAP-6350", "fieldtype": "jira", "fromString": "THEEDGE-924"}
-         AAP        | AAP-3866        | {"to": null, "from": null, "field": "Key", "toString": "ANSTRAT-307", "fieldtype": "jira", "fromString": "AAP-3866"}
-         HATSTRAT   | HATSTRAT-70     | {"to": null, "from": null, "field": "Key", "toString": "TELCOSTRAT-42", "fieldtype": "jira", "fromString": "HATSTRAT-70"}
-         HATSTRAT   | HATSTRAT-233    | {"to": null, "from": null, "field": "Key", "toString": "TELCOSTRAT-95", "fieldtype": "jira", "fromString": "HATSTRAT-233"}
-         OCPBU      | OCPBU-493       | {"to": null, "from": null, "field": "Key", "toString": "OCPSTRAT-356", "fieldtype": "jira", "fromString": "OCPBU-493"}
-         OCPBU      | OCPBU-372       | {"to": null, "from": null, "field": "Key", "toString": "OCPBU-372", "fieldtype": "jira", "fromString": "NE-1238"}
-         OCPBU      | OCPBU-372       | {"to": null, "from": null, "field": "Key", "toString": "OCPSTRAT-375", "fieldtype": "jira", "fromString": "OCPBU-372"}
-        '''
-
-        utc_timezone = pytz.timezone("UTC")
+    def get_open_close_move_events(self, projects, jql=None, start=None, end=None, frequency='M'):
+        """Backlog flow of projects, or of the issues matching jql, per period.
 
+        Returns dicts of period, opened, closed, moved_in and moved_out, the
+        period being the first day of the day, week or month, in order. See
+        backlog_queries.py for what each count means.
+        """
         if jql:
             print(f'JQL: {jql}')
-            with open('lib/static/json/fields.json', 'r') as f:
-                field_map = json.loads(f.read())
-            field_map = dict((x['id'], x) for x in field_map)
-            cols = ['created', 'updated', 'state', 'project', 'key']
-            qs = query_parse(jql, cols=cols, field_map=field_map, debug=True)
-
-            print('*' * 50)
-            print(qs)
-            print('*' * 50)
-
-            events = []
-            with self.conn.cursor() as cur:
-                cur.execute(qs)
-                colnames = [x[0] for x in cur.description]
-                for row in cur.fetchall():
-                    ds = {}
-                    for idc, colname in enumerate(colnames):
-                        ds[colname] = row[idc]
-
-                    # print(ds)
-
-                    events.append({
-                        'timestamp': ds['created'].astimezone(utc_timezone),
-                        'opened': 1,
-                        'closed': 0,
-                        'moved_in': 0,
-                        'moved_out': 0,
-                    })
-
-                    if ds['state'] == 'Closed':
-                        events.append({
-                            'timestamp': ds['updated'].astimezone(utc_timezone),
-                            'opened': 0,
-                            'closed': 1,
-                            'moved_in': 0,
-                            'moved_out': 0,
-                        })
-
+            issues_sql, issues_params = query_compile(jql, cols=['created', 'updated', 'state'])
+            qs, qargs = open_close_query(issues_sql, issues_params, frequency)
         else:
+            qs, qargs = open_close_move_query(projects, frequency, start=start, end=end)
 
-            where_clause = ''
-            if projects:
-                placeholders = []
-                for project in projects:
-                    placeholders.append(f"'{project}'")
-                where_clause = "project = " + \
-                    " OR project = ".join(placeholders)
-
-            where_clause_1 = ''
-            if projects:
-                placeholders = []
-                for project in projects:
-                    placeholders.append('%s')
-                where_clause_1 = "project = " + \
-                    " OR project = ".join(placeholders)
-
-            placeholders_2 = []
-            if projects:
-                for project in projects:
-                    _qs = f"(data->>'toString' like '{project}-%' OR data->>'fromString' like '{project}-%')"
-                    placeholders_2.append(_qs)
-
-            qs = f'SELECT created,data,project,key FROM jira_issue_events WHERE (({where_clause})'
-            qs += " AND (data->>'field' = 'Key' OR (data->>'field' = 'status' AND ( data->>'toString'='New' OR data->>'toString'='Closed' ))))"
-            if placeholders_2:
-                qs += " OR "
-                qs += '(' + " OR ".join(placeholders_2) + ')'
-
-            print('*' * 50)
-            print(qs)
-            print('*' * 50)
-
-            event = {
-                'timestamp': None,
-                'opened': 0,
-                'closed': 0,
-                'moved_in': 0,
-                'moved_out': 0,
-            }
-
-            events = []
-            with self.conn.cursor() as cur:
-
-                # cur.execute(qs,(projects))
-                cur.execute(qs)
-
-                for row in cur.fetchall():
-
-                    # print(row)
-
-                    ev = copy.deepcopy(event)
-
-                    ts = row[0]
-                    ts = ts.astimezone(utc_timezone)
-                    ev['timestamp'] = ts
-
-                    src_project = None
-                    dst_project = None
-
-                    if row[1]['field'] == 'Key':
-                        src_project = row[1]['fromString'].split('-')[0]
-                        dst_project = row[1]['toString'].split('-')[0]
-
-                    matched = False
-                    for project in projects:
-                        if project in [row[2], src_project, dst_project]:
-                            matched = True
-                            break
-
-                    if not matched:
-                        continue
-
-                    if row[1]['field'] == 'status':
-                        if row[1]['toString'] == 'New':
-                            ev['opened'] = 1
-                            events.append(ev)
-                        elif row[1]['toString'] == 'Closed':
-                            ev['closed'] = 1
-                            events.append(ev)
-                        else:
-                            import epdb
-                            epdb.st()
+        print('*' * 50)
+        print(qs, qargs)
+        print('*' * 50)
 
-                    elif row[1]['field'] == 'Key':
+        return list(self.jdbw.iter_dicts(qs, qargs))
 
-                        src_project = row[1]['fromString'].split('-')[0]
-                        dst_project = row[1]['toString'].split('-')[0]
+    def burndown(self, projects, frequency='monthly', start=None, end=None, jql=None, limit=None, **kwargs):
 
-                        matched = False
-                        for project in projects:
-                            if project in [src_project, dst_project]:
-                                matched = True
-                                break
+        assert frequency in ['weekly', 'monthly', 'daily']
+        frequency = frequency[0].upper()
 
-                        if not matched:
-                            continue
+        # the rollup only knows projects, arbitrary jql is counted live
+        if jql:
+            merged_df = self._burndown_from_events(projects, frequency, end=end, jql=jql)
+        else:
+            merged_df = self._burndown_from_rollup(projects, frequency, end=end)
 
-                        if dst_project in projects:
-                            ev['moved_in'] = 1
-                            events.append(ev)
-                        elif src_project not in projects:
-                            import epdb
-                            epdb.st()
-                        else:
-                            ev['moved_out'] = 1
-                            events.append(ev)
+        if start or end:
+            if start:
+                cutoff_period = pd.Period(start, freq=frequency[0])
+                merged_df = merged_df[merged_df.index >= cutoff_period]
+            if end:
+                cutoff_period = pd.Period(end, freq=frequency[0])
+                merged_df = merged_df[merged_df.index <= cutoff_period]
 
-        # import epdb; epdb.st()
-        events = sorted(events, key=lambda x: x['timestamp'])
+            # import epdb; epdb.st()
 
-        # return [events[0]]
-        return events
+        return merged_df.to_json(date_format='iso', indent=2)
 
-    def burndown(self, projects, frequency='monthly', start=None, end=None, jql=None, limit=None, **kwargs):
+    def _burndown_from_rollup(self, projects, frequency, end=None):
+        """The burndown of projects read from the jira_backlog_daily rollup.
 
-        assert frequency in ['weekly', 'monthly', 'daily']
-        frequency = frequency[0].upper()
+        Costs a row per project and day with activity, however many issues
+        and events the projects have.
+        """
+        end_day = None
+        if end:
+            end_day = pd.Period(end, freq=frequency).end_time.date()
+        qs, qargs = backlog_rollup_read_query(projects, end=end_day)
+        df = pd.DataFrame(
+            list(self.jdbw.iter_dicts(qs, qargs)),
+            columns=['project', 'day'] + ROLLUP_COUNTS + ['backlog']
+        )
+        flow_columns = FLOW_COLUMNS[1:]
+        if df.empty:
+            return pd.DataFrame(columns=['backlog'] + flow_columns + ['enumerated', 'enumerated_backlog'])
+        df['day'] = pd.to_datetime(df['day'])
+
+        # each project's backlog carries over the days it has no row for
+        backlog = df.pivot(index='day', columns='project', values='backlog')\
+            .ffill().fillna(0).sum(axis=1)
+        flows = df.groupby('day')[flow_columns].sum()
+
+        periods = flows.index.to_period(frequency)
+        index = pd.period_range(periods.min(), periods.max(), freq=frequency, name='timestamp')
+        merged_df = flows.groupby(periods).sum().reindex(index, fill_value=0)
+        merged_df.insert(0, 'backlog', backlog.groupby(periods).last().reindex(index).ffill().astype(int))
+
+        merged_df['enumerated'] = accumulate_enumerated_backlog(merged_df)
+        merged_df['enumerated_backlog'] = merged_df['enumerated'].cumsum()
+        return merged_df
+
+    def _burndown_from_events(self, projects, frequency, end=None, jql=None):
+        """The burndown of projects or jql counted from the issues and events."""
 
         utc_timezone = pytz.timezone("UTC")
 
@@ -281,18 +165,16 @@ class StatsWrapper:
             created = issue['created'].astimezone(utc_timezone)
             open_close_events.append([created, 1])
             if issue['state'] == 'Closed':
-                if issue['data']['fields']['resolutiondate']:
-                    # 2022-10-07T18:27:40.793+0000
-                    ts = issue['data']['fields']['resolutiondate']
-                    ts = datetime.datetime.strptime(
-                        ts, "%Y-%m-%dT%H:%M:%S.%f%z")
+                # closed is the resolutiondate for closed issues
+                if issue['closed']:
+                    ts = issue['closed']
                 else:
                     ts = issue['updated']
                 ts = ts.astimezone(utc_timezone)
                 open_close_events.append([ts, -1])
 
                 # import epdb; epdb.st()
-                oc_with_key.append([ts, -1, issue['data']['key']])
+                oc_with_key.append([ts, -1, issue['key']])
 
         df = pd.DataFrame(open_close_events, columns=['timestamp', 'backlog'])
         df['timestamp'] = pd.to_datetime(df['timestamp'])
@@ -318,34 +200,25 @@ class StatsWrapper:
         else:
         '''
         if True:
-            ocm_events = self.get_open_close_move_events(projects, jql=jql)
-            ocm_df = pd.DataFrame(
-                ocm_events, columns=['timestamp', 'opened',
-                                     'closed', 'moved_in', 'moved_out']
-            )
-            ocm_df['timestamp'] = pd.to_datetime(ocm_df['timestamp'])
-            ocm_df = ocm_df.sort_values('timestamp')
-            ocm_grouped = ocm_df.groupby(ocm_df['timestamp'].dt.to_period(frequency))\
-                .agg({'opened': 'sum', 'closed': 'sum', 'moved_in': 'sum', 'moved_out': 'sum'})
-
-            ocm_grouped['enumerated'] = ocm_grouped.apply(
-                accumulate_enumerated_backlog_from_row, axis=1)
+            # Only the end bound can be pushed down, the enumerated backlog
+            # is a cumulative sum that needs every event before start.
+            events_end = None
+            if end:
+                events_end = pd.Period(end, freq=frequency).end_time.to_pydatetime()
+            ocm_rows = self.get_open_close_move_events(
+                projects, jql=jql, end=events_end, frequency=frequency)
+            ocm_grouped = pd.DataFrame(ocm_rows, columns=FLOW_COLUMNS)
+            ocm_grouped.index = pd.DatetimeIndex(ocm_grouped.pop('period'), name='timestamp')\
+                .to_period(frequency)
+            ocm_grouped = ocm_grouped.astype(int)
+
+            ocm_grouped['enumerated'] = accumulate_enumerated_backlog(ocm_grouped)
             ocm_grouped['enumerated_backlog'] = ocm_grouped['enumerated'].cumsum()
 
             merged_df = pd.merge(backlog_grouped, ocm_grouped,
                                  on='timestamp', how='outer')
 
-        if start or end:
-            if start:
-                cutoff_period = pd.Period(start, freq=frequency[0])
-                merged_df = merged_df[merged_df.index >= cutoff_period]
-            if end:
-                cutoff_period = pd.Period(end, freq=frequency[0])
-                merged_df = merged_df[merged_df.index <= cutoff_period]
-
-            # import epdb; epdb.st()
-
-        return merged_df.to_json(date_format='iso', indent=2)
+        return merged_df
 
     def churn(self, projects, frequency='monthly', fields=None, start=None, end=None, jql=None, limit=None, **kwargs):
 
@@ -358,7 +231,7 @@ class StatsWrapper:
         # make a list of event types
         field_names = set()
         qs = "select distinct(data->>'field') as field_name from jira_issue_events order by field_name"
-        with self.conn.cursor() as cur:
+        with self.jdbw.connection() as conn, conn.cursor() as cur:
             cur.execute(qs)
             for row in cur.fetchall():
                 field_names.add(row[0])
@@ -366,37 +239,36 @@ class StatsWrapper:
 
         # get list for each event type
         records = []
+        clauses = []
+        qargs = []
         if projects:
             print(f'selecting events from {projects}')
             placeholders = []
             for project in projects:
                 placeholders.append('%s')
-            where_clause = "project = " + " OR project = ".join(placeholders)
-            qs = f"SELECT created,data->>'field' AS field_name FROM jira_issue_events WHERE {where_clause}"
-            with self.conn.cursor() as cur:
-                cur.execute(qs, (projects))
-                for row in cur.fetchall():
-                    if fields and row[1] not in fields:
-                        continue
-                    records.append({'timestamp': row[0], row[1]: 1})
-
+            clauses.append("(project = " + " OR project = ".join(placeholders) + ")")
+            qargs.extend(projects)
         else:
             print('selecting events from all projects')
-            qs = "SELECT created,data->>'field' AS field_name FROM jira_issue_events ORDER BY created"
-            with self.conn.cursor() as cur:
-                cur.execute(qs)
-                for row in cur.fetchall():
-                    if fields and row[1] not in fields:
-                        continue
-                    records.append({'timestamp': row[0], row[1]: 1})
 
+        # bound the scan so the events partitions can be pruned
         if start:
-            st = datetime.datetime.strptime(start, '%Y-%m-%d')
-            records = [x for x in records if x['timestamp'] >= st]
-
+            clauses.append('created >= %s')
+            qargs.append(datetime.datetime.strptime(start, '%Y-%m-%d'))
         if end:
-            et = datetime.datetime.strptime(end, '%Y-%m-%d')
-            records = [x for x in records if x['timestamp'] <= et]
+            clauses.append('created <= %s')
+            qargs.append(datetime.datetime.strptime(end, '%Y-%m-%d'))
+
+        qs = "SELECT created,data->>'field' AS field_name FROM jira_issue_events"
+        if clauses:
+            qs += ' WHERE ' + ' AND '.join(clauses)
+        qs += ' ORDER BY created'
+        with self.jdbw.connection() as conn, conn.cursor() as cur:
+            cur.execute(qs, qargs)
+            for row in cur.fetchall():
+                if fields and row[1] not in fields:
+                    continue
+                records.append({'timestamp': row[0], row[1]: 1})
 
         df = pd.DataFrame(records)
         # import epdb; epdb.st()
@@ -428,12 +300,17 @@ class StatsWrapper:
         return clean.to_json(date_format='iso', indent=2)
 
     def stats_report(self, projects=None, frequency='monthly', fields=None, start=None, end=None, jql=None, limit=None, **kwargs):
-        qs = query_parse(jql, {}, cols=[
-                         'key', 'project', 'number', 'created', 'updated', 'type', 'state'])
+        # with a limit, the most recently updated issues are the ones kept
+        qs, qargs = query_compile(
+            jql,
+            cols=['key', 'project', 'number', 'created', 'updated', 'type', 'state'],
+            limit=int(limit) if limit else None,
+            order_by=[('updated', 'DESC')] if limit else None
+        )
 
         rows = []
-        with self.conn.cursor() as cur:
-            cur.execute(qs)
+        with self.jdbw.connection() as conn, conn.cursor() as cur:
+            cur.execute(qs, qargs)
             colnames = [x.name for x in cur.description]
             for row in cur.fetchall():
                 ds = {}
@@ -502,7 +379,7 @@ class StatsWrapper:
             version: str
 
         fields = {}
-        for fm in FIELD_MAP:
+        for fm in FIELDS:
             if 'version' in fm.get('name', '').lower() or 'fix' in fm.get('name', '').lower():
                 fields[fm['id']] = fm['name']
 
@@ -514,9 +391,13 @@ class StatsWrapper:
 
         # cols = ['project', 'number', 'key', 'created', 'updated', 'type', 'state', 'data', 'history']
         cols = ['project', 'number', 'key', 'created',
-                'updated', 'type', 'state', 'history']
+                'updated', 'type', 'state', HISTORY_COLUMN]
         for fkey, fval in fields.items():
-            cols.append(f"data->'fields'->'{fkey}' as \"{fval}\"")
+            if fkey == 'fixVersions':
+                # promoted to a column holding just the version names
+                cols.append(f"fix_versions as \"{fval}\"")
+            else:
+                cols.append(f"data->'fields'->'{fkey}' as \"{fval}\"")
 
         jql = ""
         if kwargs.get('projects'):
@@ -524,28 +405,13 @@ class StatsWrapper:
             #    raise Exception("can't handle mutli-projects yet")
             # projects = kwargs['projects']
             # jql += f"project={projects[0]}"
-            clauses = [f"project='{x}'" for x in kwargs['projects']]
-            clause = " OR ".join(clauses)
-            jql = "jql_scheme=2 " + clause
-            # import epdb; epdb.st()
-        qs = query_parse(jql, {}, cols=cols)
-        if kwargs.get('limit'):
-            qs += f" LIMIT {kwargs['limit']}"
-        print(qs)
+            jql = "project IN (" + ", ".join(jql_quote(x) for x in kwargs['projects']) + ")"
+        qs, qargs = query_compile(jql, cols=cols, limit=int(kwargs['limit']) if kwargs.get('limit') else None)
+        print(qs, qargs)
 
         print("run sql ...")
-        rows = []
-        with self.conn.cursor() as cur:
-            cur.execute(qs)
-            colnames = [x.name for x in cur.description]
-
-            counter = 0
-            for row in cur.fetchall():
-                counter += 1
-                ds = {}
-                for idx, x in enumerate(row):
-                    ds[colnames[idx]] = x
-                rows.append(ds)
+        # streamed, each issue and its history is dropped once observed
+        rows = self.jdbw.iter_dicts(qs, qargs)
 
         # fix version was applied
         # fix version was changed
@@ -575,7 +441,10 @@ class StatsWrapper:
                         ))
                     else:
                         for fv_item in field_val:
-                            version = fv_item['name']
+                            if isinstance(fv_item, dict):
+                                version = fv_item['name']
+                            else:
+                                version = fv_item
                             vevents.append(VersionEvent(
                                 issue['key'], issue['project'], issue['number'], issue['type'], its, fname, version
                             ))
@@ -614,57 +483,19 @@ class StatsWrapper:
         # trim to relevant events
         vevents = [x for x in vevents if 'fix' in x.field.lower()]
 
-        # sort on time
-        vevents = sorted(vevents, key=lambda x: x.ts)
-
-        # Step 2: Maintain state and accumulate data
-        version_dict = defaultdict(lambda: defaultdict(int))
-        current_versions = {}
-
-        # Accumulate timestamps
-        print('accumulating timestamps ...')
-        timestamps = sorted(set(event.ts for event in vevents))
-        for ts in timestamps:
-            for event in vevents:
-                if event.ts == ts:
-                    if event.version is not None:
-                        current_versions[event.key] = event.version
-                    elif event.key in current_versions:
-                        del current_versions[event.key]
-
-            # Propagate current state to the version_dict
-            for key, version in current_versions.items():
-                version_dict[ts][version] += 1
-
-        # Step 3: Create a dataframe
-        data = defaultdict(dict)
-
-        print('accumulating data ...')
-        for ts, versions in version_dict.items():
-            for version, count in versions.items():
-                data[ts][version] = count
-
-        print('making dataframe ...')
-        df = pd.DataFrame.from_dict(
-            data, orient='index').fillna(0).sort_index()
-
-        # Step 4: Sort columns by name
-        print('sort dataframe columns ...')
-        df = df.sort_index(axis=1)
-
-        # Step 5: Filter out columns that don't start with a digit
+        # Step 2: count the issues per version at the end of each month
+        print('counting issues per version ...')
+        df = monthly_version_counts(
+            [x.ts for x in vevents],
+            [x.key for x in vevents],
+            [x.version for x in vevents],
+        )
+
+        # Step 3: Filter out columns that don't start with a digit
         print('trim irrelevant columns ...')
         df = df[[col for col in df.columns if re.match(r'^\d', col)]]
         df = df[[col for col in df.columns if re.match(r'^(1|2)', col)]]
 
-        # Step 6: Convert the index to datetime and group by month
-        print('set df index to datetime ...')
-        df.index = pd.to_datetime(df.index)
-
-        print('resample df by month ...')
-        # df = df.resample('M').sum()
-        df = df.resample('ME').last()
-
         # trim down to the user's defined versions
         if kwargs.get('versions'):
             allowed_versions = kwargs['versions'][:]
@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 
 import argparse
-import atexit
 import copy
 import datetime
 import glob
@@ -12,12 +11,11 @@ from pprint import pprint
 from logzero import logger
 
 from database import JiraDatabaseWrapper
-from query_parser import query_parse
+from database import HISTORY_COLUMN
+from jql import query_compile
 
 
 jdbw = JiraDatabaseWrapper()
-conn = jdbw.get_connection()
-atexit.register(conn.close)
 
 
 
@@ -33,11 +31,11 @@ def make_timeline(
     jql=None,
 ):
 
-    cols = ['created', 'created_by', 'summary', 'assigned_to', 'type', 'history', 'updated', 'state', 'project', 'number', 'key']
+    cols = ['created', 'created_by', 'summary', 'assigned_to', 'type', HISTORY_COLUMN, 'updated', 'state', 'project', 'number', 'key']
 
     if jql:
         print(f'JQL: {jql}')
-        sql = query_parse(jql, cols=cols, debug=True)
+        sql, params = query_compile(jql, cols=cols)
 
     else:
 
@@ -46,14 +44,16 @@ def make_timeline(
         #sql += ' from jira_issues'
         sql = 'select ' + ','.join(cols) + ' from jira_issues'
 
+        clauses = []
+        params = []
+
         if filter_project:
-            sql += f" WHERE project='{filter_project}'"
+            clauses.append("project=%s")
+            params.append(filter_project)
 
         if filter_assignee:
-            if 'WHERE' in sql:
-                sql += f" AND assigned_to like '%{filter_assignee}%'"
-            else:
-                sql += f" WHERE assigned_to like '%{filter_assignee}%'"
+            clauses.append("assigned_to like %s")
+            params.append(f'%{filter_assignee}%')
 
         if filter_state:
 
@@ -63,83 +63,72 @@ def make_timeline(
                 operator = '!='
                 val = val.lstrip('-')
 
-            if 'WHERE' in sql:
-                sql += f" AND state{operator}'{val}'"
-            else:
-                sql += f" WHERE state{operator}'{val}'"
+            clauses.append(f"state{operator}%s")
+            params.append(val)
 
         if filter_key:
-            if 'WHERE' in sql:
-                sql += f" AND key='{filter_key}'"
-            else:
-                sql += f" WHERE key='{filter_key}'"
+            clauses.append("key=%s")
+            params.append(filter_key)
+
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
 
-    print(sql)
+    print(sql, params)
 
     imap = {}
     time_start = None
     time_finish = None
 
-    with conn.cursor() as cur:
+    for ds in jdbw.iter_dicts(sql, params):
 
-        cur.execute(sql)
-        colnames = [x.name for x in cur.description]
+        key = ds['key']
+        current_assignee = None
+        current_resolution = None
+        current_state = None
 
-        results = cur.fetchall()
-        for row in results:
+        if key not in imap:
+            imap[key] = {
+                'created': ds['created'].isoformat(),
+                'created_by': ds['created_by'],
+                'assigned_to': ds['assigned_to'],
+                'summary': ds['summary'],
+                'type': ds['type'],
+                'involved_users': [],
+                'state': ds['state'],
+                'states': []
+            }
 
-            ds = {}
-            for idx,x in enumerate(colnames):
-                ds[x] = row[idx]
 
-            key = ds['key']
-            current_assignee = None
-            current_resolution = None
-            current_state = None
+        if ds['history']:
+            for hist in ds['history']:
 
-            if key not in imap:
-                imap[key] = {
-                    'created': ds['created'].isoformat(),
-                    'created_by': ds['created_by'],
-                    'assigned_to': ds['assigned_to'],
-                    'summary': ds['summary'],
-                    'type': ds['type'],
-                    'involved_users': [],
-                    'state': ds['state'],
-                    'states': []
-                }
+                author = hist['author']['name']
+                ts = hist['created']
 
+                if author not in imap[key]['involved_users']:
+                    imap[key]['involved_users'].append(author)
 
-            if ds['history']:
-                for hist in ds['history']:
+                for hitem in hist['items']:
 
-                    author = hist['author']['name']
-                    ts = hist['created']
+                    if hitem.get('field') != 'status':
+                        continue
 
-                    if author not in imap[key]['involved_users']:
-                        imap[key]['involved_users'].append(author)
+                    imap[key]['states'].append([ts, hitem['toString']])
 
-                    for hitem in hist['items']:
+                    if not time_start or ts < time_start:
+                        time_start = ts
+                    if not time_finish or ts > time_finish:
+                        time_finish = ts
 
-                        if hitem.get('field') != 'status':
-                            continue
-
-                        imap[key]['states'].append([ts, hitem['toString']])
-
-                        if not time_start or ts < time_start:
-                            time_start = ts
-                        if not time_finish or ts > time_finish:
-                            time_finish = ts
-
-            # add created state
-            created = ds['created']
-            created_ts = created.isoformat()
-            #import epdb; epdb.st()
-            if not imap[key]['states'] or imap[key]['states'][0][1] != 'New':
-                imap[key]['states'].insert(0, [created_ts, 'New'])
+        # add created state
+        created = ds['created']
+        created_ts = created.isoformat()
+        #import epdb; epdb.st()
+        if not imap[key]['states'] or imap[key]['states'][0][1] != 'New':
+            imap[key]['states'].insert(0, [created_ts, 'New'])
 
-            if not time_start or time_start > created_ts:
-                time_start = created_ts
+        if not time_start or time_start > created_ts:
+            time_start = created_ts
 
     if filter_user:
         allowed_keys = set()
@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 
 import argparse
-import atexit
 import copy
 import glob
 import json
@@ -14,8 +13,6 @@ from database import JiraDatabaseWrapper
 
 
 jdbw = JiraDatabaseWrapper()
-conn = jdbw.get_connection()
-atexit.register(conn.close)
 
 
 def _make_nodes(issue_map, debug=True):
@@ -74,11 +71,10 @@ def _get_issue_map(filter_key=None, filter_project=None, debug=True):
 
     # relationship fields are ID'fied
     field_map = {
-        'parent': "data->'fields'->'parent'->>'key'",
-        'parent_link': "data->'fields'->'customfield_12313140'->>'key'",
-        'feature': "data->'fields'->'customfield_12318341'->>'key'",
-        'epic': "data->'fields'->>'customfield_12311140'",
-        'fix_versions': "data->'fields'->>'fixVersions'",
+        'parent': 'parent',
+        'parent_link': 'parent_link',
+        'feature': 'feature_link',
+        'epic': 'epic_link',
     }
 
 
@@ -88,39 +84,32 @@ def _get_issue_map(filter_key=None, filter_project=None, debug=True):
     # build the query ...
     field_cols = [f"{x[1]} {x[0]}" for x in field_map.items()]
     field_cols = ', '.join(field_cols)
-    sql = f'SELECT key,type,state,summary,{field_cols} FROM jira_issues'
+    sql = f'SELECT key,type,state,summary,fix_versions,{field_cols} FROM jira_issues'
 
     # if filter_key or filter_project add conditionals ...
+    params = []
     if filter_key or filter_project:
         sql += ' WHERE '
         clauses = []
         if filter_project:
-            clauses.append(f"project='{filter_project}'")
+            clauses.append("project=%s")
+            params.append(filter_project)
         if filter_key:
             subclauses = []
             for field_key, field_col in field_map.items():
-                clause = f"data->'fields'->>'{field_col}'='{filter_key}'"
-                subclauses.append(clause)
+                subclauses.append(f"{field_col}=%s")
+                params.append(filter_key)
             clauses.append('(' + ' OR '.join(subclauses) + ')')
         sql += ' ' + ' AND '.join(clauses)
 
     # map out all issues ...
-    with conn.cursor() as cur:
-
-        cur.execute(sql)
-        colnames = [x.name for x in cur.description]
-
-        results = cur.fetchall()
-        for row in results:
-
-            ikey = row[colnames.index('key')]
-            ds = {}
-            for idx,x in enumerate(colnames):
-                ds[x] = row[idx]
-            issue_map[ikey] = ds
-            #if ikey == 'AAP-16435':
-            #    import epdb; epdb.st()
-            issue_map[ikey]['fix_versions'] = [x['name'] for x in json.loads(ds['fix_versions'])]
+    for ds in jdbw.iter_dicts(sql, params):
+
+        ikey = ds['key']
+        issue_map[ikey] = ds
+        #if ikey == 'AAP-16435':
+        #    import epdb; epdb.st()
+        issue_map[ikey]['fix_versions'] = ds['fix_versions'] or []
 
     return issue_map
 
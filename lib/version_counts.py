@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+"""
+version_counts.py - how many issues sat in each fix version over time.
+
+The fix version burndown replays every fix version change in time order and
+counts the issues per version after each timestamp. Replayed naively that is
+a pass over every event for every timestamp. Here each change becomes a -1
+for the version an issue leaves and a +1 for the one it joins, versions are
+dictionary encoded, and a cumulative sum per version gives the counts. Only
+the rows that survive the monthly resample are ever materialized.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def monthly_version_counts(timestamps, keys, versions):
+    """Issue counts per fix version at the end of each month.
+
+    Each position of the three sequences is one event: at timestamp, a
+    sortable string like 2023-03-28T16:09:38, issue key was put in version,
+    or taken out of its version when that is None. Events with the same
+    timestamp apply in the given order.
+
+    The result equals replaying the events into one row of counts per
+    timestamp that has any issue in a version, filling missing counts with
+    0 and applying resample('ME').last(). So the columns are the versions
+    counted in at least one of those rows, sorted by name, and a column is
+    float if it is 0 in any of them, int otherwise.
+    """
+    tcodes, tvalues = pd.factorize(np.asarray(timestamps, dtype=object), sort=True)
+    kcodes, _ = pd.factorize(np.asarray(keys, dtype=object))
+    vcodes, vvalues = pd.factorize(np.asarray(versions, dtype=object))
+    ntimes = len(tvalues)
+    if not (vcodes >= 0).any():
+        return pd.DataFrame(index=pd.DatetimeIndex([])).resample('ME').last()
+
+    # group the events per issue in time order, keeping the input order
+    # within a timestamp, the last event of an issue at a timestamp wins
+    ids = kcodes.astype(np.int64) * ntimes + tcodes
+    order = np.argsort(ids, kind='stable')
+    ids = ids[order]
+    last = np.r_[ids[1:] != ids[:-1], True]
+    k = kcodes[order][last]
+    t = tcodes[order][last]
+    v = vcodes[order][last]
+
+    # the version each issue was in before, -1 for none
+    prev = np.r_[-1, v[:-1]]
+    prev[np.r_[True, k[1:] != k[:-1]]] = -1
+
+    leave = prev >= 0
+    join = v >= 0
+    dt = np.concatenate([t[leave], t[join]])
+    dv = np.concatenate([prev[leave], v[join]])
+    dd = np.concatenate([-np.ones(leave.sum(), dtype=np.int64), np.ones(join.sum(), dtype=np.int64)])
+
+    # timestamps after which any issue is in a version get a row
+    total = np.cumsum(np.bincount(t[join], minlength=ntimes) - np.bincount(t[leave], minlength=ntimes))
+    included = total > 0
+    seen = np.r_[0, np.cumsum(included)]
+
+    # per version, the count it changes to at each of its change points
+    change, inverse = np.unique(dv.astype(np.int64) * ntimes + dt, return_inverse=True)
+    delta = np.bincount(inverse, weights=dd, minlength=len(change)).astype(np.int64)
+    cv = change // ntimes
+    ct = change % ntimes
+    first = np.r_[True, cv[1:] != cv[:-1]]
+    running = np.cumsum(delta)
+    level = running - (running - delta)[first][np.cumsum(first) - 1]
+
+    # how many rows each count holds for, up to the next change point
+    ends = np.r_[ct[1:], ntimes]
+    ends[np.r_[cv[1:] != cv[:-1], True]] = ntimes
+    rows_held = seen[ends] - seen[ct]
+
+    present = np.zeros(len(vvalues), dtype=bool)
+    present[cv[(level > 0) & (rows_held > 0)]] = True
+    has_zero = np.zeros(len(vvalues), dtype=bool)
+    has_zero[cv[(level == 0) & (rows_held > 0)]] = True
+    has_zero[cv[first][seen[ct[first]] > 0]] = True
+
+    # the last row of every month
+    times = pd.to_datetime(tvalues[included])
+    rows = np.flatnonzero(included)
+    months = times.to_period('M').asi8
+    month_end = np.r_[months[1:] != months[:-1], True]
+    rows = rows[month_end]
+
+    # each version's count at those rows, from its last change point
+    columns = np.flatnonzero(present)
+    wanted = np.tile(columns, len(rows))
+    at = np.searchsorted(change, wanted * ntimes + np.repeat(rows, len(columns)), side='right') - 1
+    found = (at >= 0) & (cv[np.maximum(at, 0)] == wanted)
+    counts = np.where(found, level[np.maximum(at, 0)], 0).reshape(len(rows), len(columns))
+
+    df = pd.DataFrame(counts, index=times[month_end], columns=vvalues[columns])
+    for column, zero in zip(df.columns, has_zero[columns]):
+        if zero:
+            df[column] = df[column].astype(float)
+    df = df.sort_index(axis=1)
+    return df.resample('ME').last()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+import datetime
+
+import pytest
+
+from lib.api_queries import MAX_PAGE_LENGTH
+from lib.api_queries import datatables_order
+from lib.api_queries import decode_cursor
+from lib.api_queries import encode_cursor
+from lib.api_queries import filter_args
+from lib.api_queries import format_ticket_row
+from lib.api_queries import is_paged_request
+from lib.api_queries import jql_quote
+from lib.api_queries import tickets_page_queries
+from lib.api_queries import tickets_page_response
+from lib.api_queries import tickets_query_from_args
+
+
+BASE_SQL = "SELECT key,created,summary,id FROM jira_issues WHERE project = %s AND summary ILIKE %s"
+BASE_PARAMS = ['AAH', '%foo%']
+
+
+def test_filter_args():
+    args = {
+        'project': 'AAH',
+        'draw': '1',
+        'start': '0',
+        'length': '50',
+        'order[0][column]': '1',
+        'columns[1][data]': 'created',
+        'search[value]': '',
+        '_': '123',
+    }
+    assert is_paged_request(args)
+    assert not is_paged_request({'project': 'AAH'})
+    assert filter_args(args) == {'project': 'AAH'}
+
+
+@pytest.mark.parametrize(
+    "test_input,expected",
+    [
+        ({}, ('created', 'desc')),
+        ({'order[0][column]': '2', 'columns[2][data]': 'updated', 'order[0][dir]': 'asc'}, ('updated', 'asc')),
+        ({'order[0][column]': '2', 'columns[2][data]': 'id; DROP TABLE x'}, ('created', 'desc')),
+        ({'order[0][dir]': 'sideways'}, ('created', 'desc')),
+    ]
+)
+def test_datatables_order(test_input, expected):
+    assert datatables_order(test_input) == expected
+
+
+def test_cursor_roundtrip():
+    ts = datetime.datetime(2023, 3, 28, 16, 9, 38)
+    cursor = encode_cursor(ts, '12345')
+    assert decode_cursor(cursor) == ('2023-03-28T16:09:38', '12345')
+
+
+def test_page_queries_offset():
+    queries = tickets_page_queries(BASE_SQL, {'start': '100', 'length': '25'}, BASE_PARAMS)
+    assert queries['total'] == (f'SELECT count(*) FROM ({BASE_SQL}) t', BASE_PARAMS)
+    assert 'filtered' not in queries
+    sql, params = queries['page']
+    # each branch matches a forward or backward scan of the paging index
+    assert 'WHERE t.created IS NOT NULL ORDER BY t.created desc, coalesce(t.id, t.key) desc LIMIT %s)' in sql
+    assert 'WHERE t.created IS NULL ORDER BY coalesce(t.id, t.key) desc LIMIT %s)' in sql
+    assert sql.endswith('ORDER BY p.created desc NULLS LAST, coalesce(p.id, p.key) desc LIMIT %s OFFSET %s')
+    assert sql.count('%s') == len(params)
+    assert params == BASE_PARAMS + [125] + BASE_PARAMS + [125, 25, 100]
+
+
+def test_page_queries_keyset_and_search():
+    cursor = encode_cursor('2023-03-28T16:09:38', '12345')
+    args = {'start': '50', 'length': '50', 'after': cursor, 'search[value]': '50%'}
+    queries = tickets_page_queries(BASE_SQL, args, BASE_PARAMS)
+    assert queries['filtered'][1][:3] == ['AAH', '%foo%', r'%50\%%']
+    sql, params = queries['page']
+    assert '(t.created, coalesce(t.id, t.key)) < (%s::timestamp, %s)' in sql
+    assert sql.count('%s') == len(params)
+    assert params[-4:] == [r'%50\%%', 50, 50, 0]
+    assert '12345' in params
+
+
+def test_page_queries_keyset_past_nulls():
+    # the rows without a created come last, a cursor on one only pages nulls
+    cursor = encode_cursor(None, '12345')
+    args = {'length': '10', 'after': cursor, 'order[0][dir]': 'asc'}
+    sql, params = tickets_page_queries(BASE_SQL, args, BASE_PARAMS)['page']
+    assert 'AND false ORDER BY t.created asc' in sql
+    assert 'WHERE t.created IS NULL AND coalesce(t.id, t.key) > %s ORDER BY coalesce(t.id, t.key) asc' in sql
+    assert sql.count('%s') == len(params)
+    assert params == BASE_PARAMS + [10] + BASE_PARAMS + ['12345', 10, 10, 0]
+
+
+def test_page_queries_keyset_ignored_for_other_columns():
+    cursor = encode_cursor('x', '1')
+    args = {'after': cursor, 'order[0][column]': '3', 'columns[3][data]': 'summary'}
+    sql, params = tickets_page_queries(BASE_SQL, args, BASE_PARAMS)['page']
+    assert 't.key)) <' not in sql
+    assert 'ORDER BY t.summary desc' in sql
+
+
+@pytest.mark.parametrize(
+    "test_input,expected",
+    [
+        ({}, 'project="AAH" AND status!=Closed'),
+        ({'component': 'ui', 'status': 'New'}, 'components="ui" AND status="New"'),
+        ({'summary': 'say "hi"'}, r'summary="say \"hi\"" AND status!=Closed'),
+    ]
+)
+def test_tickets_query_from_args(test_input, expected):
+    assert tickets_query_from_args(test_input) == expected
+    assert jql_quote('a\\b') == '"a\\\\b"'
+
+
+def test_page_response():
+    rows = [
+        {'key': 'AAH-2', 'created': datetime.datetime(2023, 1, 2), 'id': '2', 'labels': ['a', 'JIRALERT1']},
+        {'key': 'AAH-1', 'created': datetime.datetime(2023, 1, 1), 'id': '1', 'labels': None},
+    ]
+    ds = tickets_page_response({'draw': '3', 'length': '2'}, 10, None, rows)
+    assert ds['draw'] == 3
+    assert ds['recordsTotal'] == 10
+    assert ds['recordsFiltered'] == 10
+    assert ds['data'][0] == {'key': 'AAH-2', 'created': '2023-01-02T00:00:00', 'labels': ['a']}
+    assert decode_cursor(ds['next']) == ('2023-01-01T00:00:00', '1')
+
+    ds = tickets_page_response({'length': '50'}, 10, 2, rows)
+    assert ds['recordsFiltered'] == 2
+    assert ds['next'] is None
+
+
+def test_page_response_placeholder_rows():
+    # invalid issues are stored without id, created or updated
+    rows = [
+        {'key': 'AAH-3', 'created': datetime.datetime(2023, 1, 3), 'updated': None, 'id': '3'},
+        {'key': 'AAH-9', 'created': None, 'updated': None, 'id': None},
+    ]
+    ds = tickets_page_response({'length': '2'}, 2, None, rows)
+    assert ds['data'][1] == {'key': 'AAH-9', 'created': None, 'updated': None}
+    assert ds['data'][0]['updated'] is None
+    assert decode_cursor(ds['next']) == (None, 'AAH-9')
+    assert format_ticket_row({'created': None, 'sfdc_count': None}) == {'created': None, 'sfdc_count': None}
+
+
+@pytest.mark.parametrize("test_input", ['-1', '0', str(MAX_PAGE_LENGTH + 1)])
+def test_page_response_clamps_length(test_input):
+    # the page query clamped these lengths to MAX_PAGE_LENGTH
+    rows = [
+        {'key': f'AAH-{x}', 'created': datetime.datetime(2023, 1, 1), 'id': str(x)}
+        for x in range(MAX_PAGE_LENGTH)
+    ]
+    assert tickets_page_response({'length': test_input}, 2000, None, rows)['next'] is not None
+    assert tickets_page_response({'length': test_input}, 2000, None, rows[:-1])['next'] is None
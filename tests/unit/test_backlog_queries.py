@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+import datetime
+import random
+import re
+
+import pytest
+
+from lib.backlog_queries import ROLLUP_COUNTS
+from lib.backlog_queries import ROLLUP_SOURCES
+from lib.backlog_queries import backlog_rollup_query
+from lib.backlog_queries import backlog_running_total_query
+from lib.backlog_queries import frequency_unit
+from lib.backlog_queries import issue_backlog_days
+from lib.backlog_queries import open_close_move_query
+from lib.backlog_queries import open_close_query
+
+
+@pytest.mark.parametrize(
+    "test_input,expected",
+    [
+        ('M', 'month'),
+        ('monthly', 'month'),
+        ('W', 'week'),
+        ('daily', 'day'),
+    ]
+)
+def test_frequency_unit(test_input, expected):
+    assert frequency_unit(test_input) == expected
+
+
+def test_frequency_unit_rejected():
+    with pytest.raises(ValueError):
+        frequency_unit('yearly')
+
+
+def test_open_close_move_query():
+    end = datetime.datetime(2023, 12, 31)
+    qs, qargs = open_close_move_query(['AAP', 'AAH'], 'W', end=end)
+    assert qs.startswith('SELECT date_trunc(%s, created) AS period,')
+    assert qs.endswith(' AND created <= %s GROUP BY 1 ORDER BY 1')
+    assert 'LIKE' not in qs
+    assert qs.count('%s') == len(qargs)
+    assert qargs == ['week'] + [['AAP', 'AAH']] * 6 + [end]
+
+
+def test_open_close_query():
+    qs, qargs = open_close_query('SELECT created,updated,state FROM jira_issues WHERE project = %s', ['AAP'], 'M')
+    assert qs.startswith('WITH issues AS (SELECT created,updated,state FROM jira_issues WHERE project = %s)')
+    assert qs.count('%s') == len(qargs)
+    assert qargs == ['AAP', 'month', 'month']
+
+
+def test_backlog_rollup_query():
+    qs, qargs = backlog_rollup_query()
+    assert qs.startswith('INSERT INTO jira_backlog_daily (project, day, opened, closed,')
+    assert qs.endswith('resolved = EXCLUDED.resolved')
+    assert qs.count(' UNION ALL ') == len(ROLLUP_COUNTS) - 1
+    assert qargs == []
+
+    days = [datetime.date(2023, 3, 5), datetime.date(2023, 3, 1)]
+    qs, qargs = backlog_rollup_query(projects=['AAP'], days=days)
+    assert qs.count('%s') == len(qargs)
+    assert qargs[:4] == [
+        ['AAP'],
+        datetime.date(2023, 3, 1),
+        datetime.date(2023, 3, 6),
+        [datetime.date(2023, 3, 1), datetime.date(2023, 3, 5)],
+    ]
+
+
+def test_backlog_running_total_query():
+    qs, qargs = backlog_running_total_query(projects=['AAP'], since=datetime.date(2023, 3, 1))
+    assert 'sum(created - resolved) OVER (PARTITION BY project ORDER BY day)' in qs
+    assert qs.endswith(' AND rollup.day >= %s')
+    assert qargs == [['AAP'], datetime.date(2023, 3, 1)]
+
+
+@pytest.mark.parametrize(
+    "test_input,expected",
+    [
+        (None, set()),
+        ({'created': '2023-01-02T10:00:00.000+0000', 'updated': None, 'state': 'New'}, set()),
+        (
+            {'created': '2023-01-02T10:00:00.000+0000', 'updated': '2023-02-01T23:00:00.000-0500', 'state': 'New'},
+            {datetime.date(2023, 1, 2)}
+        ),
+        (
+            {
+                'created': datetime.datetime(2023, 1, 2, 10),
+                'updated': datetime.datetime(2023, 2, 5),
+                'closed': datetime.datetime(2023, 2, 1, 12),
+                'state': 'Closed',
+            },
+            {datetime.date(2023, 1, 2), datetime.date(2023, 2, 1)}
+        ),
+    ]
+)
+def test_issue_backlog_days(test_input, expected):
+    assert issue_backlog_days(test_input) == expected
+
+
+def matches(condition, event, projects):
+    """Evaluate a conjunction of the simple comparisons the flow queries use."""
+    for term in condition.split(' AND '):
+        left, op, right = re.fullmatch(r"(\S+) (=|<>) (.+)", term).groups()
+        value = event[left]
+        if right == 'ANY(%s)':
+            ok = value in projects
+        elif right == 'ALL(%s)':
+            ok = value not in projects
+        elif right.startswith("'"):
+            ok = (value == right.strip("'")) == (op == '=')
+        else:
+            ok = (value == event[right]) == (op == '=')
+        if not ok:
+            return False
+    return True
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_rollup_moves_match_open_close_move_query(seed):
+    rng = random.Random(seed)
+    events = []
+    for _ in range(50):
+        from_project, to_project = rng.choice(['AAP', 'AAH', 'ANSTRAT']), rng.choice(['AAP', 'AAH', 'ANSTRAT'])
+        # includes renames within one project
+        events.append({'field': 'Key', 'from_project': from_project, 'to_project': to_project})
+
+    qs, _ = open_close_move_query(['AAP'], 'M')
+    filters = dict((name, condition) for condition, name in re.findall(r'FILTER \(WHERE (.*?)\) AS (\w+)', qs))
+    sources = dict((x[0], x) for x in ROLLUP_SOURCES)
+
+    for project in ['AAP', 'AAH', 'ANSTRAT']:
+        for count in ['moved_in', 'moved_out']:
+            _, project_column, _, _, condition = sources[count]
+            rollup = sum(1 for x in events if x[project_column] == project and matches(condition, x, []))
+            live = sum(1 for x in events if matches(filters[count], x, [project]))
+            assert rollup == live, (project, count)
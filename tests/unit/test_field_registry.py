@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+import json
+import os
+
+import pytest
+
+from lib.field_registry import FieldRegistry
+from lib.field_registry import FIELDS_FILE
+
+
+FIELDS = [
+    {
+        'id': 'customfield_12313140',
+        'name': 'Parent Link',
+        'clauseNames': ['cf[12313140]', 'Parent Link'],
+    },
+    {
+        'id': 'fixVersions',
+        'name': 'Fix Version/s',
+        'clauseNames': ['fixVersion'],
+    },
+]
+
+
+@pytest.fixture
+def fields_file(tmp_path):
+    fn = tmp_path / 'fields.json'
+    fn.write_text(json.dumps(FIELDS))
+    return fn
+
+
+def test_lookups(fields_file):
+    fr = FieldRegistry(filename=str(fields_file))
+    assert len(fr) == 2
+    assert fr.get('fixVersions')['name'] == 'Fix Version/s'
+    assert fr.get_by_name('Parent Link')['id'] == 'customfield_12313140'
+    assert fr.get_by_clause_name('FIXVERSION')['id'] == 'fixVersions'
+    assert fr.get('nope') is None
+    assert sorted(fr.id_map().keys()) == ['customfield_12313140', 'fixVersions']
+    assert [x['id'] for x in fr] == ['customfield_12313140', 'fixVersions']
+
+
+@pytest.mark.parametrize(
+    "test_input,expected",
+    [
+        ('customfield_12313140', 'customfield_12313140'),
+        ('Parent Link', 'customfield_12313140'),
+        ('cf[12313140]', 'customfield_12313140'),
+        ('fixversion', 'fixVersions'),
+        ('nope', None),
+    ]
+)
+def test_resolve(fields_file, test_input, expected):
+    fr = FieldRegistry(filename=str(fields_file))
+    assert fr.resolve(test_input) == expected
+
+
+def test_hot_reload(fields_file):
+    fr = FieldRegistry(filename=str(fields_file), check_interval=0)
+    assert fr.get_by_name('Epic Link') is None
+
+    fields = FIELDS + [{'id': 'customfield_12311140', 'name': 'Epic Link', 'clauseNames': []}]
+    fields_file.write_text(json.dumps(fields))
+    mtime = os.stat(fields_file).st_mtime + 10
+    os.utime(fields_file, (mtime, mtime))
+
+    assert fr.get_by_name('Epic Link')['id'] == 'customfield_12311140'
+    assert fr.reload_if_changed() is False
+
+
+def test_reload_is_throttled(fields_file):
+    fr = FieldRegistry(filename=str(fields_file), check_interval=3600)
+    assert len(fr) == 2
+
+    fields_file.write_text(json.dumps(FIELDS[:1]))
+    mtime = os.stat(fields_file).st_mtime + 10
+    os.utime(fields_file, (mtime, mtime))
+
+    assert len(fr) == 2
+
+
+def test_shipped_fields_file():
+    fr = FieldRegistry(filename=FIELDS_FILE)
+    assert fr.get_by_name('Parent Link')['id'] == 'customfield_12313140'
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+import datetime
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from lib.issue_snapshot import IssueSnapshot  # noqa: E402
+from lib.issue_snapshot import UnsupportedQuery  # noqa: E402
+from lib.jql import parse  # noqa: E402
+from lib.jql import resolve_field  # noqa: E402
+
+
+def issue(number, project='AAP', state='New', assignee=None, labels=None, updated=1, sfdc_count=None):
+    return {
+        'id': str(1000 + number),
+        'key': f'{project}-{number}',
+        'summary': f'issue number {number}',
+        'project': project,
+        'state': state,
+        'type': 'Bug',
+        'priority': None,
+        'assigned_to': assignee,
+        'created_by': 'bob',
+        'created': datetime.datetime(2023, 1, number),
+        'updated': datetime.datetime(2023, 2, updated),
+        'closed': None,
+        'number': number,
+        'sfdc_count': sfdc_count,
+        'labels': labels or [],
+        'components': [],
+        'fix_versions': [],
+    }
+
+
+class FakeDatabase:
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def iter_dicts(self, sql, params=None):
+        self.queries.append((sql, params))
+        if 'unnest' in sql:
+            # the test values collate like they sort in python
+            return iter([{'v': x} for x in sorted(params[0])])
+        since = params[0] if params else None
+        return iter([x for x in self.rows if since is None or x['updated'] >= since])
+
+
+@pytest.fixture
+def snapshot():
+    rows = [
+        issue(1, labels=['galaxy', 'hub'], assignee='alice'),
+        issue(2, state='Closed', labels=['hub'], sfdc_count=3),
+        issue(3, project='AAH', assignee='bob', updated=2),
+        issue(4, project='AAH', state='Closed', labels=['galaxy'], sfdc_count=1),
+    ]
+    return IssueSnapshot(FakeDatabase(rows), resolver=resolve_field)
+
+
+def keys(snapshot, query, **kwargs):
+    total, filtered, rows = snapshot.select(parse(query), ['key'], **kwargs)
+    return [x['key'] for x in rows]
+
+
+@pytest.mark.parametrize(
+    "test_input,expected",
+    [
+        ('', ['AAP-1', 'AAP-2', 'AAH-3', 'AAH-4']),
+        ('project = AAP', ['AAP-1', 'AAP-2']),
+        ('project in (AAH, nope) AND status != Closed', ['AAH-3']),
+        ('labels = galaxy', ['AAP-1', 'AAH-4']),
+        ('labels not in (galaxy, hub)', ['AAH-3']),
+        ('labels is empty', ['AAH-3']),
+        # null assignees are neither equal nor unequal, as in sql
+        ('assignee != alice', ['AAH-3']),
+        ('NOT assignee = alice', ['AAH-3']),
+        ('assignee is empty OR key = AAP-1', ['AAP-1', 'AAP-2', 'AAH-4']),
+        ('sfdc_count > 1', ['AAP-2']),
+        ('created >= "2023-01-03"', ['AAH-3', 'AAH-4']),
+        ('project = AAP ORDER BY number DESC', ['AAP-2', 'AAP-1']),
+        ('ORDER BY assignee', ['AAP-1', 'AAH-3', 'AAP-2', 'AAH-4']),
+        ('ORDER BY project, created DESC', ['AAH-4', 'AAH-3', 'AAP-2', 'AAP-1']),
+        ('ORDER BY created DESC LIMIT 2', ['AAH-4', 'AAH-3']),
+    ]
+)
+def test_select(snapshot, test_input, expected):
+    assert keys(snapshot, test_input) == expected
+
+
+def test_select_page(snapshot):
+    total, filtered, rows = snapshot.select(
+        parse('project = AAH OR project = AAP'),
+        ['key', 'created', 'labels', 'sfdc_count'],
+        order_by=[('created', 'desc', True)],
+        search='NUMBER',
+        search_columns=['key', 'summary', 'state'],
+        offset=1,
+        limit=2,
+    )
+    assert (total, filtered) == (4, 4)
+    assert rows == [
+        {'key': 'AAH-3', 'created': datetime.datetime(2023, 1, 3), 'labels': [], 'sfdc_count': None},
+        {'key': 'AAP-2', 'created': datetime.datetime(2023, 1, 2), 'labels': ['hub'], 'sfdc_count': 3.0},
+    ]
+
+    total, filtered, rows = snapshot.select(parse(''), ['key'], search='clos', search_columns=['state'])
+    assert (total, filtered) == (4, 2)
+
+
+def test_incremental_refresh(snapshot):
+    assert keys(snapshot, 'labels = hub') == ['AAP-1', 'AAP-2']
+
+    snapshot.jdbw.rows[0] = issue(1, labels=['galaxy'], updated=5)
+    snapshot.jdbw.rows.append(issue(5, labels=['hub'], updated=5))
+    snapshot.invalidate('AAP', ['AAP-1'])
+
+    assert keys(snapshot, 'labels = hub') == ['AAP-2', 'AAP-5']
+    assert snapshot.jdbw.queries[-1][1] == (datetime.datetime(2023, 2, 2),)
+    assert snapshot.store.n == 5
+
+
+def test_full_refresh(snapshot):
+    assert keys(snapshot, 'project = AAH') == ['AAH-3', 'AAH-4']
+
+    # an older updated is missed by the incremental read, a delete too
+    snapshot.jdbw.rows[2] = issue(3, project='AAH', state='Closed', updated=1)
+    del snapshot.jdbw.rows[3]
+    snapshot.invalidate()
+    assert keys(snapshot, 'project = AAH AND status = Closed') == ['AAH-4']
+
+    snapshot.full_refresh = 0
+    assert keys(snapshot, 'project = AAH AND status = Closed') == ['AAH-3']
+    assert [x[1] for x in snapshot.jdbw.queries if 'jira_issues' in x[0]][-1] is None
+    assert snapshot.store.n == 3
+
+
+def test_order_new_value_is_ranked(snapshot):
+    assert keys(snapshot, 'ORDER BY status DESC') == ['AAP-1', 'AAH-3', 'AAP-2', 'AAH-4']
+
+    snapshot.jdbw.rows.append(issue(5, state='Backlog', updated=5))
+    snapshot.invalidate()
+    assert keys(snapshot, 'ORDER BY status') == ['AAP-5', 'AAP-2', 'AAH-4', 'AAP-1', 'AAH-3']
+
+
+@pytest.mark.parametrize(
+    "test_input",
+    [
+        'summary ~ number',
+        'created > startOfMonth()',
+        'labels ~ gal',
+        'description = x',
+        # text outside the dictionaries sorts by the database collation
+        'ORDER BY key DESC',
+        'ORDER BY summary',
+    ]
+)
+def test_unsupported(snapshot, test_input):
+    with pytest.raises(UnsupportedQuery):
+        snapshot.select(parse(test_input), ['key'])
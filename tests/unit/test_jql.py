@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+
+import json
+import os
+
+import pytest
+
+from lib.field_registry import FieldRegistry
+from lib.jql import And
+from lib.jql import Clause
+from lib.jql import Function
+from lib.jql import JQLError
+from lib.jql import Not
+from lib.jql import Or
+from lib.jql import SortKey
+from lib.jql import normalize_query
+from lib.jql import parse
+from lib.jql import query_cache_clear
+from lib.jql import query_cache_stats
+from lib.jql import query_compile
+
+
+@pytest.fixture
+def fields(tmp_path):
+    fn = tmp_path / 'fields.json'
+    fn.write_text(json.dumps([
+        {'id': 'customfield_12313140', 'name': 'Parent Link', 'clauseNames': ['cf[12313140]']},
+        {'id': 'customfield_99', 'name': 'Team', 'clauseNames': ['cf[99]', 'Team']},
+    ]))
+    return FieldRegistry(filename=str(fn))
+
+
+def where(query, fields=None):
+    sql, params = query_compile(query, cols=['key'], fields=fields)
+    prefix = 'SELECT key FROM jira_issues'
+    assert sql.startswith(prefix)
+    return sql[len(prefix):].strip(), params
+
+
+def test_parse_precedence():
+    query = parse('project = AAP and not status = Closed or labels in (a, "b c")')
+    assert query.where == Or([
+        And([Clause('project', '=', 'AAP'), Not(Clause('status', '=', 'Closed'))]),
+        Clause('labels', 'in', ['a', 'b c']),
+    ])
+
+
+def test_parse_implicit_and_and_order_by():
+    query = parse('jql_scheme=2 project=AAP (type=Bug OR type=Epic) ORDER BY updated DESC, key')
+    assert query.where == And([
+        Clause('project', '=', 'AAP'),
+        Or([Clause('type', '=', 'Bug'), Clause('type', '=', 'Epic')]),
+    ])
+    assert query.order_by == [SortKey('updated', 'DESC'), SortKey('key', 'ASC')]
+
+
+def test_normalize_keeps_string_contents():
+    query = parse('summary ~ "a  b" AND description = \'jql_scheme=2\'  AND summary = "say \\"hi\\"  "')
+    assert query.where.items == [
+        Clause('summary', '~', 'a  b'),
+        Clause('description', '=', 'jql_scheme=2'),
+        Clause('summary', '=', 'say "hi"  '),
+    ]
+    assert normalize_query(' project=AAP\n AND  summary ~ "x\ty"') == 'project=AAP AND summary ~ "x\ty"'
+
+    query_cache_clear()
+    assert query_compile('summary = "a  b"', cols=['key'])[1] == ['a  b']
+    assert query_compile('summary  = "a b"', cols=['key'])[1] == ['a b']
+
+
+def test_parse_values():
+    query = parse('summary ~ "AND (or)" AND created > startOfWeek(-1w) AND assignee = EMPTY')
+    assert query.where.items == [
+        Clause('summary', '~', 'AND (or)'),
+        Clause('created', '>', Function('startOfWeek', ['-1w'])),
+        Clause('assignee', 'is', None),
+    ]
+
+
+@pytest.mark.parametrize(
+    "test_input",
+    [
+        'project =',
+        'project = AAP AND',
+        '(project = AAP',
+        'project AAP',
+        'labels in ()',
+        'created > -1d ORDER updated',
+        'project = "AAP',
+        'project = AAP LIMIT 0',
+        'project = AAP ORDER BY key LIMIT x',
+        'project = AAP ORDER BY key sideways',
+    ]
+)
+def test_parse_errors(test_input):
+    with pytest.raises(JQLError):
+        parse(test_input)
+
+
+@pytest.mark.parametrize(
+    "test_input,expected",
+    [
+        ('', ('', [])),
+        ('project = AAP', ('WHERE project = %s', ['AAP'])),
+        ("status != 'Closed'", ('WHERE state != %s', ['Closed'])),
+        ('key in (AAP-1, AAP-2)', ('WHERE key = ANY(%s)', [['AAP-1', 'AAP-2']])),
+        ('project not in (AAP)', ('WHERE project <> ALL(%s)', [['AAP']])),
+        ('assignee is not empty', ('WHERE assigned_to IS NOT NULL', [])),
+        ('summary ~ "100%"', ('WHERE summary ILIKE %s', [r'%100\%%'])),
+        ('created >= "2023-01-01"', ('WHERE created >= %s::timestamp', ['2023-01-01'])),
+        ('sfdc_count > 2', ('WHERE sfdc_count > %s::numeric', ['2'])),
+        ('project = AAP ORDER BY created', ('WHERE project = %s ORDER BY created ASC', ['AAP'])),
+        (
+            'updated > -30d',
+            ("WHERE updated > (now() AT TIME ZONE 'UTC') + %s::interval", ['-30 days'])
+        ),
+        (
+            'project = "x\' OR 1=1 --"',
+            ('WHERE project = %s', ["x' OR 1=1 --"])
+        ),
+    ]
+)
+def test_compile(test_input, expected):
+    assert where(test_input) == expected
+
+
+def test_compile_multi_valued():
+    sql, params = where('labels = a AND component != b')
+    assert sql == (
+        'WHERE EXISTS (SELECT 1 FROM issue_labels WHERE issue_labels.issue_id = jira_issues.id AND label = %s)'
+        ' AND NOT EXISTS (SELECT 1 FROM issue_components'
+        ' WHERE issue_components.issue_id = jira_issues.id AND component = %s)'
+    )
+    assert params == ['a', 'b']
+
+
+def test_compile_registry_fields(fields):
+    assert where('"Parent Link" = AAP-1', fields) == ('WHERE parent_link = %s', ['AAP-1'])
+    assert where('Team = x ORDER BY team', fields) == (
+        "WHERE data->'fields'->>%s = %s ORDER BY data->'fields'->>%s ASC",
+        ['customfield_99', 'x', 'customfield_99']
+    )
+    with pytest.raises(JQLError):
+        where('nope = 1', fields)
+
+
+def test_compile_functions():
+    sql, params = where('created < endOfMonth() AND updated > now()')
+    assert sql == (
+        "WHERE created < (date_trunc('month', (now() AT TIME ZONE 'UTC'))"
+        " + interval '1 month' - interval '1 microsecond')"
+        " AND updated > (now() AT TIME ZONE 'UTC')"
+    )
+    assert params == []
+
+    with pytest.raises(JQLError):
+        where('created > membersOf(x)')
+    with pytest.raises(JQLError):
+        where('project = now()')
+
+
+def test_compile_rejects_unsupported():
+    with pytest.raises(JQLError):
+        where('labels > a')
+    with pytest.raises(JQLError):
+        where('project = AAP ORDER BY labels')
+
+
+def test_query_cache():
+    query_cache_clear()
+    sql, params = query_compile('project = AAP  AND status != Closed', cols=['key'])
+    params.append(10)
+    assert query_compile(' project = AAP AND status != Closed', cols=['key']) == (sql, ['AAP', 'Closed'])
+    query_compile('project = AAP AND status != Closed', cols=['key', 'id'])
+
+    stats = query_cache_stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 2
+    assert stats['entries'] == 2
+
+    with pytest.raises(JQLError):
+        query_compile('project =')
+    assert query_cache_stats()['entries'] == 2
+
+
+def test_query_cache_follows_field_reload(fields):
+    fields.check_interval = 0
+    assert where('Team = x', fields)[1] == ['customfield_99', 'x']
+
+    fn = fields.filename
+    with open(fn, 'w') as f:
+        f.write(json.dumps([{'id': 'customfield_100', 'name': 'Team', 'clauseNames': ['Team']}]))
+    mtime = os.stat(fn).st_mtime + 10
+    os.utime(fn, (mtime, mtime))
+
+    assert where('Team = x', fields)[1] == ['customfield_100', 'x']
+
+
+def test_compile_text_search():
+    sql, params = where('project = AAP AND text ~ "galaxy import timeout"')
+    assert sql == (
+        "WHERE project = %s AND search_vector @@ websearch_to_tsquery('english', %s)"
+        " ORDER BY ts_rank(search_vector, websearch_to_tsquery('english', %s)) DESC"
+    )
+    assert params == ['AAP', 'galaxy import timeout', 'galaxy import timeout']
+
+    sql, params = where('text !~ flaky ORDER BY updated DESC')
+    assert sql == "WHERE NOT search_vector @@ websearch_to_tsquery('english', %s) ORDER BY updated DESC"
+    assert params == ['flaky']
+
+    with pytest.raises(JQLError):
+        where('text = galaxy')
+    with pytest.raises(JQLError):
+        where('project = AAP ORDER BY text')
+
+
+def test_compile_order_by_and_limit():
+    sql, params = where('project = AAP ORDER BY updated DESC LIMIT 10')
+    assert sql == 'WHERE project = %s ORDER BY updated DESC LIMIT %s'
+    assert params == ['AAP', 10]
+
+    # the smaller of the query's and the caller's limit wins
+    sql, params = query_compile('project = AAP LIMIT 10', cols=['key'], limit=5)
+    assert sql.endswith('WHERE project = %s LIMIT %s')
+    assert params == ['AAP', 5]
+
+    # the caller's order only applies when the query has none
+    sql, params = query_compile('project = AAP', cols=['key'], order_by=[('number', 'DESC')])
+    assert sql.endswith('ORDER BY number DESC')
+    sql, params = query_compile('ORDER BY key', cols=['key'], order_by=[('number', 'DESC')])
+    assert sql.endswith('ORDER BY key ASC')
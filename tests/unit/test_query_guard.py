@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+
+import pytest
+
+from lib.query_guard import DEFAULT_ROW_LIMIT
+from lib.query_guard import DOWNGRADED_ROW_LIMIT
+from lib.query_guard import MAX_QUERY_COST
+from lib.query_guard import MAX_ROW_LIMIT
+from lib.query_guard import QueryRejected
+from lib.query_guard import check_cost
+from lib.query_guard import row_limit
+
+
+def plan(cost, rows=100):
+    return [{'Plan': {'Node Type': 'Seq Scan', 'Total Cost': cost, 'Plan Rows': rows}}]
+
+
+@pytest.mark.parametrize(
+    "test_input,expected",
+    [
+        ({}, DEFAULT_ROW_LIMIT),
+        ({'limit': ''}, DEFAULT_ROW_LIMIT),
+        ({'limit': '20'}, 20),
+        ({'limit': 20}, 20),
+        ({'limit': str(MAX_ROW_LIMIT)}, MAX_ROW_LIMIT),
+    ]
+)
+def test_row_limit(test_input, expected):
+    assert row_limit(test_input) == expected
+
+
+@pytest.mark.parametrize("test_input", ['x', '0', '-1', str(MAX_ROW_LIMIT + 1)])
+def test_row_limit_rejected(test_input):
+    with pytest.raises(QueryRejected) as exc:
+        row_limit({'limit': test_input})
+    assert exc.value.status == 400
+
+
+def test_check_cost():
+    assert check_cost(plan(1000.0), 5000) == 5000
+    assert check_cost(plan(MAX_QUERY_COST - 1), 5000) == DOWNGRADED_ROW_LIMIT
+    assert check_cost(plan(MAX_QUERY_COST - 1), 10) == 10
+    with pytest.raises(QueryRejected):
+        check_cost(plan(MAX_QUERY_COST + 1), 10)
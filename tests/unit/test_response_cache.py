@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+import pytest
+
+from lib.response_cache import ALL_PROJECTS
+from lib.response_cache import ResponseCache
+from lib.response_cache import make_etag
+from lib.response_cache import make_key
+from lib.response_cache import normalize_args
+from lib.response_cache import version_key
+
+
+class MultiDict(dict):
+    # the bits of werkzeug's MultiDict that normalize_args uses
+    def __init__(self, items):
+        super().__init__()
+        for key, value in items:
+            self.setdefault(key, []).append(value)
+
+    def getlist(self, key):
+        return self[key]
+
+
+@pytest.mark.parametrize(
+    "test_input,expected",
+    [
+        ({}, ()),
+        ({'project': 'AAH'}, (('project', ('AAH',)),)),
+        ({'project': ['AAP', 'AAH'], 'end': ''}, (('project', ('AAH', 'AAP')),)),
+        (
+            MultiDict([('project', 'AAP'), ('frequency', 'weekly'), ('project', 'AAH')]),
+            (('frequency', ('weekly',)), ('project', ('AAH', 'AAP'))),
+        ),
+    ]
+)
+def test_normalize_args(test_input, expected):
+    assert normalize_args(test_input) == expected
+
+
+def test_version_key():
+    versions = {'AAH': 3, 'AAP': 5}
+    assert version_key(versions, projects=['AAP', 'AAH', 'AAP']) == (('AAH', 3), ('AAP', 5))
+    assert version_key(versions, projects=['NEW']) == (('NEW', 0),)
+    assert version_key(versions) == ((ALL_PROJECTS, 8),)
+
+
+def test_key_changes_with_version():
+    args = {'project': 'AAH'}
+    key1 = make_key('/api/tickets_burndown', args, {'AAH': 1, 'AAP': 1}, projects=['AAH'])
+    key2 = make_key('/api/tickets_burndown', args, {'AAH': 1, 'AAP': 2}, projects=['AAH'])
+    key3 = make_key('/api/tickets_burndown', args, {'AAH': 2, 'AAP': 2}, projects=['AAH'])
+    assert key1 == key2
+    assert key1 != key3
+    assert make_etag(key1) == make_etag(key2)
+    assert make_etag(key1) != make_etag(key3)
+
+
+def test_cache_get_put():
+    rc = ResponseCache(max_bytes=1024)
+    assert rc.get('a') is None
+    entry = rc.put('a', b'{}', projects=['AAH'])
+    assert entry.etag == make_etag('a')
+    assert rc.get('a').body == b'{}'
+    assert rc.stats()['hits'] == 1
+    assert rc.stats()['misses'] == 1
+
+
+def test_cache_evicts_least_recently_used():
+    rc = ResponseCache(max_bytes=100)
+    rc.put('a', b'x' * 40)
+    rc.put('b', b'x' * 40)
+    rc.get('a')
+    rc.put('c', b'x' * 40)
+    assert rc.get('b') is None
+    assert rc.get('a') is not None
+    assert rc.get('c') is not None
+    assert rc.size <= 100
+
+
+def test_cache_skips_oversized_bodies():
+    rc = ResponseCache(max_bytes=10)
+    entry = rc.put('a', b'x' * 100)
+    assert entry.body == b'x' * 100
+    assert len(rc) == 0
+    assert rc.size == 0
+
+
+def test_cache_invalidate_projects():
+    rc = ResponseCache(max_bytes=1024)
+    rc.put('aah', b'{}', projects=['AAH'])
+    rc.put('aap', b'{}', projects=['AAP'])
+    rc.put('both', b'{}', projects=['AAH', 'AAP'])
+    rc.put('all', b'{}')
+    rc.invalidate(['AAH'])
+    assert rc.get('aah') is None
+    assert rc.get('both') is None
+    assert rc.get('all') is None
+    assert rc.get('aap') is not None
+    assert rc.size == len(b'{}') + len(repr('aap'))
+
+
+def test_cache_invalidate_everything():
+    rc = ResponseCache(max_bytes=1024)
+    rc.put('aah', b'{}', projects=['AAH'])
+    rc.put('all', b'{}')
+    rc.invalidate()
+    assert len(rc) == 0
+    assert rc.size == 0
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+import random
+from collections import defaultdict
+
+import pytest
+
+pd = pytest.importorskip('pandas')
+
+from lib.version_counts import monthly_version_counts  # noqa: E402
+
+
+def replay(events):
+    """The event by event replay that fix_versions_burndown used to run."""
+    events = sorted(events, key=lambda x: x[0])
+    version_dict = defaultdict(lambda: defaultdict(int))
+    current_versions = {}
+    for ts in sorted(set(x[0] for x in events)):
+        for event_ts, key, version in events:
+            if event_ts == ts:
+                if version is not None:
+                    current_versions[key] = version
+                elif key in current_versions:
+                    del current_versions[key]
+        for key, version in current_versions.items():
+            version_dict[ts][version] += 1
+
+    df = pd.DataFrame.from_dict(version_dict, orient='index').fillna(0).sort_index()
+    df = df.sort_index(axis=1)
+    df.index = pd.to_datetime(df.index)
+    return df.resample('ME').last()
+
+
+def counts(events):
+    return monthly_version_counts([x[0] for x in events], [x[1] for x in events], [x[2] for x in events])
+
+
+def test_monthly_version_counts():
+    events = [
+        ('2023-01-05T10:00:00', 'AAP-1', '2.4'),
+        ('2023-01-05T10:00:00', 'AAP-2', '2.4'),
+        ('2023-01-20T10:00:00', 'AAP-1', '2.5'),
+        ('2023-03-02T10:00:00', 'AAP-2', None),
+        ('2023-03-02T10:00:00', 'AAP-2', '2.5'),
+        ('2023-03-09T10:00:00', 'AAP-1', None),
+    ]
+    df = counts(events)
+    assert list(df.columns) == ['2.4', '2.5']
+    assert df['2.4'].tolist()[0::2] == [1.0, 0.0]
+    assert df['2.5'].tolist()[0::2] == [1, 1]
+    assert df.iloc[1].isna().all()
+    assert df.to_json(date_format='iso') == replay(events).to_json(date_format='iso')
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_monthly_version_counts_matches_replay(seed):
+    rng = random.Random(seed)
+    keys = [f'AAP-{x}' for x in range(rng.randint(1, 15))]
+    versions = ['1.0', '2.0', '2.1', 'ux', None]
+    events = []
+    for _ in range(rng.randint(1, 80)):
+        ts = f'2023-{rng.randint(1, 12):02d}-{rng.randint(1, 3):02d}T00:00:00'
+        events.append((ts, rng.choice(keys), rng.choice(versions)))
+
+    pd.testing.assert_frame_equal(counts(events), replay(events), check_freq=False)
+
+
+@pytest.mark.parametrize("events", [[], [('2023-01-01T00:00:00', 'AAP-1', None)]])
+def test_monthly_version_counts_empty(events):
+    pd.testing.assert_frame_equal(counts(events), replay(events), check_freq=False)